@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# asyncio counterpart of RabbitMQ, for polling many RabbitMQ management endpoints and
+# resource types concurrently from one event loop.
+#
+# each AsyncRabbitMQ wraps a pooled RabbitMQ client and runs its blocking HTTP calls on a
+# small per-endpoint thread pool, so no extra http library is needed. a per-endpoint semaphore
+# bounds the number of in-flight requests and each call has its own timeout, so a slow
+# endpoint only delays its own results.
+#
+# example usage:
+#   async def main():
+#       clients = [AsyncRabbitMQ(endpoint, "guest", "guest") for endpoint in endpoints]
+#       await asyncio.gather(*[c.poll_forever("queues", 10, print_queues) for c in clients])
+#   asyncio.run(main())
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rabbitmq.RabbitMQ import RabbitMQ
+
+
+class AsyncRabbitMQ:
+
+    # resource name to the RabbitMQ method that fetches it
+    _resource_getters = {
+        "queues": "get_queues",
+        "connections": "get_connections",
+        "queue_snapshot": "get_queue_snapshot",
+        "connection_snapshot": "get_connection_snapshot",
+    }
+
+    def __init__(self, api_endpoint, username, passwd, max_concurrency=2, timeout=30.0, **kwargs):
+        """
+        @param max_concurrency: max number of in-flight requests to this endpoint.
+        @param timeout: seconds before a call to this endpoint is abandoned with asyncio.TimeoutError.
+            also the client's deadline for its retries and failover, unless deadline is passed in kwargs.
+        @param kwargs: passed on to RabbitMQ(), e.g. connect_timeout, read_timeout, deadline, verify.
+        """
+        kwargs.setdefault("pool_maxsize", max_concurrency)
+        # an abandoned call must not keep its worker thread retrying past the timeout, or later calls queue behind it
+        kwargs.setdefault("deadline", timeout)
+        self._rbmq = RabbitMQ(api_endpoint, username, passwd, **kwargs)
+        self._api_endpoint = api_endpoint if isinstance(api_endpoint, str) else ",".join(api_endpoint)
+        self._max_concurrency = max_concurrency
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="rabbitmq")
+        # created lazily so that it binds to the running event loop
+        self._semaphore = None
+
+
+    @property
+    def api_endpoint(self):
+        return self._api_endpoint
+
+
+    @property
+    def client(self):
+        """
+        @return: the underlying blocking RabbitMQ client
+        """
+        return self._rbmq
+
+
+    def close(self):
+        """
+        closes the pooled connections and the worker threads.
+        """
+        self._executor.shutdown(wait=False)
+        self._rbmq.close()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    async def _call(self, method_name, *args, **kwargs):
+        """
+        runs a RabbitMQ method on the endpoint's thread pool, bounded by the endpoint's
+        concurrency limit and timeout.
+        note that on timeout the worker thread is not interrupted. it stops retrying at the client's deadline
+        (by default the same as the timeout), and reading a streamed body is bounded by the client's read_timeout per read.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        loop = asyncio.get_running_loop()
+        func = functools.partial(getattr(self._rbmq, method_name), *args, **kwargs)
+        async with self._semaphore:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, func), self._timeout)
+
+
+    async def get_queues(self, queue_name='', **kwargs):
+        """
+        Queries RabbitMQ's REST API to get list of queues. see RabbitMQ.get_queues()
+        @return: list of dicts
+        """
+        return await self._call("get_queues", queue_name, **kwargs)
+
+
+    async def get_connections(self, connection_name='', **kwargs):
+        """
+        Queries RabbitMQ's REST API to get list of connections. see RabbitMQ.get_connections()
+        @return: list of dicts
+        """
+        return await self._call("get_connections", connection_name, **kwargs)
+
+
+    async def get_queue_snapshot(self, queue_name='', **kwargs):
+        """
+        @return: QueueSnapshot. see RabbitMQ.get_queue_snapshot()
+        """
+        return await self._call("get_queue_snapshot", queue_name, **kwargs)
+
+
+    async def get_connection_snapshot(self, connection_name='', **kwargs):
+        """
+        @return: ConnectionSnapshot. see RabbitMQ.get_connection_snapshot()
+        """
+        return await self._call("get_connection_snapshot", connection_name, **kwargs)
+
+
+    async def get(self, resource, **kwargs):
+        """
+        fetches a resource by name: "queues", "connections", "queue_snapshot" or "connection_snapshot".
+        """
+        if resource not in AsyncRabbitMQ._resource_getters:
+            raise ValueError("unknown resource {}. choose from {}".format(resource, sorted(AsyncRabbitMQ._resource_getters)))
+        return await self._call(AsyncRabbitMQ._resource_getters[resource], **kwargs)
+
+
+    async def poll_forever(self, resource, interval, callback, **kwargs):
+        """
+        polls a resource every interval seconds and calls callback(client, resource, result) with each result.
+        errors and timeouts are logged and the polling continues, so one bad endpoint does not stop the others.
+        """
+        while True:
+            started = time.monotonic()
+            try:
+                result = await self.get(resource, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error( "polling {} from {} failed: {!r}".format(resource, self._api_endpoint, e) )
+            else:
+                callback(self, resource, result)
+
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(max(interval - elapsed, 0))
+        # end while
+
+
+    @staticmethod
+    async def poll_all(clients, resources=("queues", "connections"), **kwargs):
+        """
+        fetches each resource from each client concurrently.
+        @return: dict {(api_endpoint, resource): result or exception}
+        """
+        keys = []
+        calls = []
+        for client in clients:
+            for resource in resources:
+                keys.append((client.api_endpoint, resource))
+                calls.append(client.get(resource, **kwargs))
+            # end for
+        # end for
+
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        return dict(zip(keys, results))
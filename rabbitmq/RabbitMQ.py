@@ -25,7 +25,49 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
 
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os
 import json
+import time
+import codecs
+from urllib.parse import quote, unquote
+
+from rabbitmq.records import QueueRecord, ConnectionRecord, QueueSnapshot, ConnectionSnapshot
+from rabbitmq.resilience import Deadline, CircuitBreaker, backoff_delays
+from rabbitmq.messages import MoveStats, message_origin, republish_body
+from rabbitmq.snapshot import SnapshotClient
+from rabbitmq.instrumentation import PhaseStats
+
+# json decoders selectable with RabbitMQ(json_backend=...). orjson and ujson are optional and only
+# available if installed.
+_json_backends = {"json": json.loads}
+try:
+    import orjson
+    _json_backends["orjson"] = orjson.loads
+except ImportError:
+    pass
+try:
+    import ujson
+    _json_backends["ujson"] = ujson.loads
+except ImportError:
+    pass
+
+class RabbitMQError(Exception):
+    """
+    error response from the management API, e.g. http 401 or 404. not retried.
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RabbitMQUnavailable(RabbitMQError):
+    """
+    no endpoint answered within the retries and deadline, e.g. while the cluster nodes restart.
+    """
+
 
 class RabbitMQ:
 
@@ -33,35 +75,611 @@ class RabbitMQ:
     # many URIs require the name of a virtual host as part of the path, since names only uniquely identify objects within a virtual host. As the default virtual host is called "/", this will need to be encoded as "%2f".
     _api_queues_path = '/api/queues/%2F/'
     _api_connections_path = '/api/connections/'
+    _api_overview_path = '/api/overview'
+    _api_nodes_path = '/api/nodes/'
+    _api_channels_path = '/api/channels/'
+    _api_consumers_path = '/api/consumers/'
+
+    # responses retried on another endpoint or after a backoff, e.g. from a proxy in front of a restarting node
+    _retry_status_codes = (502, 503, 504)
+
+    # shortest connect and read timeouts of a request, so that a deadline about to expire never gives requests a zero timeout
+    _min_timeout = 0.01
+
+    # management API options for a cheap queue listing: skip the per-queue message rate and
+    # garbage collection stats, but still return the queue totals (messages_ready, messages_unacknowledged).
+    _lightweight_params = {"disable_stats": "true", "enable_queue_totals": "true"}
+
+    # default number of items per page for the paged iterators. the management API caps page_size at 500.
+    _default_page_size = 500
+
+    # number of bytes read from the socket at a time by the streaming iterators.
+    _default_chunk_size = 65536
+
+    # minimal set of columns needed by queue_to_tuple() and connection_to_tuple().
+    # nested fields use the management API's dotted column syntax.
+    QUEUE_TUPLE_COLUMNS = ('name', 'state', 'messages_ready', 'messages_unacknowledged')
+    CONNECTION_TUPLE_COLUMNS = ('name', 'state', 'send_oct_details.rate', 'recv_oct_details.rate')
+
+    # minimal set of overview columns needed by overview_queue_totals().
+    OVERVIEW_TOTALS_COLUMNS = ('queue_totals.messages', 'queue_totals.messages_ready',
+                               'queue_totals.messages_unacknowledged', 'object_totals.queues')
+
+    # minimal set of columns needed by node_to_tuple() and overview_to_tuple().
+    NODE_TUPLE_COLUMNS = ('name', 'running', 'mem_used', 'mem_limit', 'mem_alarm', 'fd_used', 'fd_total',
+                          'sockets_used', 'sockets_total', 'proc_used', 'proc_total',
+                          'disk_free', 'disk_free_limit', 'disk_free_alarm')
+    OVERVIEW_TUPLE_COLUMNS = ('cluster_name', 'message_stats.publish_details.rate', 'message_stats.deliver_get_details.rate',
+                              'message_stats.ack_details.rate', 'queue_totals.messages_ready', 'queue_totals.messages_unacknowledged',
+                              'object_totals.connections', 'object_totals.consumers', 'object_totals.queues')
 
-    def __init__(self, api_endpoint, username, passwd):
+    def __init__(self, api_endpoint, username, passwd,
+                 pool_connections=4, pool_maxsize=4,
+                 connect_timeout=5.0, read_timeout=30.0,
+                 max_retries=2, backoff_factor=0.5, backoff_max=10.0,
+                 deadline=60.0, hedge_delay=None,
+                 failure_threshold=3, reset_timeout=30.0,
+                 verify=False, cert=None, json_backend="json", snapshot_socket=None):
+        """
+        @param api_endpoint: management API endpoint, or a list (or comma-separated string) of the endpoints of each cluster node.
+            calls go to the last endpoint that answered, and fail over to the others in order.
+        @param pool_connections: number of per-host connection pools to cache.
+        @param pool_maxsize: max number of keep-alive connections kept per host pool.
+        @param connect_timeout: seconds to wait for the TCP/TLS connection to be established.
+        @param read_timeout: seconds to wait between bytes of the response.
+        @param max_retries: number of times to retry all endpoints after connection errors, timeouts and 502/503/504 responses.
+        @param backoff_factor: base of the jittered exponential backoff between retries, in seconds.
+        @param backoff_max: longest backoff between retries, in seconds.
+        @param deadline: seconds a call may take, across all of its retries and failovers. None for no deadline.
+        @param hedge_delay: (optional) seconds to wait for an endpoint before sending the same request to the next endpoint too.
+            the first response wins. if not specified, endpoints are only tried one after another.
+        @param failure_threshold: consecutive failures after which an endpoint is skipped for reset_timeout seconds.
+        @param reset_timeout: seconds an endpoint is skipped after failure_threshold consecutive failures.
+        @param verify: TLS verification. False, True, or path to a CA bundle.
+        @param cert: client TLS cert. path to a cert file, or tuple (cert, key).
+        @param json_backend: json decoder for whole responses. "json", or if installed "orjson" or "ujson".
+        @param snapshot_socket: (optional) path of the socket of a local snapshot daemon (rabbitmq.snapshot) to read queue and
+            connection listings from while it runs, instead of querying the management API. True for $RABBITMQ_SNAPSHOT_SOCKET
+            or /tmp/rabbitmq-snapshot.sock. False to always query the management API.
+            (default=$RABBITMQ_SNAPSHOT_SOCKET if set, else always query the management API)
+        """
 
         # call rabbitmq REST API
-        self._api_endpoint = api_endpoint
+        if isinstance(api_endpoint, str):
+            api_endpoint = api_endpoint.split(",")
+        self._endpoints = [e.strip() for e in api_endpoint if e.strip()]
+        if not self._endpoints:
+            raise ValueError("no api endpoint given")
+        # index of the endpoint that last answered, tried first
+        self._preferred = 0
+        self._breakers = [CircuitBreaker(e, failure_threshold, reset_timeout) for e in self._endpoints]
 
         # rabbitmq credentials
         self._http_basic_auth_credentials = (username, passwd)
 
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._max_retries = max_retries
+        self._backoff_factor = backoff_factor
+        self._backoff_max = backoff_max
+        self._deadline = deadline
+        self._hedge_delay = hedge_delay
+        self._hedge_executor = None
+
+        if json_backend not in _json_backends:
+            raise ValueError("json backend {} not available. choose from {}".format(json_backend, sorted(_json_backends)))
+        self._json_loads = _json_backends[json_backend]
+
+        # one persistent session for all API calls so that keep-alive connections are
+        # reused across polls and resource types instead of a new TCP+TLS handshake per call.
+        # retries are done by _get(), across endpoints and within the deadline, so the adapter does not retry.
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+
+        self._session = requests.Session()
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        self._session.auth = self._http_basic_auth_credentials
+        # using verify=False by default just in case some rabbitmq endpoint yields OpenSSL.SSL.Error: [('SSL routines', 'tls_process_server_certificate', 'certificate verify failed')]
+        self._session.verify = verify
+        self._session.cert = cert
+
+        # timings of the http round trips and json decoding, payload bytes and record counts
+        self.stats = PhaseStats()
+
+        # shared snapshots of a local daemon, used only if it polls one of our endpoints
+        self.snapshot = None
+        if snapshot_socket is None:
+            snapshot_socket = os.environ.get("RABBITMQ_SNAPSHOT_SOCKET") or False
+        if snapshot_socket is not False:
+            self.snapshot = SnapshotClient(None if snapshot_socket is True else snapshot_socket, self._endpoints)
+
 
-    def get_queues(self, queue_name=''):
+    @property
+    def api_endpoint(self):
         """
-        Queries RabbitMQ's REST API to get list of queues.
-        @return: list of dicts
+        the endpoint that last answered.
         """
+        return self._endpoints[self._preferred]
 
-        # add specific queue if given. otherwise gets all queues.
-        url = "{}{}{}".format(self._api_endpoint, RabbitMQ._api_queues_path, queue_name)
-        logger.debug( "calling url {} with credentials {}".format(url, self._http_basic_auth_credentials) )
 
-        # using verify=False just in case some rabbitmq endpoint yields OpenSSL.SSL.Error: [('SSL routines', 'tls_process_server_certificate', 'certificate verify failed')]
-        response = requests.get(url, auth=self._http_basic_auth_credentials, verify=False)
+    @property
+    def endpoints(self):
+        return list(self._endpoints)
+
+
+    def close(self):
+        """
+        closes the pooled keep-alive connections.
+        """
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+            self._hedge_executor = None
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self._session.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def get_connection_stats(self):
+        """
+        counts how often the pooled session reused a keep-alive connection versus opened a new one.
+        @return: dict {"requests": int, "new_connections": int, "reused_connections": int}
+        """
+        num_requests = 0
+        num_connections = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+        # end for
+
+        return {
+            "requests": num_requests,
+            "new_connections": num_connections,
+            "reused_connections": max(num_requests - num_connections, 0),
+        }
+
+
+    def get_endpoint_states(self):
+        """
+        @return: dict {endpoint: circuit breaker state}, "closed" for healthy endpoints
+        """
+        return {endpoint: breaker.state for endpoint, breaker in zip(self._endpoints, self._breakers)}
+
+
+    def get_timing_stats(self):
+        """
+        @return: dict of the client's phase timings in seconds (http, read, decode) and counters
+                 (requests, retries, failed_requests, deadline_exceeded, payload_bytes, records), see rabbitmq.instrumentation.
+        """
+        return self.stats.to_dict()
+
+
+    def _attempt(self, index, path, params, stream, deadline, json_body=None):
+        """
+        issues one GET of path on one endpoint, or a POST if json_body is given.
+        @return: requests.Response
+        """
+        endpoint = self._endpoints[index]
+        breaker = self._breakers[index]
+        url = "{}{}".format(endpoint, path)
+        if deadline.expired:
+            # not the endpoint's fault, so the circuit breaker does not count it, and gets back a half-open trial slot
+            breaker.release()
+            raise RabbitMQUnavailable( "deadline exceeded before calling {}".format(url) )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug( "calling url {} with credentials {}".format(url, self._http_basic_auth_credentials) )
+
+        # requests rejects a zero timeout, which the deadline can leave when it is about to expire
+        timeout = (deadline.bound(self._connect_timeout, RabbitMQ._min_timeout),
+                   deadline.bound(self._read_timeout, RabbitMQ._min_timeout))
+        try:
+            if json_body is None:
+                response = self._session.get(url, params=params, timeout=timeout, stream=stream)
+            else:
+                response = self._session.post(url, params=params, json=json_body, timeout=timeout)
+        except requests.RequestException as e:
+            breaker.record_failure()
+            raise RabbitMQUnavailable( "{} from {}".format(e.__class__.__name__, url) )
+
+        if response.status_code in RabbitMQ._retry_status_codes:
+            breaker.record_failure()
+            response.close()
+            raise RabbitMQUnavailable( "got error http {} from {}".format(response.status_code, url), response.status_code )
+
+        # the node answered, so it is up even if the request was wrong
+        breaker.record_success()
+        self._preferred = index
 
-        # exit if error so outter scripts calling this python scripts can detect for non-zero exit code
         if response.status_code != 200:
-            logger.error( "got error http {} from {}".format(url, response.status_code) )
-            raise Exception( "got error http {} from {}".format(url, response.status_code) )
+            response.close()
+            raise RabbitMQError( "got error http {} from {}".format(response.status_code, url), response.status_code )
 
-        logger.debug( "response: {}".format(response) )
+        return response
+
+
+    @staticmethod
+    def _discard(future):
+        # closes the response of a hedged request that lost the race
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+
+    def _try_endpoints(self, path, params, stream, deadline):
+        """
+        tries each endpoint once, starting with the one that last answered.
+        with hedge_delay, the next endpoint is also tried when an endpoint takes longer than hedge_delay.
+        @return: requests.Response of the first endpoint that answered
+        """
+        n = len(self._endpoints)
+        order = [(self._preferred + i) % n for i in range(n)]
+        errors = []
+
+        if self._hedge_delay is None or n == 1:
+            for index in order:
+                if deadline.expired:
+                    errors.append("deadline exceeded")
+                    break
+                if not self._breakers[index].allow():
+                    errors.append("circuit open for {}".format(self._endpoints[index]))
+                    continue
+                try:
+                    return self._attempt(index, path, params, stream, deadline)
+                except RabbitMQUnavailable as e:
+                    errors.append(str(e))
+            # end for
+            raise RabbitMQUnavailable("; ".join(errors))
+
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=n, thread_name_prefix="hedge")
+        pending = {}
+
+        def launch():
+            while order:
+                if deadline.expired:
+                    errors.append("deadline exceeded")
+                    return
+                index = order.pop(0)
+                if self._breakers[index].allow():
+                    pending[self._hedge_executor.submit(self._attempt, index, path, params, stream, deadline)] = index
+                    return
+                errors.append("circuit open for {}".format(self._endpoints[index]))
+            # end while
+
+        launch()
+        try:
+            while pending:
+                done, not_done = wait(pending, timeout=deadline.bound(self._hedge_delay if order else None), return_when=FIRST_COMPLETED)
+                if not done:
+                    if deadline.expired:
+                        errors.append("deadline exceeded")
+                        break
+                    # slow endpoint: hedge with the next one
+                    launch()
+                    continue
+                for future in done:
+                    del pending[future]
+                    try:
+                        return future.result()
+                    except RabbitMQUnavailable as e:
+                        errors.append(str(e))
+                        # fail over right away rather than after the hedge delay
+                        launch()
+                # end for
+            # end while
+        finally:
+            for future in pending:
+                future.add_done_callback(RabbitMQ._discard)
+        raise RabbitMQUnavailable("; ".join(errors))
+
+
+    def _get(self, path, params=None, stream=False):
+        """
+        issues a GET of an API path, failing over between the endpoints, and retrying with jittered
+        exponential backoff, all within the deadline.
+        @return: requests.Response
+        """
+        started = time.perf_counter()
+        deadline = Deadline(self._deadline)
+        delays = backoff_delays(self._max_retries, self._backoff_factor, self._backoff_max)
+        while True:
+            try:
+                response = self._try_endpoints(path, params, stream, deadline)
+                break
+            except RabbitMQUnavailable as e:
+                # no point in waiting if every endpoint is skipped until its reset_timeout
+                all_open = all(b.state == CircuitBreaker.OPEN for b in self._breakers)
+                delay = None if all_open else next(delays, None)
+                # exit if error so outter scripts calling this python scripts can detect for non-zero exit code
+                if delay is None or deadline.expired:
+                    logger.error( "giving up on {}: {}".format(path, e) )
+                    self.stats.count("failed_requests")
+                    if deadline.expired:
+                        self.stats.count("deadline_exceeded")
+                    raise
+                delay = deadline.bound(delay)
+                logger.warning( "{}. retrying in {:.2f}s".format(e, delay) )
+                self.stats.count("retries")
+                time.sleep(delay)
+        # end while
+        self.stats.record("http", time.perf_counter() - started)
+        self.stats.count("requests")
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug( "response: {}".format(response) )
+
+        return response
+
+
+    def _post(self, path, json_body):
+        """
+        issues a POST of an API path on the endpoint that last answered, and decodes the response.
+        not retried nor failed over, since the message operations are not idempotent.
+        @return: decoded json response
+        """
+        index = self._preferred
+        if not self._breakers[index].allow():
+            raise RabbitMQUnavailable( "circuit open for {}".format(self._endpoints[index]) )
+        response = self._attempt(index, path, None, False, Deadline(self._deadline), json_body)
+        return self._decode(response)
+
+
+    @staticmethod
+    def _query_params(columns=None, name=None, use_regex=False, page=None, page_size=None, lightweight=False):
+        """
+        builds the management API query string options.
+        @return: dict of query params
+        """
+        params = dict(RabbitMQ._lightweight_params) if lightweight else {}
+        if columns:
+            params["columns"] = ",".join(columns)
+        if name:
+            params["name"] = name
+            if use_regex:
+                params["use_regex"] = "true"
+        if page is not None:
+            params["page"] = page
+            params["page_size"] = page_size or RabbitMQ._default_page_size
+        return params
+
+
+    def _decode(self, response):
+        """
+        decodes a whole json response body, recording the decode time, payload bytes and number of records.
+        """
+        content = response.content
+        started = time.perf_counter()
+        result = self._json_loads(content)
+        self.stats.record("decode", time.perf_counter() - started)
+        self.stats.count("payload_bytes", len(content))
+        if isinstance(result, list):
+            self.stats.count("records", len(result))
+        elif isinstance(result, dict):
+            self.stats.count("records", len(result["items"]) if isinstance(result.get("items"), list) else 1)
+        return result
+
+
+    def _iter_pages(self, path, columns=None, name=None, use_regex=False, page_size=None, lightweight=False):
+        """
+        walks the pages of a management API listing.
+        note that the name and use_regex filters are only honored by the management API on paged requests.
+        @return: generator of dicts
+        """
+        page = 1
+        while True:
+            params = RabbitMQ._query_params(columns, name, use_regex, page, page_size, lightweight)
+            response = self._get(path, params=params)
+
+            # paged response is of the form:
+            # {"filtered_count": 2, "item_count": 2, "items": [...], "page": 1, "page_count": 1, "page_size": 500, "total_count": 30}
+            result = self._decode(response)
+            for item in result["items"]:
+                yield item
+            # end for
+
+            if page >= result.get("page_count", 0):
+                break
+            page += 1
+        # end while
+
+
+    @staticmethod
+    def _iter_json_array(response, chunk_size=None, stats=None):
+        """
+        incrementally decodes a streamed json array response body, one element at a time,
+        so that memory stays bounded by the largest element rather than the whole payload.
+        a json object body (e.g. when a specific name is queried) is yielded as a single element.
+        @param stats: (optional) PhaseStats to record the read and decode times, payload bytes and records in.
+        @return: generator of decoded elements
+        """
+        decoder = json.JSONDecoder()
+        utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        chunks = response.iter_content(chunk_size=chunk_size or RabbitMQ._default_chunk_size)
+
+        buf = ""
+        pos = 0
+        eof = False
+        in_array = False
+
+        # time spent in this generator rather than in its consumer, and the part of it spent reading the socket
+        clock = time.perf_counter
+        counts = {"busy": 0.0, "read": 0.0, "bytes": 0, "records": 0}
+        resumed = clock()
+
+        def _fill(buf, pos):
+            # drop consumed text, then append the next chunk. returns (buf, pos, eof)
+            started = clock()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return buf[pos:] + utf8_decoder.decode(b"", final=True), 0, True
+            except requests.RequestException as e:
+                # e.g. the node restarted mid-response
+                raise RabbitMQUnavailable( "{} while reading {}".format(e.__class__.__name__, response.url) )
+            finally:
+                counts["read"] += clock() - started
+            counts["bytes"] += len(chunk)
+            return buf[pos:] + utf8_decoder.decode(chunk), 0, False
+
+        try:
+            while True:
+                # skip whitespace and element separators
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if pos >= len(buf):
+                    if eof:
+                        if in_array:
+                            raise ValueError("truncated json array in response")
+                        return
+                    buf, pos, eof = _fill(buf, pos)
+                    continue
+
+                if not in_array:
+                    if buf[pos] == "[":
+                        in_array = True
+                        pos += 1
+                        continue
+                    # not an array. e.g. a single queue dict, so decode as one element.
+                    while not eof:
+                        buf, pos, eof = _fill(buf, pos)
+                    element = decoder.raw_decode(buf, pos)[0]
+                    counts["records"] += 1
+                    counts["busy"] += clock() - resumed
+                    yield element
+                    resumed = clock()
+                    return
+
+                if buf[pos] == "]":
+                    return
+
+                try:
+                    element, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # element spans past the end of the buffer, so read more
+                    if eof:
+                        raise
+                    buf, pos, eof = _fill(buf, pos)
+                    continue
+                pos = end
+                counts["records"] += 1
+                counts["busy"] += clock() - resumed
+                yield element
+                resumed = clock()
+            # end while
+        finally:
+            response.close()
+            if stats is not None:
+                counts["busy"] += clock() - resumed
+                stats.record("read", counts["read"])
+                stats.record("decode", counts["busy"] - counts["read"])
+                stats.count("payload_bytes", counts["bytes"])
+                stats.count("records", counts["records"])
+
+
+    def _from_snapshot(self, resource, item_name='', columns=None, name=None, use_regex=False):
+        """
+        reads a listing from the local snapshot daemon, if one is running and can serve it.
+        @return: list of dicts, or None to query the management API
+        """
+        if self.snapshot is None:
+            return None
+        return self.snapshot.select(resource, unquote(item_name), columns, name, use_regex)
+
+
+    def iter_queues(self, queue_name='', columns=None, chunk_size=None, lightweight=False):
+        """
+        Queries RabbitMQ's REST API and streams the queues, decoding the response one queue at a time.
+        time-to-first-record and peak memory do not grow with the number of queues on the broker.
+        @param columns: (optional) list of fields to return. if not specified, all fields are returned.
+        @param chunk_size: (optional) number of bytes to read from the socket at a time. (default=65536)
+        @param lightweight: (optional) ask the broker to skip per-queue stats, keeping only the message totals.
+        @return: generator of dicts
+        """
+        items = self._from_snapshot("queues", queue_name, columns)
+        if items is not None:
+            return iter(items)
+        path = "{}{}".format(RabbitMQ._api_queues_path, queue_name)
+        response = self._get(path, params=RabbitMQ._query_params(columns, lightweight=lightweight), stream=True)
+        return RabbitMQ._iter_json_array(response, chunk_size, self.stats)
+
+
+    def iter_connections(self, connection_name='', columns=None, chunk_size=None):
+        """
+        Queries RabbitMQ's REST API and streams the connections, decoding the response one connection at a time.
+        time-to-first-record and peak memory do not grow with the number of connections on the broker.
+        @param columns: (optional) list of fields to return. if not specified, all fields are returned.
+        @param chunk_size: (optional) number of bytes to read from the socket at a time. (default=65536)
+        @return: generator of dicts
+        """
+        items = self._from_snapshot("connections", connection_name, columns)
+        if items is not None:
+            return iter(items)
+        path = "{}{}".format(RabbitMQ._api_connections_path, connection_name)
+        response = self._get(path, params=RabbitMQ._query_params(columns), stream=True)
+        return RabbitMQ._iter_json_array(response, chunk_size, self.stats)
+
+
+    def iter_queues_paged(self, columns=None, name=None, use_regex=False, page_size=None, lightweight=False):
+        """
+        Queries RabbitMQ's REST API page by page to get queues.
+        @param columns: (optional) list of fields to return, e.g. RabbitMQ.QUEUE_TUPLE_COLUMNS
+        @param name: (optional) queue name filter. substring match, or regex if use_regex=True.
+        @param page_size: (optional) number of queues per request. (default=500)
+        @param lightweight: (optional) ask the broker to skip per-queue stats, keeping only the message totals.
+        @return: generator of dicts
+        """
+        items = self._from_snapshot("queues", '', columns, name, use_regex)
+        if items is not None:
+            return iter(items)
+        return self._iter_pages(RabbitMQ._api_queues_path, columns, name, use_regex, page_size, lightweight)
+
+
+    def iter_connections_paged(self, columns=None, name=None, use_regex=False, page_size=None):
+        """
+        Queries RabbitMQ's REST API page by page to get connections.
+        @param columns: (optional) list of fields to return, e.g. RabbitMQ.CONNECTION_TUPLE_COLUMNS
+        @param name: (optional) connection name filter. substring match, or regex if use_regex=True.
+        @param page_size: (optional) number of connections per request. (default=500)
+        @return: generator of dicts
+        """
+        items = self._from_snapshot("connections", '', columns, name, use_regex)
+        if items is not None:
+            return iter(items)
+        return self._iter_pages(RabbitMQ._api_connections_path, columns, name, use_regex, page_size)
+
+
+    def get_queues(self, queue_name='', columns=None, name=None, use_regex=False, page_size=None, lightweight=False):
+        """
+        Queries RabbitMQ's REST API to get list of queues.
+        @param columns: (optional) list of fields to return. if not specified, all fields are returned.
+        @param name: (optional) queue name filter. substring match, or regex if use_regex=True. implies paging.
+        @param page_size: (optional) fetch the listing in pages of this size.
+        @param lightweight: (optional) ask the broker to skip per-queue stats (disable_stats=true&enable_queue_totals=true).
+                            name, state, messages_ready and messages_unacknowledged are still returned.
+        @return: list of dicts
+        """
+
+        # name filters are only supported on paged listings
+        if not queue_name and (name or page_size):
+            return list(self.iter_queues_paged(columns, name, use_regex, page_size, lightweight))
+
+        items = self._from_snapshot("queues", queue_name, columns)
+        if items is not None:
+            return items
+
+        # add specific queue if given. otherwise gets all queues.
+        path = "{}{}".format(RabbitMQ._api_queues_path, queue_name)
+        response = self._get(path, params=RabbitMQ._query_params(columns, lightweight=lightweight))
 
         # [
         #     {
@@ -160,7 +778,7 @@ class RabbitMQ:
         # ]
 
         # get json stream of http response
-        queues = response.json()
+        queues = self._decode(response)
         # for list of queues, returns list of dicts
         # if a specific queue is given, will only return dict, and not list.
 
@@ -168,7 +786,8 @@ class RabbitMQ:
         if isinstance(queues, dict):
             queues = [queues]
 
-        logger.debug(json.dumps(queues, indent=4, sort_keys=True))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(queues, indent=4, sort_keys=True))
 
         return queues
 
@@ -180,39 +799,164 @@ class RabbitMQ:
         @return: tuple (queue_name, queue_state, messages_ready, messages_unacknowledged)
         """
         queue_name = queue["name"]
-        logger.debug( "queue_name: {}".format(queue_name) )
-
         queue_state = queue["state"]
-        logger.debug( "queue_state: {}".format(queue_state) )
-
         messages_ready = queue["messages_ready"]
-        logger.debug( "messages_ready: {}".format(messages_ready) )
-
         messages_unacknowledged = queue["messages_unacknowledged"]
-        logger.debug( "messages_unacknowledged: {}".format(messages_unacknowledged) )
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug( "queue_name: {}".format(queue_name) )
+            logger.debug( "queue_state: {}".format(queue_state) )
+            logger.debug( "messages_ready: {}".format(messages_ready) )
+            logger.debug( "messages_unacknowledged: {}".format(messages_unacknowledged) )
 
         return (queue_name, queue_state, messages_ready, messages_unacknowledged)
 
 
-    def get_connections(self, connection_name=''):
+    @staticmethod
+    def queue_to_record(queue):
         """
-        Queries RabbitMQ's REST API to get list of connections.
+        converts a queue dict to a compact __slots__ record, without debug logging.
+        @return: QueueRecord
+        """
+        return QueueRecord.from_dict(queue)
+
+
+    def get_queue_snapshot(self, queue_name='', columns=QUEUE_TUPLE_COLUMNS, lightweight=False):
+        """
+        Queries RabbitMQ's REST API and decodes the queues straight into a columnar snapshot.
+        @return: QueueSnapshot
+        """
+        return QueueSnapshot.from_queues(self.iter_queues(queue_name, columns, lightweight=lightweight))
+
+
+    def get_overview(self, columns=None):
+        """
+        Queries RabbitMQ's REST API to get the cluster-wide overview. this is cheap for the broker,
+        so it can be used as a probe of whether a full queue listing is needed at all.
+        @param columns: (optional) list of fields to return, e.g. RabbitMQ.OVERVIEW_TOTALS_COLUMNS
+        @return: dict
+        """
+        path = RabbitMQ._api_overview_path
+        response = self._get(path, params=RabbitMQ._query_params(columns))
+
+        # {
+        #     "cluster_name": "rabbit@localhost",
+        #     "management_version": "3.8.2",
+        #     "message_stats": {...},
+        #     "object_totals": {"channels": 52, "connections": 52, "consumers": 40, "exchanges": 12, "queues": 30},
+        #     "queue_totals": {"messages": 1, "messages_ready": 1, "messages_unacknowledged": 0, ...},
+        #     "rabbitmq_version": "3.8.2",
+        #     ...
+        # }
+        return self._decode(response)
+
+
+    @staticmethod
+    def overview_queue_totals(overview):
+        """
+        converts an overview dict to the broker-wide queue totals.
+        if these are unchanged between two polls, it is likely that no queue changed either.
+        @return: tuple (messages, messages_ready, messages_unacknowledged, queues)
+        """
+        queue_totals = overview.get("queue_totals") or {}
+        object_totals = overview.get("object_totals") or {}
+        return (queue_totals.get("messages", 0), queue_totals.get("messages_ready", 0),
+                queue_totals.get("messages_unacknowledged", 0), object_totals.get("queues", 0))
+
+
+    @staticmethod
+    def overview_to_tuple(overview):
+        """
+        converts an overview dict to the broker-wide message rates and totals.
+        rates are in messages per second, as sampled by the broker. they are 0.0 while no messages flow,
+        since the management API then leaves out the message_stats.
+        @return: tuple (cluster_name, publish_rate, deliver_rate, ack_rate, messages_ready, messages_unacknowledged,
+                        connections, consumers, queues)
+        """
+        message_stats = overview.get("message_stats") or {}
+        queue_totals = overview.get("queue_totals") or {}
+        object_totals = overview.get("object_totals") or {}
+        rate = lambda field: (message_stats.get(field) or {}).get("rate", 0.0)
+        return (overview.get("cluster_name"), rate("publish_details"), rate("deliver_get_details"), rate("ack_details"),
+                queue_totals.get("messages_ready", 0), queue_totals.get("messages_unacknowledged", 0),
+                object_totals.get("connections", 0), object_totals.get("consumers", 0), object_totals.get("queues", 0))
+
+
+    def get_nodes(self, node_name='', columns=None):
+        """
+        Queries RabbitMQ's REST API to get the cluster nodes and their resource usage and alarms.
+        @param node_name: (optional) name of a node, e.g. "rabbit@mozart". if not specified, all nodes are returned.
+        @param columns: (optional) list of fields to return, e.g. RabbitMQ.NODE_TUPLE_COLUMNS
         @return: list of dicts
         """
+        path = "{}{}".format(RabbitMQ._api_nodes_path, quote(node_name, safe=''))
+        response = self._get(path, params=RabbitMQ._query_params(columns))
 
-        # add specific connection if given. otherwise gets all connections.
-        url = "{}{}{}".format(self._api_endpoint, RabbitMQ._api_connections_path, connection_name)
-        logger.debug( "calling url {} with credentials {}".format(url, self._http_basic_auth_credentials) )
+        # [
+        #     {
+        #         "name": "rabbit@localhost",
+        #         "running": true,
+        #         "mem_used": 157286400,
+        #         "mem_limit": 1677721600,
+        #         "mem_alarm": false,
+        #         "fd_used": 300,
+        #         "fd_total": 65536,
+        #         "sockets_used": 200,
+        #         "sockets_total": 58893,
+        #         "proc_used": 2000,
+        #         "proc_total": 1048576,
+        #         "disk_free": 53687091200,
+        #         "disk_free_limit": 52428800,
+        #         "disk_free_alarm": false,
+        #         "uptime": 1000000,
+        #         "partitions": [],
+        #         ...
+        #     }
+        # ]
+        nodes = self._decode(response)
 
-        # using verify=False just in case some rabbitmq endpoint yields OpenSSL.SSL.Error: [('SSL routines', 'tls_process_server_certificate', 'certificate verify failed')]
-        response = requests.get(url, auth=self._http_basic_auth_credentials, verify=False)
+        # make sure always return list of dict
+        if isinstance(nodes, dict):
+            nodes = [nodes]
 
-        # exit if error so outter scripts calling this python scripts can detect for non-zero exit code
-        if response.status_code != 200:
-            logger.error( "got error http {} from {}".format(url, response.status_code) )
-            raise Exception( "got error http {} from {}".format(url, response.status_code) )
+        return nodes
+
+
+    @staticmethod
+    def node_to_tuple(node):
+        """
+        converts a node dict to a simpler tuple subset. usage fields are None while a node is down.
+        @return: tuple (node_name, running, mem_used, mem_limit, mem_alarm, fd_used, fd_total, sockets_used, sockets_total,
+                        proc_used, proc_total, disk_free, disk_free_limit, disk_free_alarm)
+        """
+        return (node["name"], node.get("running", False),
+                node.get("mem_used"), node.get("mem_limit"), node.get("mem_alarm", False),
+                node.get("fd_used"), node.get("fd_total"),
+                node.get("sockets_used"), node.get("sockets_total"),
+                node.get("proc_used"), node.get("proc_total"),
+                node.get("disk_free"), node.get("disk_free_limit"), node.get("disk_free_alarm", False))
+
+
+    def get_connections(self, connection_name='', columns=None, name=None, use_regex=False, page_size=None):
+        """
+        Queries RabbitMQ's REST API to get list of connections.
+        @param columns: (optional) list of fields to return. if not specified, all fields are returned.
+        @param name: (optional) connection name filter. substring match, or regex if use_regex=True. implies paging.
+        @param page_size: (optional) fetch the listing in pages of this size.
+        @return: list of dicts
+        """
 
-        logger.debug( "response: {}".format(response) )
+        # name filters are only supported on paged listings
+        if not connection_name and (name or page_size):
+            return list(self.iter_connections_paged(columns, name, use_regex, page_size))
+
+        items = self._from_snapshot("connections", connection_name, columns)
+        if items is not None:
+            return items
+
+        # add specific connection if given. otherwise gets all connections.
+        path = "{}{}".format(RabbitMQ._api_connections_path, connection_name)
+        response = self._get(path, params=RabbitMQ._query_params(columns))
 
         # ]
         #     {
@@ -277,7 +1021,7 @@ class RabbitMQ:
         # ]
 
         # get json stream of http response
-        connections = response.json()
+        connections = self._decode(response)
         # for list of connections, returns list of dicts
         # if a specific connection is given, will only return dict, and not list.
 
@@ -285,7 +1029,8 @@ class RabbitMQ:
         if isinstance(connections, dict):
             connections = [connections]
 
-        logger.debug(json.dumps(connections, indent=4, sort_keys=True))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(connections, indent=4, sort_keys=True))
 
         return connections
 
@@ -296,17 +1041,246 @@ class RabbitMQ:
         @return: tuple (connection_name, connection_state, connection_send_rate, connection_recv_rate)
         """
         connection_name = connection["name"]
-        logger.debug( "connection_name: {}".format(connection_name) )
-
         connection_state = connection["state"]
-        logger.debug( "connection_state: {}".format(connection_state) )
+        connection_send_rate = connection["send_oct_details"]["rate"]
+        connection_recv_rate = connection["recv_oct_details"]["rate"]
 
-        connection_send_oct_details = connection["send_oct_details"]
-        connection_send_rate = connection_send_oct_details["rate"]
-        logger.debug( "connection_send_rate: {}".format(connection_send_rate) )
-
-        connection_recv_oct_details = connection["recv_oct_details"]
-        connection_recv_rate = connection_recv_oct_details["rate"]
-        logger.debug( "connection_recv_rate: {}".format(connection_recv_rate) )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug( "connection_name: {}".format(connection_name) )
+            logger.debug( "connection_state: {}".format(connection_state) )
+            logger.debug( "connection_send_rate: {}".format(connection_send_rate) )
+            logger.debug( "connection_recv_rate: {}".format(connection_recv_rate) )
 
         return (connection_name, connection_state, connection_send_rate, connection_recv_rate)
+
+
+    @staticmethod
+    def connection_to_record(connection):
+        """
+        converts a connection dict to a compact __slots__ record, without debug logging.
+        @return: ConnectionRecord
+        """
+        return ConnectionRecord.from_dict(connection)
+
+
+    def get_connection_snapshot(self, connection_name='', columns=CONNECTION_TUPLE_COLUMNS):
+        """
+        Queries RabbitMQ's REST API and decodes the connections straight into a columnar snapshot.
+        @return: ConnectionSnapshot
+        """
+        return ConnectionSnapshot.from_connections(self.iter_connections(connection_name, columns))
+
+
+    def iter_channels(self, channel_name='', columns=None, chunk_size=None):
+        """
+        Queries RabbitMQ's REST API and streams the channels, decoding the response one channel at a time.
+        @param columns: (optional) list of fields to return, e.g. rabbitmq.correlation.CHANNEL_INDEX_COLUMNS
+        @return: generator of dicts
+        """
+        path = "{}{}".format(RabbitMQ._api_channels_path, quote(channel_name, safe=''))
+        response = self._get(path, params=RabbitMQ._query_params(columns), stream=True)
+        return RabbitMQ._iter_json_array(response, chunk_size, self.stats)
+
+
+    def get_channels(self, channel_name='', columns=None, name=None, use_regex=False, page_size=None):
+        """
+        Queries RabbitMQ's REST API to get list of channels.
+        @param columns: (optional) list of fields to return. if not specified, all fields are returned.
+        @param name: (optional) channel name filter. substring match, or regex if use_regex=True. implies paging.
+        @param page_size: (optional) fetch the listing in pages of this size.
+        @return: list of dicts
+        """
+        if not channel_name and (name or page_size):
+            return list(self._iter_pages(RabbitMQ._api_channels_path, columns, name, use_regex, page_size))
+
+        # {
+        #     "name": "127.0.0.1:46542 -> 127.0.0.1:5672 (1)",
+        #     "number": 1,
+        #     "user": "hysdsops",
+        #     "state": "running",
+        #     "prefetch_count": 1,
+        #     "global_prefetch_count": 0,
+        #     "messages_unacknowledged": 1,
+        #     "consumer_count": 1,
+        #     "connection_details": {"name": "127.0.0.1:46542 -> 127.0.0.1:5672", "peer_host": "127.0.0.1", "peer_port": 46542},
+        #     ...
+        # }
+        path = "{}{}".format(RabbitMQ._api_channels_path, quote(channel_name, safe=''))
+        response = self._get(path, params=RabbitMQ._query_params(columns))
+        return self._decode(response)
+
+
+    def get_consumers(self, columns=None, vhost=None):
+        """
+        Queries RabbitMQ's REST API to get list of consumers.
+        @param columns: (optional) list of fields to return, e.g. rabbitmq.correlation.CONSUMER_INDEX_COLUMNS
+        @param vhost: (optional) only the consumers of this virtual host.
+        @return: list of dicts
+        """
+        # {
+        #     "consumer_tag": "None4",
+        #     "prefetch_count": 1,
+        #     "ack_required": true,
+        #     "active": true,
+        #     "channel_details": {"name": "127.0.0.1:46542 -> 127.0.0.1:5672 (1)", "connection_name": "127.0.0.1:46542 -> 127.0.0.1:5672", "peer_host": "127.0.0.1", ...},
+        #     "queue": {"name": "user_rules_dataset", "vhost": "/"},
+        #     ...
+        # }
+        path = RabbitMQ._api_consumers_path + (quote(vhost, safe='') if vhost else '')
+        response = self._get(path, params=RabbitMQ._query_params(columns))
+        return self._decode(response)
+
+
+    @staticmethod
+    def _vhost_path(resource, vhost, name, action=None):
+        path = "/api/{}/{}/{}".format(resource, quote(vhost, safe=''), quote(name, safe=''))
+        return "{}/{}".format(path, action) if action else path
+
+
+    def get_messages(self, queue_name, count=1, requeue=True, vhost='/', truncate=None):
+        """
+        gets messages from the head of a queue with /api/queues/{vhost}/{name}/get.
+        @param count: max number of messages to get.
+        @param requeue: if True, the messages are put back (peek). if False, they are removed from the queue.
+        @param truncate: (optional) truncate payloads to this many bytes. only use when peeking.
+        @return: list of message dicts with payload, payload_encoding, properties, exchange, routing_key, redelivered
+        """
+        body = {"count": count, "ackmode": "ack_requeue_true" if requeue else "ack_requeue_false", "encoding": "auto"}
+        if truncate:
+            body["truncate"] = truncate
+        return self._post(RabbitMQ._vhost_path("queues", vhost, queue_name, "get"), body)
+
+
+    def publish_message(self, message, exchange='', routing_key='', vhost='/'):
+        """
+        publishes a message dict, e.g. from get_messages(), with its payload and properties, with /api/exchanges/{vhost}/{name}/publish.
+        @param exchange: name of the exchange. '' is the default exchange, which routes to the queue named by routing_key.
+        @return: True if the message was routed to at least one queue
+        """
+        path = RabbitMQ._vhost_path("exchanges", vhost, exchange or "amq.default", "publish")
+        return self._post(path, republish_body(message, routing_key)).get("routed", False)
+
+
+    def peek_messages(self, queue_name, count=1, predicate=None, vhost='/', truncate=None):
+        """
+        gets up to count messages from the head of a queue without removing them.
+        @param predicate: (optional) function(message) -> bool. only matching messages are returned.
+        @return: list of message dicts
+        """
+        messages = self.get_messages(queue_name, count, requeue=True, vhost=vhost, truncate=truncate)
+        if predicate is not None:
+            messages = [m for m in messages if predicate(m)]
+        return messages
+
+
+    def move_messages(self, queue_name, exchange='', routing_key=None, predicate=None, limit=None,
+                      batch_size=500, concurrency=4, dry_run=False, progress=None, vhost='/', lost=None):
+        """
+        moves messages out of a queue in batches, e.g. to requeue failed jobs from a dead-letter queue.
+        messages are removed from the queue a batch at a time, then the matching messages are published to the target
+        and the others are put back at the tail of the queue, concurrency at a time.
+        a message that cannot be published to the target is put back at the tail of the queue too.
+        each message is only gone through once, so the number of messages gone through is bounded by the queue depth at the start.
+
+        @param exchange: exchange to publish to. '' is the default exchange.
+        @param routing_key: (optional) routing key to publish with, e.g. the target queue name with the default exchange.
+            if not specified, each message goes back to where it came from: the queue in its x-death header, or else its original exchange and routing key.
+        @param predicate: (optional) function(message) -> bool. only matching messages are moved.
+        @param limit: (optional) max number of messages to go through.
+        @param batch_size: number of messages removed from the queue per request.
+        @param concurrency: number of concurrent publish requests. should be at most pool_maxsize.
+        @param dry_run: only peek at the first limit (or batch_size) messages, and count the matching ones.
+        @param progress: (optional) function(MoveStats) called after each batch.
+        @param lost: (optional) list to collect the messages that could neither be moved nor put back, as MoveStats.lost.
+            if the move raises, e.g. on KeyboardInterrupt, it also holds the removed messages of the batch that were not gone through,
+            so the caller can save them.
+        @return: MoveStats. messages that could neither be moved nor put back are in its lost list.
+        """
+        response = self._get(RabbitMQ._vhost_path("queues", vhost, queue_name), params=RabbitMQ._query_params(('messages_ready',)))
+        total = self._decode(response).get("messages_ready") or 0
+        if limit is not None:
+            total = min(total, limit)
+
+        if dry_run:
+            stats = MoveStats(min(total, limit or batch_size), dry_run=True)
+            messages = self.get_messages(queue_name, stats.total, requeue=True, vhost=vhost)
+            stats.fetched = len(messages)
+            stats.matched = sum(1 for m in messages if predicate is None or predicate(m))
+            if progress is not None:
+                progress(stats)
+            return stats
+
+        stats = MoveStats(total)
+        if lost is not None:
+            stats.lost = lost
+
+        # the messages are already removed from the queue, so any error publishing one must end in put back or lost,
+        # e.g. a ValueError decoding a non-json response of a proxy, not escape with the message
+        def put_back(message):
+            try:
+                return self.publish_message(message, '', queue_name, vhost), None
+            except Exception as e:
+                return False, str(e) or e.__class__.__name__
+
+        def move(message, matched):
+            """
+            @return: tuple (outcome, reason the message was not moved or None)
+            """
+            error = None
+            if matched:
+                target = (exchange, routing_key) if routing_key is not None else message_origin(message)
+                try:
+                    if self.publish_message(message, target[0], target[1], vhost):
+                        return "moved", None
+                    error = "not routed by exchange {!r} with routing key {!r}".format(*target)
+                except Exception as e:
+                    error = str(e) or e.__class__.__name__
+            put, put_error = put_back(message)
+            if not put:
+                return "failed", put_error or "not routed back to {}".format(queue_name)
+            return "requeued", error
+
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="move")
+        try:
+            while stats.fetched < total:
+                batch = self.get_messages(queue_name, min(batch_size, total - stats.fetched), requeue=False, vhost=vhost)
+                if not batch:
+                    break
+                stats.fetched += len(batch)
+                # one log line per batch and reason, rather than per message
+                errors = {}
+                done = 0
+                try:
+                    matches = [predicate is None or predicate(m) for m in batch]
+                    stats.matched += sum(matches)
+                    for message, (outcome, error) in zip(batch, executor.map(move, batch, matches)):
+                        if outcome == "moved":
+                            stats.moved += 1
+                        elif outcome == "requeued":
+                            stats.requeued += 1
+                        else:
+                            stats.failed += 1
+                            stats.lost.append(message)
+                        if error is not None:
+                            errors[(outcome, error)] = errors.get((outcome, error), 0) + 1
+                        done += 1
+                    # end for
+                except BaseException:
+                    # e.g. a failing predicate or KeyboardInterrupt. some of these may have been published already,
+                    # but a duplicate is better than a message that is gone
+                    stats.failed += len(batch) - done
+                    stats.lost.extend(batch[done:])
+                    logger.error( "{} removed message(s) of {} were not gone through".format(len(batch) - done, queue_name) )
+                    raise
+                for (outcome, error), count in errors.items():
+                    if outcome == "failed":
+                        logger.error( "{} message(s) could not be put back: {}".format(count, error) )
+                    else:
+                        logger.warning( "{} message(s) put back to {}: {}".format(count, queue_name, error) )
+                # end for
+                if progress is not None:
+                    progress(stats)
+            # end while
+        finally:
+            executor.shutdown(wait=True)
+        return stats
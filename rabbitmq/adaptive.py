@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Adaptive polling helpers for the monitor scripts.
+#
+# AdaptiveInterval shortens the polling interval while polls keep finding changes, and
+# lengthens it while they find none, within [min_interval, max_interval].
+#
+# HotSet remembers the names that changed recently, so that the monitors can poll just those
+# queues by name between rare refreshes of the full listing.
+#
+# example usage:
+#   interval = AdaptiveInterval(min_interval=5, max_interval=120)
+#   hot = HotSet(ttl=5)
+#   ...
+#   hot.update(name for (name, state, ready, unacked) in new)
+#   time.sleep(interval.update(len(new) > 0))
+#
+# ---------------------------------------------------------
+
+
+class AdaptiveInterval:
+
+    def __init__(self, min_interval, max_interval, initial=None, speedup=0.5, slowdown=1.5):
+        """
+        @param min_interval: shortest interval in seconds, used while things keep changing.
+        @param max_interval: longest interval in seconds, used while things stay quiet.
+        @param initial: (optional) starting interval. (default=min_interval)
+        @param speedup: factor applied to the interval after a poll with changes.
+        @param slowdown: factor applied to the interval after a poll without changes.
+        """
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("need 0 < min_interval <= max_interval, got {} and {}".format(min_interval, max_interval))
+        if not 0 < speedup <= 1 <= slowdown:
+            raise ValueError("need 0 < speedup <= 1 <= slowdown, got {} and {}".format(speedup, slowdown))
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._speedup = speedup
+        self._slowdown = slowdown
+        self.interval = min_interval if initial is None else min(max(initial, min_interval), max_interval)
+
+    def update(self, changed):
+        """
+        @param changed: whether the last poll found any changes.
+        @return: the interval to wait before the next poll.
+        """
+        factor = self._speedup if changed else self._slowdown
+        self.interval = min(max(self.interval * factor, self.min_interval), self.max_interval)
+        return self.interval
+
+
+class HotSet:
+
+    def __init__(self, ttl=5, max_size=50):
+        """
+        @param ttl: number of polls a name stays hot after its last change.
+        @param max_size: max number of hot names. the least recently changed are dropped first.
+        """
+        self._ttl = ttl
+        self._max_size = max_size
+        # name -> remaining polls
+        self._remaining = {}
+
+    def update(self, changed_names):
+        """
+        ages all hot names by one poll, then marks the changed names as hot.
+        """
+        remaining = self._remaining
+        for name in list(remaining):
+            remaining[name] -= 1
+            if remaining[name] <= 0:
+                del remaining[name]
+        # end for
+        for name in changed_names:
+            # re-insert to keep dict order from least to most recently changed
+            remaining.pop(name, None)
+            remaining[name] = self._ttl
+        # end for
+        while len(remaining) > self._max_size:
+            del remaining[next(iter(remaining))]
+        # end while
+
+    def discard(self, name):
+        self._remaining.pop(name, None)
+
+    def names(self):
+        """
+        @return: list of hot names
+        """
+        return list(self._remaining)
+
+    def __len__(self):
+        return len(self._remaining)
+
+    def __contains__(self, name):
+        return name in self._remaining
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Aggregation of connections by client host, user or client product, with top-N heavy hitters.
+#
+# connections are summed per group in one streaming pass, so memory grows with the number of
+# groups rather than connections. the top-N groups are selected with heapq.nlargest, a partial
+# sort in O(groups * log N) rather than sorting all groups.
+#
+# example usage:
+#   groups = aggregate_connections(rbmq.iter_connections(columns=AGGREGATE_COLUMNS), "host")
+#   top_groups(groups, 3, "send_rate")
+#   [('100.64.1.17', 12, 4410.3, 120.5, 12), ('100.64.1.18', 10, 1450.0, 98.1, 10), ...]
+#
+# ---------------------------------------------------------
+
+import heapq
+
+
+# columns needed from the management API by aggregate_connections()
+AGGREGATE_COLUMNS = ('name', 'peer_host', 'user', 'client_properties.product', 'channels',
+                     'send_oct_details.rate', 'recv_oct_details.rate')
+
+# group name -> function(connection) -> group key
+GROUP_KEYS = {
+    "host": lambda c: c.get("peer_host"),
+    "user": lambda c: c.get("user"),
+    "product": lambda c: (c.get("client_properties") or {}).get("product"),
+}
+
+# fields of the group tuples after the group key, in order
+GROUP_FIELDS = ('connections', 'send_rate', 'recv_rate', 'channels')
+
+
+def _rate(connection, field):
+    details = connection.get(field)
+    return (details.get("rate") or 0.0) if isinstance(details, dict) else 0.0
+
+
+def aggregate_connections(connections, group_by="host"):
+    """
+    @param connections: iterable of connection dicts with at least the AGGREGATE_COLUMNS fields.
+    @param group_by: "host", "user" or "product"
+    @return: dict {group key: [connections, send_rate, recv_rate, channels]}
+    """
+    if group_by not in GROUP_KEYS:
+        raise ValueError("unknown group {}. choose from {}".format(group_by, sorted(GROUP_KEYS)))
+    key_of = GROUP_KEYS[group_by]
+    groups = {}
+    for connection in connections:
+        key = key_of(connection)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = [0, 0.0, 0.0, 0]
+        group[0] += 1
+        group[1] += _rate(connection, "send_oct_details")
+        group[2] += _rate(connection, "recv_oct_details")
+        group[3] += connection.get("channels") or 0
+    # end for
+    return groups
+
+
+def top_groups(groups, n=10, by="send_rate"):
+    """
+    @param groups: dict from aggregate_connections()
+    @param n: number of groups to return. 0 or None for all groups.
+    @param by: one of GROUP_FIELDS to rank the groups by.
+    @return: list of tuples (group key, connections, send_rate, recv_rate, channels), heaviest first
+    """
+    if by not in GROUP_FIELDS:
+        raise ValueError("unknown field {}. choose from {}".format(by, GROUP_FIELDS))
+    i = GROUP_FIELDS.index(by)
+    if n:
+        items = heapq.nlargest(n, groups.items(), key=lambda item: item[1][i])
+    else:
+        items = sorted(groups.items(), key=lambda item: item[1][i], reverse=True)
+    return [(str(key), group[0], round(group[1], 1), round(group[2], 1), group[3]) for key, group in items]
@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Alert rules evaluated by the monitors on each poll, instead of by queries over the SDSWatch logs.
+#
+# rules are declared in a json file (or yaml, if PyYAML is installed) over the fields of the queue
+# and connection tuples, i.e. rabbitmq.diff.QUEUE_FIELDS and rabbitmq.diff.CONNECTION_FIELDS:
+#
+#   {
+#     "repeat_interval": 600,
+#     "max_per_minute": 30,
+#     "sinks": [{"type": "log"}, {"type": "webhook", "url": "http://localhost:9000/alerts"}],
+#     "rules": [
+#       {"name": "backlog", "resource": "queue", "match": "*-job_worker-*", "type": "threshold",
+#        "field": "messages_ready", "op": ">", "value": 1000, "for": 60},
+#       {"name": "backlog_growing", "resource": "queue", "type": "rate", "field": "messages_ready",
+#        "op": ">", "value": 5, "window": 300},
+#       {"name": "jobs_processed_missing", "resource": "queue", "match": "jobs_processed", "type": "absence", "for": 30},
+#       {"name": "connection_blocked", "resource": "connection", "type": "state", "expected": "running"}
+#     ]
+#   }
+#
+#   threshold: the field compared to value with op (>, >=, <, <=, ==, !=).
+#   rate:      the change of the field per second over the last window seconds, compared to value with op.
+#   absence:   no record matches the rule for "for" seconds, e.g. a queue was deleted.
+#   state:     the state field is not the expected state. (default="running")
+#   match is a shell-style pattern of record names. (default="*")
+#   for is how long a condition must hold before the alert fires. (default=0)
+#   sinks default to "log", i.e. the monitor's log on stderr. "stdout" and "stderr" write json lines,
+#   but note that stdout also carries the monitors' records.
+#
+# the engine is incremental: each update only evaluates the rules against the records that changed
+# in the cycle, which is what the monitors already compute. conditions that depend on time alone
+# (pending "for" durations, rates decaying while a record is unchanged, absences) are re-checked
+# from the small set of pending and firing alerts. an alert notifies once when it fires and once when
+# it resolves, again every repeat_interval seconds while it keeps firing, and at most max_per_minute
+# notifications are sent per minute over all rules. resolves over that limit are held back, not dropped.
+#
+# example usage:
+#   engine = AlertEngine.from_file("alerts.json")
+#   engine.update("queue", time.time(), changed_queue_tuples, removed_queue_names)
+#   {"timestamp": "2020-05-22T03:19:04+00:00", "rule": "backlog", "resource": "queue", "name": "standard_product-s1gunw-topsapp-pleiade",
+#    "status": "firing", "value": 1250, "message": "messages_ready 1250 > 1000"}
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+
+import sys
+import json
+import fnmatch
+import operator
+from collections import namedtuple, deque
+from datetime import datetime, timezone
+
+# optional, for yaml rule files
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from rabbitmq.diff import QUEUE_FIELDS, CONNECTION_FIELDS
+
+
+# resource -> names of the tuple fields after the name
+RESOURCE_FIELDS = {
+    "queue": QUEUE_FIELDS,
+    "connection": CONNECTION_FIELDS,
+}
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+THRESHOLD = "threshold"
+RATE = "rate"
+ABSENCE = "absence"
+STATE = "state"
+RULE_TYPES = (THRESHOLD, RATE, ABSENCE, STATE)
+
+FIRING = "firing"
+RESOLVED = "resolved"
+
+Alert = namedtuple('Alert', ['timestamp', 'rule', 'resource', 'name', 'status', 'value', 'message'])
+
+
+def alert_to_dict(alert):
+    """
+    @return: dict of an Alert, with an iso timestamp
+    """
+    result = alert._asdict()
+    result["timestamp"] = datetime.fromtimestamp(alert.timestamp, timezone.utc).replace(microsecond=0).isoformat()
+    return result
+
+
+class AlertRule:
+
+    def __init__(self, name, resource, type, field=None, op=">", value=None, match="*", window=300.0,
+                 expected="running", for_seconds=0.0):
+        """
+        @param name: unique name of the rule, used in notifications.
+        @param resource: "queue" or "connection"
+        @param type: "threshold", "rate", "absence" or "state"
+        @param field: (threshold and rate) one of the resource's tuple fields.
+        @param op: (threshold and rate) comparison operator.
+        @param value: (threshold and rate) value compared to.
+        @param match: (optional) shell-style pattern of record names.
+        @param window: (rate) seconds over which the rate of change is measured.
+        @param expected: (state) the state that does not alert.
+        @param for_seconds: (optional) seconds the condition must hold before firing.
+        """
+        if resource not in RESOURCE_FIELDS:
+            raise ValueError("rule {}: unknown resource {}. choose from {}".format(name, resource, sorted(RESOURCE_FIELDS)))
+        if type not in RULE_TYPES:
+            raise ValueError("rule {}: unknown type {}. choose from {}".format(name, type, RULE_TYPES))
+        if type == STATE:
+            field = "state"
+        if type in (THRESHOLD, RATE, STATE):
+            if field not in RESOURCE_FIELDS[resource]:
+                raise ValueError("rule {}: unknown field {}. choose from {}".format(name, field, RESOURCE_FIELDS[resource]))
+        if type in (THRESHOLD, RATE):
+            if op not in OPERATORS:
+                raise ValueError("rule {}: unknown op {}. choose from {}".format(name, op, sorted(OPERATORS)))
+            if value is None:
+                raise ValueError("rule {}: a {} rule needs a value".format(name, type))
+        self.name = name
+        self.resource = resource
+        self.type = type
+        self.field = field
+        self.op = op
+        self.value = value
+        self.match = match
+        self.window = float(window)
+        self.expected = expected
+        self.for_seconds = float(for_seconds)
+        self._compare = OPERATORS.get(op)
+        # tuple position of the field, after the name
+        self.index = RESOURCE_FIELDS[resource].index(field) + 1 if field else None
+        # names are matched once, then looked up
+        self._matches = {}
+
+    @classmethod
+    def from_dict(cls, spec):
+        spec = dict(spec)
+        if "for" in spec:
+            spec["for_seconds"] = spec.pop("for")
+        return cls(**spec)
+
+    def matches(self, name):
+        matched = self._matches.get(name)
+        if matched is None:
+            matched = self._matches[name] = fnmatch.fnmatchcase(name, self.match)
+        return matched
+
+    def forget(self, name):
+        self._matches.pop(name, None)
+
+    def check(self, value):
+        """
+        @param value: the field value for threshold and state rules, or the rate for rate rules.
+        @return: (condition holds, message)
+        """
+        if self.type == STATE:
+            return (value != self.expected, "state {} != {}".format(value, self.expected))
+        if value is None:
+            return (False, None)
+        if self.type == RATE:
+            return (self._compare(value, self.value), "{} changing {:.3f}/s {} {}".format(self.field, value, self.op, self.value))
+        return (self._compare(value, self.value), "{} {} {} {}".format(self.field, value, self.op, self.value))
+
+
+def load_rules(path):
+    """
+    @return: dict config of a json or yaml rule file
+    """
+    with open(path) as f:
+        if path.endswith((".yml", ".yaml")):
+            if yaml is None:
+                raise ValueError("{} is yaml, but PyYAML is not installed. use a json rule file instead.".format(path))
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+class LogAlertSink:
+    """
+    logs one json line per notification, so notifications never mix with the records a monitor writes to stdout.
+    """
+
+    def __init__(self, level="warning"):
+        """
+        @param level: log level of the notifications, e.g. "warning" or "info".
+        """
+        self._level = logging.getLevelName(level.upper())
+        if not isinstance(self._level, int):
+            raise ValueError("unknown log level {}".format(level))
+
+    def send(self, alerts):
+        for alert in alerts:
+            logger.log(self._level, json.dumps(alert_to_dict(alert)))
+        # end for
+
+
+class StdoutAlertSink:
+    """
+    one json line per notification.
+    """
+
+    def __init__(self, stream=None):
+        self._stream = stream or sys.stdout
+
+    def send(self, alerts):
+        self._stream.write("".join(json.dumps(alert_to_dict(a)) + "\n" for a in alerts))
+        self._stream.flush()
+
+
+class StderrAlertSink(StdoutAlertSink):
+
+    def __init__(self):
+        super().__init__(sys.stderr)
+
+
+class WebhookAlertSink:
+    """
+    POSTs the notifications of one cycle as a json list, e.g. to a chat or paging gateway.
+    """
+
+    def __init__(self, url, timeout=5.0, headers=None):
+        import requests
+        self._url = url
+        self._timeout = timeout
+        self._session = requests.Session()
+        self._session.headers.update(headers or {})
+
+    def send(self, alerts):
+        try:
+            response = self._session.post(self._url, json=[alert_to_dict(a) for a in alerts], timeout=self._timeout)
+            response.raise_for_status()
+        except Exception as e:
+            # alerting must never stop the monitor
+            logger.warning("failed to send {} alert(s) to {}: {}".format(len(alerts), self._url, e))
+
+
+# sink type -> class. add future alert sinks here.
+ALERT_SINKS = {
+    "log": LogAlertSink,
+    "stdout": StdoutAlertSink,
+    "stderr": StderrAlertSink,
+    "webhook": WebhookAlertSink,
+}
+
+
+def make_alert_sink(spec):
+    """
+    @param spec: dict with the sink "type" and the keyword arguments of its class, e.g. {"type": "webhook", "url": ...}
+    """
+    spec = dict(spec)
+    sink_type = spec.pop("type", "log")
+    if sink_type not in ALERT_SINKS:
+        raise ValueError("unknown alert sink {}. choose from {}".format(sink_type, sorted(ALERT_SINKS)))
+    return ALERT_SINKS[sink_type](**spec)
+
+
+class _AlertState:
+
+    __slots__ = ('since', 'checked', 'firing', 'notified', 'last_sent', 'value', 'message')
+
+    def __init__(self, since):
+        # when the condition started to hold, and when it was last evaluated
+        self.since = since
+        self.checked = None
+        self.firing = False
+        # whether a firing notification got past the rate limit, so a resolve is owed
+        self.notified = False
+        self.last_sent = None
+        self.value = None
+        self.message = None
+
+
+class AlertEngine:
+
+    def __init__(self, rules, sinks=(), repeat_interval=600.0, max_per_minute=30):
+        """
+        @param rules: list of AlertRule
+        @param sinks: list of alert sinks, objects with a send(alerts) method.
+        @param repeat_interval: seconds between repeated notifications of an alert that keeps firing. 0 to never repeat.
+        @param max_per_minute: max notifications sent per minute over all rules. 0 for no limit.
+        """
+        names = [rule.name for rule in rules]
+        if len(set(names)) != len(names):
+            raise ValueError("rule names must be unique: {}".format(names))
+        self.rules = list(rules)
+        self.sinks = list(sinks)
+        self._repeat_interval = repeat_interval
+        self._max_per_minute = max_per_minute
+        # resource -> rules evaluated per changed record, and absence rules
+        self._record_rules = {}
+        self._absence_rules = {}
+        for rule in self.rules:
+            (self._absence_rules if rule.type == ABSENCE else self._record_rules).setdefault(rule.resource, []).append(rule)
+        # end for
+        # (rule name, record name) -> _AlertState of the pending and firing alerts
+        self._active = {}
+        # (resource, record name) -> last record tuple
+        self._records = {}
+        # (rule name, record name) -> deque of (time, value) samples of rate rules
+        self._samples = {}
+        # absence rule name -> set of present matching names
+        self._present = dict((rule.name, set()) for rule in self.rules if rule.type == ABSENCE)
+        # absence rule name -> when its last matching name disappeared
+        self._absent_since = {}
+        self._rules_by_name = dict((rule.name, rule) for rule in self.rules)
+        self._started = None
+        # send times of the last minute
+        self._sent = deque()
+        # resolves held back by the rate limit, sent first in the next cycles
+        self._deferred = []
+        self.suppressed = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        @param config: dict with "rules", and optional "sinks", "repeat_interval" and "max_per_minute"
+        """
+        rules = [AlertRule.from_dict(spec) for spec in config.get("rules", ())]
+        sinks = [make_alert_sink(spec) for spec in config.get("sinks", ({"type": "log"},))]
+        return cls(rules, sinks, config.get("repeat_interval", 600.0), config.get("max_per_minute", 30))
+
+    @classmethod
+    def from_file(cls, path):
+        return cls.from_config(load_rules(path))
+
+    @property
+    def resources(self):
+        return set(rule.resource for rule in self.rules)
+
+    def firing(self):
+        """
+        @return: sorted list of (rule name, record name) of the firing alerts
+        """
+        return sorted(key for key, state in self._active.items() if state.firing)
+
+    def _rate(self, rule, name, now, value):
+        """
+        records a sample and returns the change per second over the window, or None.
+        records are only sampled when they change, and hold their value in between, so the baseline
+        sample's value is also the value at the start of the window when the baseline is older than that.
+        """
+        samples = self._samples.get((rule.name, name))
+        if samples is None:
+            samples = self._samples[(rule.name, name)] = deque()
+        if value is not None:
+            samples.append((now, value))
+        # keep one sample at or before the start of the window as the baseline
+        while len(samples) > 2 and samples[1][0] <= now - rule.window:
+            samples.popleft()
+        # end while
+        if len(samples) < 2 or now <= samples[0][0]:
+            return None
+        return (samples[-1][1] - samples[0][1]) / (now - max(samples[0][0], now - rule.window))
+
+    def _evaluate(self, rule, name, now, holds, value, message, notifications):
+        key = (rule.name, name)
+        state = self._active.get(key)
+        if not holds:
+            if state is not None:
+                del self._active[key]
+                if state.firing:
+                    notifications.append(Alert(now, rule.name, rule.resource, name, RESOLVED, value, message))
+            return
+        if state is None:
+            state = self._active[key] = _AlertState(now)
+        state.checked = now
+        state.value = value
+        state.message = message
+        if not state.firing:
+            if now - state.since >= rule.for_seconds:
+                state.firing = True
+                state.last_sent = now
+                notifications.append(Alert(now, rule.name, rule.resource, name, FIRING, value, message))
+        elif self._repeat_interval and now - state.last_sent >= self._repeat_interval:
+            state.last_sent = now
+            notifications.append(Alert(now, rule.name, rule.resource, name, FIRING, value, message))
+
+    def _check_record(self, rule, record, now, notifications):
+        name = record[0]
+        value = record[rule.index]
+        if rule.type == RATE:
+            value = self._rate(rule, name, now, value)
+        holds, message = rule.check(value)
+        self._evaluate(rule, name, now, holds, value, message, notifications)
+
+    def update(self, resource, now, changed=(), removed=()):
+        """
+        evaluates the rules against the records that changed in a cycle, and re-checks the time-dependent alerts.
+        @param resource: "queue" or "connection"
+        @param now: epoch seconds of the cycle
+        @param changed: iterable of the record tuples that were added or changed, e.g. the monitor's new tuples.
+        @param removed: iterable of the names of the records that disappeared.
+        @return: list of Alert notifications sent
+        """
+        if self._started is None:
+            self._started = now
+        notifications = []
+        record_rules = self._record_rules.get(resource, ())
+        absence_rules = self._absence_rules.get(resource, ())
+
+        for record in changed:
+            name = record[0]
+            self._records[(resource, name)] = record
+            for rule in record_rules:
+                if rule.matches(name):
+                    self._check_record(rule, record, now, notifications)
+            # end for
+            for rule in absence_rules:
+                if rule.matches(name):
+                    self._present[rule.name].add(name)
+            # end for
+        # end for
+
+        for name in removed:
+            self._records.pop((resource, name), None)
+            for rule in record_rules:
+                key = (rule.name, name)
+                self._samples.pop(key, None)
+                state = self._active.pop(key, None)
+                if state is not None and state.firing:
+                    notifications.append(Alert(now, rule.name, resource, name, RESOLVED, None, "removed"))
+                rule.forget(name)
+            # end for
+            for rule in absence_rules:
+                present = self._present[rule.name]
+                if name in present:
+                    present.discard(name)
+                    if not present:
+                        self._absent_since[rule.name] = now
+                rule.forget(name)
+            # end for
+        # end for
+
+        self._tick(resource, now, notifications)
+        return self._send(now, notifications)
+
+    def _tick(self, resource, now, notifications):
+        """
+        re-checks the pending and firing alerts of records that did not change, and the absence rules.
+        """
+        for (rule_name, name), state in list(self._active.items()):
+            rule = self._rules_by_name[rule_name]
+            if rule.resource != resource or rule.type == ABSENCE:
+                continue
+            if state.checked == now:
+                # the record changed in this cycle
+                continue
+            record = self._records.get((resource, name))
+            if record is None:
+                continue
+            if rule.type == RATE:
+                # the held value is sampled again, so that the rate decays while the record is unchanged
+                self._check_record(rule, record, now, notifications)
+            else:
+                self._evaluate(rule, name, now, True, state.value, state.message, notifications)
+        # end for
+
+        for rule in self._absence_rules.get(resource, ()):
+            present = len(self._present[rule.name])
+            key = (rule.name, rule.match)
+            if not present and key not in self._active:
+                # never seen since the engine started counts as absent since then
+                self._active[key] = _AlertState(self._absent_since.get(rule.name, self._started))
+            message = "{} {} matching {}".format(present or "no", rule.resource, rule.match)
+            self._evaluate(rule, rule.match, now, not present, present, message, notifications)
+        # end for
+
+    def _send(self, now, notifications):
+        """
+        rate-limits and sends the notifications of one cycle as one batch per sink.
+        @return: list of Alert sent
+        """
+        if self._deferred:
+            notifications = self._deferred + notifications
+            self._deferred = []
+        if not notifications:
+            return notifications
+        if self._max_per_minute:
+            while self._sent and self._sent[0] <= now - 60:
+                self._sent.popleft()
+            # end while
+            allowed = max(self._max_per_minute - len(self._sent), 0)
+            if allowed < len(notifications):
+                dropped = len(notifications) - allowed
+                self.suppressed += dropped
+                logger.warning("alert rate limit of {}/min reached, suppressing {} notification(s)".format(self._max_per_minute, dropped))
+                for alert in notifications[allowed:]:
+                    if alert.status == RESOLVED:
+                        # the alert state is gone, so only the queued resolve can close it at the receivers
+                        self._deferred.append(alert)
+                        continue
+                    state = self._active.get((alert.rule, alert.name))
+                    if state is None:
+                        continue
+                    if state.notified:
+                        # a repeat: keep firing, so the resolve is still sent, and repeat at the next evaluation
+                        state.last_sent = now - self._repeat_interval
+                    else:
+                        # fire again at the next evaluation rather than never notifying
+                        state.firing = False
+                # end for
+                notifications = notifications[:allowed]
+            self._sent.extend([now] * len(notifications))
+        if notifications:
+            for alert in notifications:
+                if alert.status == FIRING:
+                    state = self._active.get((alert.rule, alert.name))
+                    if state is not None:
+                        state.notified = True
+            # end for
+            for sink in self.sinks:
+                sink.send(notifications)
+            # end for
+        return notifications
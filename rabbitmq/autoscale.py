@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Autoscaling advisor: recommends a worker count per HySDS job queue ("*-job_worker-*").
+#
+# HySDS job workers consume with a prefetch of 1, so for a job queue:
+#   * consumers is the number of workers subscribed to it,
+#   * messages_unacknowledged is the number of workers busy with a job,
+#   * message_stats.ack_details.rate is the rate jobs complete, so ack_rate / consumers is the
+#     throughput of one worker.
+# the advisor sizes the workers so that the arrival rate is served and the current backlog
+# (messages_ready) drains within target_drain seconds:
+#   arrival_rate = ack_rate + messages_ready_details.rate
+#   workers      = (arrival_rate + messages_ready / target_drain) / per_worker_rate
+# if no job has completed yet, so the per-worker rate is unknown, it adds scale_step workers while
+# there is a backlog. with no backlog, it sizes to the busy workers.
+#
+# consumer_utilisation is the fraction of time the broker could deliver to the consumers immediately.
+# while there is a backlog, a low utilisation means the workers are saturated, so adding workers drains it faster.
+# a utilisation of at least idle_utilisation means the workers are waiting for messages rather than busy,
+# so more workers would not help: the advisor does not scale up, and sizes to the busy workers instead.
+#
+# hysteresis: scale-ups are recommended immediately, scale-downs only once the lower count has
+# been wanted for down_stable consecutive evaluations, and then to the highest count wanted in that time.
+#
+# example usage:
+#   advisor = AutoscaleAdvisor(min_workers=0, max_workers=100, target_drain=600)
+#   for recommendation in advisor.evaluate(rbmq.get_queues(columns=ADVISOR_COLUMNS)):
+#       print(recommendation.to_dict())
+#   {"queue": "urgent-response-job_worker-large", "current": 10, "recommended": 25, ...}
+#
+# ---------------------------------------------------------
+
+import math
+import fnmatch
+from collections import deque, namedtuple
+
+
+# fields needed from the management API by AutoscaleAdvisor.evaluate()
+ADVISOR_COLUMNS = ('name', 'messages_ready', 'messages_unacknowledged', 'consumers', 'consumer_utilisation',
+                   'messages_ready_details.rate', 'message_stats.ack_details.rate')
+
+
+class Recommendation(namedtuple('Recommendation', ['queue', 'current', 'recommended', 'wanted', 'messages_ready',
+                                                   'messages_unacknowledged', 'ack_rate', 'consumer_utilisation', 'reason'])):
+
+    __slots__ = ()
+
+    def to_dict(self):
+        return dict(self._asdict())
+
+
+def _rate(queue, *path):
+    value = queue
+    for key in path:
+        if not isinstance(value, dict):
+            return 0.0
+        value = value.get(key)
+    return value or 0.0
+
+
+class AutoscaleAdvisor:
+
+    def __init__(self, pattern="*-job_worker-*", min_workers=0, max_workers=100, target_drain=600.0,
+                 scale_step=1, down_stable=5, idle_utilisation=0.9):
+        """
+        @param pattern: fnmatch pattern of the job queue names to advise on.
+        @param min_workers: lowest recommended worker count.
+        @param max_workers: highest recommended worker count.
+        @param target_drain: seconds in which the current backlog should be drained.
+        @param scale_step: workers to add while there is a backlog but no completed jobs to size from.
+        @param down_stable: number of consecutive evaluations a lower count must be wanted before scaling down.
+        @param idle_utilisation: consumer utilisation from which the workers of a queue with a backlog are considered idle
+                                 rather than saturated. None to ignore the consumer utilisation.
+        """
+        if min_workers < 0 or max_workers < min_workers:
+            raise ValueError("need 0 <= min_workers <= max_workers, got {} and {}".format(min_workers, max_workers))
+        if down_stable < 1:
+            raise ValueError("down_stable must be at least 1, got {}".format(down_stable))
+        self._pattern = pattern
+        self._min_workers = min_workers
+        self._max_workers = max_workers
+        self._target_drain = target_drain
+        self._scale_step = scale_step
+        self._down_stable = down_stable
+        self._idle_utilisation = idle_utilisation
+        # queue name -> deque of recent wanted counts
+        self._wanted = {}
+        # queue name -> last recommended count
+        self._recommended = {}
+
+    def _clamp(self, workers):
+        return min(max(workers, self._min_workers), self._max_workers)
+
+    def _wanted_workers(self, queue):
+        """
+        @return: tuple (wanted worker count before hysteresis, reason)
+        """
+        ready = queue.get("messages_ready") or 0
+        unacked = queue.get("messages_unacknowledged") or 0
+        consumers = queue.get("consumers") or 0
+        ack_rate = _rate(queue, "message_stats", "ack_details", "rate")
+        ready_rate = _rate(queue, "messages_ready_details", "rate")
+
+        if ready == 0:
+            # no backlog: keep the busy workers
+            return self._clamp(unacked), "no backlog"
+
+        utilisation = queue.get("consumer_utilisation")
+        if consumers > 0 and utilisation is not None and self._idle_utilisation is not None and utilisation >= self._idle_utilisation:
+            # the workers take messages as soon as they are ready, so they are not what holds the backlog back
+            return self._clamp(max(min(unacked, consumers), 1)), "consumers idle (utilisation {:.2f})".format(utilisation)
+
+        if consumers > 0 and ack_rate > 0:
+            per_worker_rate = ack_rate / consumers
+            arrival_rate = max(ack_rate + ready_rate, 0.0)
+            needed_rate = arrival_rate + ready / self._target_drain
+            return self._clamp(int(math.ceil(needed_rate / per_worker_rate))), "drain backlog in {}s".format(int(self._target_drain))
+
+        return self._clamp(max(consumers, unacked) + self._scale_step), "backlog with no completed jobs"
+
+    def evaluate(self, queues):
+        """
+        @param queues: queue dicts from RabbitMQ.get_queues(), with at least the ADVISOR_COLUMNS fields.
+        @return: list of Recommendation for the job queues, sorted by queue name
+        """
+        recommendations = []
+        seen = set()
+        for queue in queues:
+            name = queue["name"]
+            if not fnmatch.fnmatchcase(name, self._pattern):
+                continue
+            seen.add(name)
+
+            current = queue.get("consumers") or 0
+            wanted, reason = self._wanted_workers(queue)
+
+            history = self._wanted.get(name)
+            if history is None:
+                history = self._wanted[name] = deque(maxlen=self._down_stable)
+            history.append(wanted)
+
+            previous = self._recommended.get(name, current)
+            if wanted >= previous:
+                recommended = wanted
+            else:
+                # once a lower count has been wanted for the whole window, scale down to the highest count wanted in it.
+                recommended = min(max(history), previous) if len(history) == history.maxlen else previous
+                if recommended > wanted:
+                    reason = "{}, holding for scale-down".format(reason)
+            self._recommended[name] = recommended
+
+            recommendations.append(Recommendation(
+                name, current, recommended, wanted,
+                queue.get("messages_ready") or 0, queue.get("messages_unacknowledged") or 0,
+                _rate(queue, "message_stats", "ack_details", "rate"), queue.get("consumer_utilisation"), reason))
+        # end for
+
+        # forget queues that went away
+        for name in [name for name in self._recommended if name not in seen]:
+            del self._recommended[name]
+            self._wanted.pop(name, None)
+        # end for
+
+        recommendations.sort(key=lambda r: r.queue)
+        return recommendations
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# In-memory index joining connections, channels, consumers and queues, to find which worker hosts
+# hold unacked messages on which queues.
+#
+# the management API listings refer to each other by name:
+#   channel.connection_details.name      -> connection.name
+#   channel.connection_details.peer_host -> connection.peer_host
+#   consumer.channel_details.name        -> channel.name
+#   consumer.queue.name                  -> queue.name
+# the index keeps one dict per join key, built in a single pass over each listing, so every query is
+# a hashed lookup per channel rather than a nested scan. building and querying are linear in the number of channels.
+#
+# example usage:
+#   index = CorrelationIndex.from_client(rbmq)
+#   index.unacked_by_host()
+#   [HostUnacked(peer_host='100.64.1.17', unacked=12, channels=3, queues=('urgent-response-job_worker-large',)), ...]
+#   index.prefetch_hoarders()
+#   [Holder(peer_host='100.64.1.17', connection='100.64.1.17:40012 -> 127.0.0.1:5672', channel='100.64.1.17:40012 -> 127.0.0.1:5672 (1)',
+#           user='hysdsops', queues=('urgent-response-job_worker-large',), unacked=10, prefetch=0), ...]
+#
+# ---------------------------------------------------------
+
+from collections import namedtuple
+
+
+# columns needed from the management API by CorrelationIndex
+CONNECTION_INDEX_COLUMNS = ('name', 'peer_host', 'user', 'state', 'client_properties.product')
+CHANNEL_INDEX_COLUMNS = ('name', 'number', 'user', 'state', 'prefetch_count', 'global_prefetch_count',
+                         'messages_unacknowledged', 'consumer_count',
+                         'connection_details.name', 'connection_details.peer_host')
+CONSUMER_INDEX_COLUMNS = ('consumer_tag', 'prefetch_count', 'ack_required', 'active',
+                          'channel_details.name', 'channel_details.connection_name', 'channel_details.peer_host', 'queue.name')
+QUEUE_INDEX_COLUMNS = ('name', 'state', 'messages_ready', 'messages_unacknowledged', 'consumers')
+
+Holder = namedtuple('Holder', ['peer_host', 'connection', 'channel', 'user', 'queues', 'unacked', 'prefetch'])
+HostUnacked = namedtuple('HostUnacked', ['peer_host', 'unacked', 'channels', 'queues'])
+
+
+def _nested(item, key, field):
+    value = item.get(key)
+    return value.get(field) if isinstance(value, dict) else None
+
+
+class CorrelationIndex:
+
+    def __init__(self, connections=(), channels=(), consumers=(), queues=()):
+        """
+        @param connections: connection dicts, e.g. from RabbitMQ.get_connections(columns=CONNECTION_INDEX_COLUMNS)
+        @param channels: channel dicts, e.g. from RabbitMQ.get_channels(columns=CHANNEL_INDEX_COLUMNS)
+        @param consumers: consumer dicts, e.g. from RabbitMQ.get_consumers(columns=CONSUMER_INDEX_COLUMNS)
+        @param queues: queue dicts, e.g. from RabbitMQ.get_queues(columns=QUEUE_INDEX_COLUMNS)
+        """
+        # name -> dict
+        self.connections = {}
+        self.channels = {}
+        self.queues = {}
+        # join keys -> list of names or dicts
+        self.connections_by_host = {}
+        self.channels_by_connection = {}
+        self.consumers_by_channel = {}
+        self.consumers_by_queue = {}
+
+        for connection in connections:
+            self.connections[connection["name"]] = connection
+            self.connections_by_host.setdefault(connection.get("peer_host"), []).append(connection["name"])
+        # end for
+        for channel in channels:
+            self.channels[channel["name"]] = channel
+            self.channels_by_connection.setdefault(_nested(channel, "connection_details", "name"), []).append(channel["name"])
+        # end for
+        for consumer in consumers:
+            self.consumers_by_channel.setdefault(_nested(consumer, "channel_details", "name"), []).append(consumer)
+            self.consumers_by_queue.setdefault(_nested(consumer, "queue", "name"), []).append(consumer)
+        # end for
+        for queue in queues:
+            self.queues[queue["name"]] = queue
+        # end for
+
+    @classmethod
+    def from_client(cls, rbmq, queues=True):
+        """
+        fetches the listings with only the columns the index needs.
+        @param rbmq: RabbitMQ client
+        @param queues: also fetch the queues, for their depth in the query results.
+        @return: CorrelationIndex
+        """
+        return cls(rbmq.iter_connections(columns=CONNECTION_INDEX_COLUMNS),
+                   rbmq.iter_channels(columns=CHANNEL_INDEX_COLUMNS),
+                   rbmq.get_consumers(columns=CONSUMER_INDEX_COLUMNS),
+                   rbmq.iter_queues(columns=QUEUE_INDEX_COLUMNS) if queues else ())
+
+    def peer_host(self, channel_name):
+        """
+        @return: peer host of a channel's connection, or None
+        """
+        channel = self.channels.get(channel_name)
+        if channel is None:
+            return None
+        peer_host = _nested(channel, "connection_details", "peer_host")
+        if peer_host is None:
+            connection = self.connections.get(_nested(channel, "connection_details", "name"))
+            peer_host = connection.get("peer_host") if connection else None
+        return peer_host
+
+    def channel_queues(self, channel_name):
+        """
+        @return: sorted tuple of the names of the queues a channel consumes from
+        """
+        return tuple(sorted(set(_nested(c, "queue", "name") for c in self.consumers_by_channel.get(channel_name, ()))))
+
+    def prefetch(self, channel_name):
+        """
+        effective prefetch limit of a channel: the lowest non-zero consumer or channel prefetch count.
+        @return: prefetch count, or 0 if unlimited
+        """
+        channel = self.channels.get(channel_name) or {}
+        limits = [c.get("prefetch_count") or 0 for c in self.consumers_by_channel.get(channel_name, ())]
+        limits.append(channel.get("prefetch_count") or 0)
+        limits.append(channel.get("global_prefetch_count") or 0)
+        limits = [limit for limit in limits if limit > 0]
+        return min(limits) if limits else 0
+
+    def holder(self, channel_name):
+        """
+        @return: Holder of a channel
+        """
+        channel = self.channels[channel_name]
+        return Holder(self.peer_host(channel_name), _nested(channel, "connection_details", "name"), channel_name,
+                      channel.get("user"), self.channel_queues(channel_name),
+                      channel.get("messages_unacknowledged") or 0, self.prefetch(channel_name))
+
+    def holders(self, queue_name):
+        """
+        @return: list of Holder of the channels consuming from a queue, most unacked messages first
+        """
+        channel_names = set(_nested(c, "channel_details", "name") for c in self.consumers_by_queue.get(queue_name, ()))
+        holders = [self.holder(name) for name in channel_names if name in self.channels]
+        holders.sort(key=lambda h: (-h.unacked, h.channel))
+        return holders
+
+    def channels_of_host(self, peer_host):
+        """
+        @return: list of the names of the channels on the connections from a host
+        """
+        names = []
+        for connection_name in self.connections_by_host.get(peer_host, ()):
+            names.extend(self.channels_by_connection.get(connection_name, ()))
+        # end for
+        return names
+
+    def unacked_by_host(self):
+        """
+        @return: list of HostUnacked of the hosts holding unacked messages, most unacked first
+        """
+        totals = {}
+        for channel_name, channel in self.channels.items():
+            unacked = channel.get("messages_unacknowledged") or 0
+            if not unacked:
+                continue
+            peer_host = self.peer_host(channel_name)
+            entry = totals.get(peer_host)
+            if entry is None:
+                entry = totals[peer_host] = [0, 0, set()]
+            entry[0] += unacked
+            entry[1] += 1
+            entry[2].update(self.channel_queues(channel_name))
+        # end for
+        result = [HostUnacked(host, unacked, channels, tuple(sorted(queues))) for host, (unacked, channels, queues) in totals.items()]
+        result.sort(key=lambda h: (-h.unacked, str(h.peer_host)))
+        return result
+
+    def prefetch_hoarders(self, max_prefetch=1):
+        """
+        channels holding more unacked messages than max_prefetch, or holding any with an unlimited prefetch.
+        HySDS workers consume with a prefetch of 1, so a job worker holding more is starving the other workers of its queues.
+        @return: list of Holder, most unacked first
+        """
+        hoarders = []
+        for channel_name, channel in self.channels.items():
+            unacked = channel.get("messages_unacknowledged") or 0
+            if not unacked:
+                continue
+            prefetch = self.prefetch(channel_name)
+            if unacked > max_prefetch or prefetch == 0 or prefetch > max_prefetch:
+                hoarders.append(self.holder(channel_name))
+        # end for
+        hoarders.sort(key=lambda h: (-h.unacked, h.channel))
+        return hoarders
+
+    def idle_consumers(self, queue_name=None):
+        """
+        channels consuming from a queue with messages ready, but holding no unacked messages, e.g. stuck workers.
+        @param queue_name: (optional) only this queue. if not specified, all queues with messages ready.
+        @return: list of Holder
+        """
+        if queue_name is not None:
+            queue_names = [queue_name]
+        else:
+            queue_names = [name for name, queue in self.queues.items() if queue.get("messages_ready")]
+        idle = []
+        for name in queue_names:
+            idle.extend(h for h in self.holders(name) if h.unacked == 0)
+        # end for
+        return idle
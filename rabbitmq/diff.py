@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Keyed incremental diff of queue or connection tuples between polls.
+#
+# unlike a set difference of whole tuples, DiffEngine keys records by name and reports:
+#   * "added" events with all fields of a name seen for the first time,
+#   * "changed" events with only the fields that changed,
+#   * "removed" events for names that disappeared.
+# numeric fields can have an absolute or relative deadband, so that jitter such as connection
+# byte rates moving by a few percent does not count as a change. deadbands are measured against
+# the last reported value, so slow drift is still reported once it exceeds the deadband.
+#
+# example usage:
+#   engine = DiffEngine(CONNECTION_FIELDS, rel_deadbands={"send_rate": 0.1, "recv_rate": 0.1})
+#   for event in engine.update(RabbitMQ.connection_to_tuple(c) for c in connections):
+#       print(event)
+#   DiffEvent(kind='changed', name='127.0.0.1:46542 -> 127.0.0.1:5672', changes={'send_rate': 45.6})
+#
+# ---------------------------------------------------------
+
+from collections import namedtuple
+
+
+# names of the fields after the name in RabbitMQ.queue_to_tuple() and RabbitMQ.connection_to_tuple()
+QUEUE_FIELDS = ('state', 'messages_ready', 'messages_unacknowledged')
+CONNECTION_FIELDS = ('state', 'send_rate', 'recv_rate')
+
+# fields that are not numbers, so they can not have a deadband
+TEXT_FIELDS = ('state',)
+
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+DiffEvent = namedtuple('DiffEvent', ['kind', 'name', 'changes'])
+
+
+def parse_deadband(spec):
+    """
+    parses a "field:abs:value" or "field:rel:value" command line option.
+    @return: tuple (field, mode, value)
+    """
+    try:
+        field, mode, value = spec.split(":")
+        value = float(value)
+    except ValueError:
+        raise ValueError("deadband {} is not of the form field:abs|rel:value".format(spec))
+    if mode not in ("abs", "rel"):
+        raise ValueError("deadband {} mode must be abs or rel".format(spec))
+    return (field, mode, value)
+
+
+class DiffEngine:
+
+    def __init__(self, fields, abs_deadbands=None, rel_deadbands=None):
+        """
+        @param fields: names of the tuple fields after the name, e.g. QUEUE_FIELDS
+        @param abs_deadbands: (optional) dict {field: min absolute change to report}
+        @param rel_deadbands: (optional) dict {field: min change to report, as a fraction of the last reported value}
+        """
+        self._fields = tuple(fields)
+        abs_deadbands = abs_deadbands or {}
+        rel_deadbands = rel_deadbands or {}
+        for field in list(abs_deadbands) + list(rel_deadbands):
+            if field not in self._fields or field in TEXT_FIELDS:
+                raise ValueError("unknown deadband field {}. choose from {}".format(
+                    field, tuple(f for f in self._fields if f not in TEXT_FIELDS)))
+        # per field position: (abs deadband, rel deadband), or None to compare exactly
+        self._deadbands = tuple(
+            (abs_deadbands.get(f, 0.0), rel_deadbands.get(f, 0.0)) if (f in abs_deadbands or f in rel_deadbands) else None
+            for f in self._fields
+        )
+        # name -> list of last reported field values
+        self._reported = {}
+
+    @property
+    def fields(self):
+        return self._fields
+
+    def _significant(self, i, old, new):
+        deadband = self._deadbands[i]
+        if deadband is None or not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            return old != new
+        abs_deadband, rel_deadband = deadband
+        delta = abs(new - old)
+        return delta > abs_deadband and delta > rel_deadband * abs(old)
+
+    def update(self, tuples):
+        """
+        diffs one poll's tuples (name, field1, field2, ...) against the last reported state.
+        @return: list of DiffEvent
+        """
+        events = []
+        reported = self._reported
+        fields = self._fields
+        seen = set()
+
+        for t in tuples:
+            name = t[0]
+            seen.add(name)
+            values = t[1:]
+            last = reported.get(name)
+            if last is None:
+                reported[name] = list(values)
+                events.append(DiffEvent(ADDED, name, dict(zip(fields, values))))
+                continue
+
+            changes = None
+            for i, value in enumerate(values):
+                if last[i] != value and self._significant(i, last[i], value):
+                    if changes is None:
+                        changes = {}
+                    changes[fields[i]] = value
+                    last[i] = value
+            # end for
+            if changes:
+                events.append(DiffEvent(CHANGED, name, changes))
+        # end for
+
+        for name in [name for name in reported if name not in seen]:
+            del reported[name]
+            events.append(DiffEvent(REMOVED, name, {}))
+        # end for
+
+        return events
+
+    def state(self):
+        """
+        @return: dict {name: dict of last reported fields}
+        """
+        return {name: dict(zip(self._fields, values)) for name, values in self._reported.items()}
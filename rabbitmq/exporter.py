@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Prometheus exporter for RabbitMQ queue and connection state.
+#
+# serves a /metrics endpoint in the Prometheus text exposition format, from a snapshot cache:
+#   * a snapshot is reused for <ttl> seconds, so scrape frequency does not translate into management API load.
+#   * when the snapshot is stale, concurrent scrapes are coalesced: one scrape fetches from the
+#     management API and the others wait for its result instead of fetching too.
+#
+# example usage:
+#   exporter = MetricsExporter(RabbitMQ(endpoint, username, passwd), ttl=5)
+#   exporter.serve("0.0.0.0", 9419)
+#
+# example output:
+#   rabbitmq_queue_messages_ready{queue="jobs_processed"} 0
+#   rabbitmq_queue_messages_unacknowledged{queue="jobs_processed"} 1
+#   rabbitmq_queue_consumers{queue="jobs_processed"} 4
+#   rabbitmq_queue_state{queue="jobs_processed",state="running"} 1
+#   rabbitmq_connection_send_rate_bytes{connection="127.0.0.1:41446 -> 127.0.0.1:5672",peer_host="127.0.0.1",user="hysdsops"} 45.6
+#   rabbitmq_connection_state{connection="127.0.0.1:41446 -> 127.0.0.1:5672",state="running"} 1
+#
+# the state is its own info-style gauge rather than a label of the numeric gauges, so that a state
+# change (e.g. running -> flow) does not start new time series of the counts and rates.
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# fields needed from the management API to build the metrics
+QUEUE_METRIC_COLUMNS = ('name', 'state', 'messages_ready', 'messages_unacknowledged', 'consumers')
+CONNECTION_METRIC_COLUMNS = ('name', 'state', 'peer_host', 'user', 'channels', 'send_oct_details.rate', 'recv_oct_details.rate')
+
+
+class SnapshotCache:
+    """
+    caches the result of fetch() for ttl seconds, and coalesces concurrent refreshes into one fetch().
+    """
+
+    def __init__(self, fetch, ttl=5.0, clock=time.monotonic):
+        """
+        @param fetch: callable returning a new snapshot.
+        @param ttl: seconds a snapshot is served before it is refetched.
+        """
+        self._fetch = fetch
+        self._ttl = ttl
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._value = None
+        self._error = None
+        self._fetched_at = None
+        self._generation = 0
+        self._inflight = False
+        self.fetches = 0
+
+    def get(self):
+        """
+        @return: tuple (snapshot, age in seconds). raises the fetch error if the coalesced fetch failed.
+        """
+        with self._condition:
+            while True:
+                now = self._clock()
+                if self._fetched_at is not None and self._error is None and now - self._fetched_at < self._ttl:
+                    return self._value, now - self._fetched_at
+                if not self._inflight:
+                    break
+                # another caller is fetching. wait for its result rather than fetching again.
+                generation = self._generation
+                while self._inflight and self._generation == generation:
+                    self._condition.wait()
+                if self._error is not None:
+                    raise self._error
+            # end while
+            self._inflight = True
+
+        value = None
+        error = None
+        try:
+            value = self._fetch()
+        except Exception as e:
+            error = e
+
+        with self._condition:
+            self.fetches += 1
+            self._inflight = False
+            self._generation += 1
+            self._error = error
+            if error is None:
+                self._value = value
+                self._fetched_at = self._clock()
+            self._condition.notify_all()
+
+        if error is not None:
+            raise error
+        return value, 0.0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return ",".join(['{}="{}"'.format(k, _escape(v)) for k, v in labels.items()])
+
+
+def _number(value):
+    # missing stats (e.g. rates while stats are being collected) are reported as NaN
+    return "NaN" if value is None else value
+
+
+def format_metrics(queues, connections):
+    """
+    formats queue and connection dicts in the Prometheus text exposition format.
+    @return: str
+    """
+    lines = []
+    append = lines.append
+
+    queue_metrics = (
+        ("rabbitmq_queue_messages_ready", "Number of messages ready to be delivered.", "messages_ready"),
+        ("rabbitmq_queue_messages_unacknowledged", "Number of messages delivered but not yet acknowledged.", "messages_unacknowledged"),
+        ("rabbitmq_queue_consumers", "Number of consumers.", "consumers"),
+    )
+    queue_labels = [_labels(queue=q["name"]) for q in queues]
+    for metric, help_text, field in queue_metrics:
+        append("# HELP {} {}".format(metric, help_text))
+        append("# TYPE {} gauge".format(metric))
+        for labels, queue in zip(queue_labels, queues):
+            append("{}{{{}}} {}".format(metric, labels, _number(queue.get(field))))
+        # end for
+    # end for
+
+    append("# HELP rabbitmq_queue_state Current state of the queue, e.g. running, idle, flow.")
+    append("# TYPE rabbitmq_queue_state gauge")
+    for queue in queues:
+        append("rabbitmq_queue_state{{{}}} 1".format(_labels(queue=queue["name"], state=queue.get("state", ""))))
+    # end for
+
+    connection_metrics = (
+        ("rabbitmq_connection_send_rate_bytes", "Bytes per second sent to the client.", "send_oct_details"),
+        ("rabbitmq_connection_recv_rate_bytes", "Bytes per second received from the client.", "recv_oct_details"),
+    )
+    connection_labels = [_labels(connection=c["name"], peer_host=c.get("peer_host", ""), user=c.get("user", ""))
+                         for c in connections]
+    for metric, help_text, field in connection_metrics:
+        append("# HELP {} {}".format(metric, help_text))
+        append("# TYPE {} gauge".format(metric))
+        for labels, connection in zip(connection_labels, connections):
+            append("{}{{{}}} {}".format(metric, labels, _number((connection.get(field) or {}).get("rate"))))
+        # end for
+    # end for
+
+    append("# HELP rabbitmq_connection_channels Number of channels on the connection.")
+    append("# TYPE rabbitmq_connection_channels gauge")
+    for labels, connection in zip(connection_labels, connections):
+        append("rabbitmq_connection_channels{{{}}} {}".format(labels, _number(connection.get("channels"))))
+    # end for
+
+    append("# HELP rabbitmq_connection_state Current state of the connection, e.g. running, blocked, flow.")
+    append("# TYPE rabbitmq_connection_state gauge")
+    for connection in connections:
+        append("rabbitmq_connection_state{{{}}} 1".format(_labels(connection=connection["name"], state=connection.get("state", ""))))
+    # end for
+
+    append("")
+    return "\n".join(lines)
+
+
+class MetricsExporter:
+
+    def __init__(self, rbmq, ttl=5.0, queues=True, connections=True):
+        """
+        @param rbmq: RabbitMQ client
+        @param ttl: seconds a snapshot is served before the management API is queried again.
+        @param queues: export queue metrics.
+        @param connections: export connection metrics.
+        """
+        self._rbmq = rbmq
+        self._queues = queues
+        self._connections = connections
+        self.cache = SnapshotCache(self._fetch, ttl)
+
+    def _fetch(self):
+        started = time.monotonic()
+        queues = list(self._rbmq.iter_queues(columns=QUEUE_METRIC_COLUMNS)) if self._queues else []
+        connections = list(self._rbmq.iter_connections(columns=CONNECTION_METRIC_COLUMNS)) if self._connections else []
+        body = format_metrics(queues, connections)
+        return body, time.monotonic() - started
+
+    def render(self):
+        """
+        @return: str of the /metrics response body
+        """
+        try:
+            (body, fetch_seconds), age = self.cache.get()
+            up = 1
+        except Exception as e:
+            logger.error( "fetching metrics failed: {!r}".format(e) )
+            body, fetch_seconds, age, up = "", 0.0, 0.0, 0
+
+        return body + "\n".join([
+            "# HELP rabbitmq_up Whether the last fetch from the management API succeeded.",
+            "# TYPE rabbitmq_up gauge",
+            "rabbitmq_up {}".format(up),
+            "# HELP rabbitmq_exporter_fetch_duration_seconds Duration of the fetch that produced the served snapshot.",
+            "# TYPE rabbitmq_exporter_fetch_duration_seconds gauge",
+            "rabbitmq_exporter_fetch_duration_seconds {:.6f}".format(fetch_seconds),
+            "# HELP rabbitmq_exporter_snapshot_age_seconds Age of the served snapshot.",
+            "# TYPE rabbitmq_exporter_snapshot_age_seconds gauge",
+            "rabbitmq_exporter_snapshot_age_seconds {:.6f}".format(age),
+            "# HELP rabbitmq_exporter_fetches_total Number of fetches from the management API.",
+            "# TYPE rabbitmq_exporter_fetches_total counter",
+            "rabbitmq_exporter_fetches_total {}".format(self.cache.fetches),
+            "",
+        ])
+
+    def make_server(self, host="0.0.0.0", port=9419):
+        """
+        @return: ThreadingHTTPServer serving /metrics
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+    def serve(self, host="0.0.0.0", port=9419):
+        """
+        serves /metrics until interrupted.
+        """
+        server = self.make_server(host, port)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
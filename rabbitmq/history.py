@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# In-memory time series of recent queue samples, with derived rates and time-to-drain.
+#
+# each queue keeps a fixed-size ring buffer of (timestamp, messages_ready, messages_unacknowledged)
+# samples in array.array storage, so memory is bounded by window * number of queues.
+# running sums are updated as samples enter and leave the window, so computing the stats of a
+# queue is O(1) regardless of the window size.
+#
+# derived stats, over the samples in the window:
+#   ingress_rate:  messages/s added to the queue, from increases of messages_ready + messages_unacknowledged
+#   egress_rate:   messages/s acked off the queue, from decreases of messages_ready + messages_unacknowledged
+#   net_rate:      ingress_rate - egress_rate
+#   ready_avg:     moving average of messages_ready
+#   unacked_avg:   moving average of messages_unacknowledged
+#   time_to_drain: seconds until the queue is empty at the current net rate, or inf if it is not draining
+# rates are lower bounds since they are derived from counts sampled at the polling interval.
+#
+# example usage:
+#   history = QueueHistory(window=60)
+#   history.record(time.time(), queue_tuples)
+#   history.stats("urgent-response-job_worker-large")
+#   QueueStats(samples=60, ready=13090, unacked=0, ingress_rate=12.3, egress_rate=0.0, net_rate=12.3, ready_avg=12650.5, unacked_avg=0.0, time_to_drain=inf)
+#
+# ---------------------------------------------------------
+
+from array import array
+from collections import namedtuple
+
+
+QueueStats = namedtuple('QueueStats', ['samples', 'ready', 'unacked', 'ingress_rate', 'egress_rate', 'net_rate',
+                                       'ready_avg', 'unacked_avg', 'time_to_drain'])
+
+# names of the stats appended to queue tuples by QueueHistory.extend_tuple()
+HISTORY_FIELDS = ('ingress_rate', 'egress_rate', 'ready_avg', 'time_to_drain')
+
+
+class _Ring:
+
+    __slots__ = ('times', 'ready', 'unacked', 'increase', 'decrease', 'head', 'count',
+                 'sum_ready', 'sum_unacked', 'sum_increase', 'sum_decrease')
+
+    def __init__(self, window):
+        self.times = array('d', bytes(8 * window))
+        self.ready = array('q', bytes(8 * window))
+        self.unacked = array('q', bytes(8 * window))
+        # increase/decrease of ready + unacked since the previous sample
+        self.increase = array('q', bytes(8 * window))
+        self.decrease = array('q', bytes(8 * window))
+        self.head = 0
+        self.count = 0
+        self.sum_ready = 0
+        self.sum_unacked = 0
+        self.sum_increase = 0
+        self.sum_decrease = 0
+
+
+class QueueHistory:
+
+    def __init__(self, window=60):
+        """
+        @param window: number of samples kept per queue.
+        """
+        if window < 2:
+            raise ValueError("window must be at least 2 samples, got {}".format(window))
+        self._window = window
+        self._rings = {}
+
+    def __len__(self):
+        return len(self._rings)
+
+    def __contains__(self, name):
+        return name in self._rings
+
+    def names(self):
+        return list(self._rings)
+
+    def add_sample(self, name, timestamp, ready, unacked):
+        """
+        appends one sample of a queue, evicting its oldest sample if the window is full.
+        """
+        ring = self._rings.get(name)
+        if ring is None:
+            ring = self._rings[name] = _Ring(self._window)
+
+        window = self._window
+        i = ring.head
+        if ring.count:
+            last = (i - 1) % window
+            delta = (ready + unacked) - (ring.ready[last] + ring.unacked[last])
+        else:
+            delta = 0
+
+        if ring.count == window:
+            # evict the oldest sample, which is in the slot being overwritten
+            ring.sum_ready -= ring.ready[i]
+            ring.sum_unacked -= ring.unacked[i]
+            ring.sum_increase -= ring.increase[i]
+            ring.sum_decrease -= ring.decrease[i]
+        else:
+            ring.count += 1
+
+        increase = delta if delta > 0 else 0
+        decrease = -delta if delta < 0 else 0
+        ring.times[i] = timestamp
+        ring.ready[i] = ready
+        ring.unacked[i] = unacked
+        ring.increase[i] = increase
+        ring.decrease[i] = decrease
+        ring.sum_ready += ready
+        ring.sum_unacked += unacked
+        ring.sum_increase += increase
+        ring.sum_decrease += decrease
+        ring.head = (i + 1) % window
+
+    def record(self, timestamp, tuples, prune=True):
+        """
+        appends one poll of queue tuples (queue_name, queue_state, messages_ready, messages_unacknowledged).
+        @param timestamp: seconds, e.g. time.time()
+        @param prune: forget queues that are not in this poll, e.g. deleted queues.
+        """
+        seen = set()
+        for t in tuples:
+            seen.add(t[0])
+            self.add_sample(t[0], timestamp, t[2], t[3])
+        # end for
+        if prune:
+            for name in [name for name in self._rings if name not in seen]:
+                del self._rings[name]
+            # end for
+
+    def stats(self, name):
+        """
+        @return: QueueStats of the queue, or None if it has no samples.
+        """
+        ring = self._rings.get(name)
+        if ring is None:
+            return None
+
+        window = self._window
+        count = ring.count
+        newest = (ring.head - 1) % window
+        oldest = (ring.head - count) % window
+        ready = ring.ready[newest]
+        unacked = ring.unacked[newest]
+
+        span = ring.times[newest] - ring.times[oldest]
+        if span > 0:
+            # the oldest sample's delta is relative to a sample that already left the window
+            ingress_rate = (ring.sum_increase - ring.increase[oldest]) / span
+            egress_rate = (ring.sum_decrease - ring.decrease[oldest]) / span
+        else:
+            ingress_rate = 0.0
+            egress_rate = 0.0
+        net_rate = ingress_rate - egress_rate
+
+        total = ready + unacked
+        if total == 0:
+            time_to_drain = 0.0
+        elif net_rate < 0:
+            time_to_drain = total / -net_rate
+        else:
+            time_to_drain = float('inf')
+
+        return QueueStats(count, ready, unacked, ingress_rate, egress_rate, net_rate,
+                          ring.sum_ready / count, ring.sum_unacked / count, time_to_drain)
+
+    def all_stats(self):
+        """
+        @return: dict {queue_name: QueueStats}
+        """
+        return {name: self.stats(name) for name in self._rings}
+
+    def series(self, name):
+        """
+        @return: list of (timestamp, messages_ready, messages_unacknowledged) samples of the queue, oldest first.
+        """
+        ring = self._rings.get(name)
+        if ring is None:
+            return []
+        window = self._window
+        start = (ring.head - ring.count) % window
+        return [(ring.times[j], ring.ready[j], ring.unacked[j])
+                for j in ((start + k) % window for k in range(ring.count))]
+
+    def extend_tuple(self, queue_tuple):
+        """
+        appends the HISTORY_FIELDS stats to a queue tuple, rounded for output.
+        @return: tuple (queue_name, queue_state, messages_ready, messages_unacknowledged, ingress_rate, egress_rate, ready_avg, time_to_drain)
+        """
+        stats = self.stats(queue_tuple[0])
+        if stats is None:
+            return tuple(queue_tuple) + (0.0, 0.0, float(queue_tuple[2]), float('inf'))
+        return tuple(queue_tuple) + (round(stats.ingress_rate, 3), round(stats.egress_rate, 3),
+                                     round(stats.ready_avg, 3), round(stats.time_to_drain, 1))
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Low-overhead instrumentation of the polling hot path: where the time of a poll cycle goes.
+#
+#   Histogram:    fixed log-spaced buckets (4 per power of 2), so recording is one log2 and one
+#                 increment, and percentiles are read from the buckets with ~19% resolution.
+#   PhaseStats:   a histogram per phase and counters, e.g. the RabbitMQ client's
+#                 http (round trip to the response headers, or the whole body when not streamed),
+#                 read (streamed body reads), decode (json), requests, retries, payload_bytes, records,
+#                 and a monitor's cycle, fetch, convert, diff, store, alerts, write, cycles, missed_deadlines.
+#   timed_map:    maps a conversion such as RabbitMQ.queue_to_tuple over a streamed listing, timing the
+#                 conversion and the wait for the next record separately.
+#   PollCycle:    times whole cycles, counts the ones that overran the poll interval, logs a periodic
+#                 stats line, and optionally profiles the slowest cycles.
+#   SlowCycleProfiles: opt-in sampling profiler. a background thread samples the polling thread's stack
+#                 every few milliseconds while a cycle runs. the samples of the slowest cycles are kept as
+#                 folded stacks ("outer;inner;leaf count" lines), e.g. for flamegraph.pl or speedscope.
+#
+# example usage:
+#   cycle = PollCycle(PhaseStats(), interval=10, client_stats=rbmq.stats, report_interval=60,
+#                     profiles=SlowCycleProfiles("/tmp/profiles", keep=5))
+#   cycle.begin()
+#   current = set(timed_map(RabbitMQ.queue_to_tuple, rbmq.iter_queues(columns=...), cycle.stats, "convert", "fetch"))
+#   with cycle.stats.phase("write"):
+#       sink.write_cycle(now, new)
+#   cycle.end()
+#   stats: cycles=6 missed_deadlines=0 records=1750 | cycle p50=21.0ms p99=30.4ms max=30.4ms | fetch p50=11.3ms ...
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import math
+import time
+import heapq
+import threading
+from collections import Counter
+
+
+class Histogram:
+
+    __slots__ = ('_lowest', '_per_octave', 'buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self, lowest=1e-6, highest=1e3, per_octave=4):
+        """
+        @param lowest: upper bound of the first bucket. smaller values go to the first bucket.
+        @param highest: values above this go to the last bucket.
+        @param per_octave: buckets per power of 2.
+        """
+        self._lowest = lowest
+        self._per_octave = per_octave
+        self.buckets = [0] * (int(math.log2(highest / lowest) * per_octave) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        if value > self._lowest:
+            i = min(int(math.log2(value / self._lowest) * self._per_octave) + 1, len(self.buckets) - 1)
+        else:
+            i = 0
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def _upper(self, i):
+        return self._lowest * 2 ** (i / self._per_octave)
+
+    def percentile(self, p):
+        """
+        @param p: percentile in [0, 100]
+        @return: upper bound of the bucket holding the p-th percentile, capped by the max. None if empty.
+        """
+        if not self.count:
+            return None
+        rank = max(math.ceil(self.count * p / 100.0), 1)
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(self._upper(i), self.max)
+        # end for
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        return {"count": self.count, "total": self.total, "mean": self.mean, "min": self.min,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99), "max": self.max}
+
+
+class _Phase:
+
+    __slots__ = ('_stats', '_name', '_started')
+
+    def __init__(self, stats, name):
+        self._stats = stats
+        self._name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats.record(self._name, time.perf_counter() - self._started)
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    if seconds < 1.0:
+        return "{:.1f}ms".format(seconds * 1000)
+    return "{:.2f}s".format(seconds)
+
+
+class PhaseStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # phase -> Histogram of seconds, in order of first use
+        self.phases = {}
+        self.counters = {}
+        self.started = time.time()
+
+    def record(self, phase, seconds):
+        with self._lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram()
+            histogram.record(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def phase(self, name):
+        """
+        @return: context manager recording the time spent in its block as phase name
+        """
+        return _Phase(self, name)
+
+    def total(self, *phases):
+        """
+        @return: seconds spent in the given phases so far
+        """
+        with self._lock:
+            return sum(self.phases[p].total for p in phases if p in self.phases)
+
+    def reset(self):
+        with self._lock:
+            self.phases = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def to_dict(self):
+        """
+        @return: dict {"since": epoch seconds, "phases": {phase: histogram dict in seconds}, "counters": {name: count}}
+        """
+        with self._lock:
+            return {"since": self.started,
+                    "phases": dict((name, h.to_dict()) for name, h in self.phases.items()),
+                    "counters": dict(self.counters)}
+
+    def format_line(self):
+        """
+        @return: one line "name=count ... | phase p50=.. p99=.. max=.. | ..."
+        """
+        with self._lock:
+            parts = [" ".join("{}={}".format(name, n) for name, n in self.counters.items())]
+            for name, h in self.phases.items():
+                parts.append("{} p50={} p99={} max={} n={}".format(name, _format_seconds(h.percentile(50)),
+                                                                    _format_seconds(h.percentile(99)), _format_seconds(h.max), h.count))
+            # end for
+        return " | ".join(p for p in parts if p)
+
+
+def timed_map(func, items, stats, phase="convert", source_phase=None):
+    """
+    yields func(item) for each item, recording the total time spent in func as one phase sample,
+    and if source_phase is given, the time spent waiting for items (e.g. streamed http reads and decoding) as another.
+    the number of items is counted as "records".
+    """
+    clock = time.perf_counter
+    converting = 0.0
+    waiting = 0.0
+    n = 0
+    # the time the consumer spends between items counts as neither
+    started = clock()
+    for item in items:
+        converted = clock()
+        result = func(item)
+        done = clock()
+        converting += done - converted
+        waiting += converted - started
+        n += 1
+        yield result
+        started = clock()
+    # end for
+    waiting += clock() - started
+    stats.record(phase, converting)
+    if source_phase:
+        stats.record(source_phase, waiting)
+    stats.count("records", n)
+
+
+class SamplingProfiler:
+    """
+    samples the stack of one thread from a background thread, without tracing every call like cProfile.
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        @param interval: seconds between samples.
+        """
+        self._interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self.samples = Counter()
+
+    def _run(self, ident):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            # end while
+            self.samples[";".join(reversed(stack))] += 1
+        # end while
+
+    def start(self, ident=None):
+        """
+        @param ident: (optional) thread id to sample. (default=the calling thread)
+        """
+        self.samples = Counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(ident or threading.get_ident(),), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        @return: Counter {folded stack: samples}
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.samples
+
+
+class SlowCycleProfiles:
+    """
+    keeps the sampled profiles of the slowest cycles as folded stack files in a directory.
+    """
+
+    def __init__(self, directory, keep=5, interval=0.005, min_seconds=0.0):
+        """
+        @param directory: where to write the profiles. created if missing.
+        @param keep: number of slowest cycles to keep.
+        @param interval: seconds between stack samples.
+        @param min_seconds: only keep cycles at least this long.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._keep = keep
+        self._min_seconds = min_seconds
+        self._profiler = SamplingProfiler(interval)
+        # min-heap of (seconds, path)
+        self._slowest = []
+
+    def begin(self):
+        self._profiler.start()
+
+    def end(self, seconds, label="cycle"):
+        """
+        stops sampling, and writes the profile if the cycle is one of the slowest so far.
+        @return: path of the written profile, or None
+        """
+        samples = self._profiler.stop()
+        if seconds < self._min_seconds or not samples:
+            return None
+        if len(self._slowest) >= self._keep and seconds <= self._slowest[0][0]:
+            return None
+        path = os.path.join(self._directory, "{}-{}-{}ms.folded".format(
+            label, time.strftime("%Y%m%dT%H%M%S"), int(seconds * 1000)))
+        with open(path, "w") as f:
+            f.write("".join("{} {}\n".format(stack, n) for stack, n in samples.most_common()))
+        heapq.heappush(self._slowest, (seconds, path))
+        if len(self._slowest) > self._keep:
+            _, evicted = heapq.heappop(self._slowest)
+            try:
+                os.unlink(evicted)
+            except OSError:
+                pass
+        logger.info("profiled {}s {} to {}".format(round(seconds, 3), label, path))
+        return path
+
+
+class PollCycle:
+    """
+    times the cycles of a polling loop.
+    """
+
+    def __init__(self, stats, interval, client_stats=None, report_interval=0, profiles=None, label="cycle"):
+        """
+        @param stats: PhaseStats of the loop.
+        @param interval: poll interval in seconds. cycles longer than this count as missed deadlines.
+        @param client_stats: (optional) PhaseStats of the RabbitMQ client, appended to the stats line.
+        @param report_interval: seconds between stats lines logged at info level. 0 disables them.
+        @param profiles: (optional) SlowCycleProfiles.
+        @param label: name of the loop in the stats line and profile file names, e.g. "queues".
+        """
+        self.stats = stats
+        self.interval = interval
+        self._client_stats = client_stats
+        self._report_interval = report_interval
+        self._profiles = profiles
+        self._label = label
+        self._started = None
+        self._last_report = time.monotonic()
+
+    def begin(self):
+        self._started = time.perf_counter()
+        if self._profiles is not None:
+            self._profiles.begin()
+
+    def end(self):
+        """
+        @return: seconds the cycle took
+        """
+        seconds = time.perf_counter() - self._started
+        self.stats.record("cycle", seconds)
+        self.stats.count("cycles")
+        if self.interval and seconds > self.interval:
+            self.stats.count("missed_deadlines")
+            logger.warning("{} took {:.2f}s, longer than its {}s interval".format(self._label, seconds, self.interval))
+        if self._profiles is not None:
+            self._profiles.end(seconds, self._label)
+        if self._report_interval and time.monotonic() - self._last_report >= self._report_interval:
+            self._last_report = time.monotonic()
+            logger.info(self.format_line())
+        return seconds
+
+    def format_line(self):
+        line = "{} stats: {}".format(self._label, self.stats.format_line())
+        if self._client_stats is not None:
+            line += " || client: {}".format(self._client_stats.format_line())
+        return line
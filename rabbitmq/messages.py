@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Helpers for the bulk message operations of RabbitMQ: message predicates, the original
+# destination of dead-lettered messages, and progress counters.
+#
+# messages are dicts as returned by the management API's /api/queues/{vhost}/{name}/get:
+#   {"payload": "{\"job\": {\"type\": \"job-hello_world:develop\", ...}}", "payload_encoding": "string",
+#    "payload_bytes": 1268, "redelivered": false, "exchange": "", "routing_key": "jobs_failed", "message_count": 99,
+#    "properties": {"priority": 0, "delivery_mode": 2, "headers": {"x-death": [{"queue": "urgent-response-job_worker-large", ...}]}}}
+#
+# example usage:
+#   predicate = all_of(json_field_equals("job.type", "job-hello_world:develop"), header_equals("x-first-death-reason", "rejected"))
+#   rbmq.peek_messages("jobs_failed", 10, predicate)
+#   rbmq.move_messages("jobs_failed", predicate=predicate, progress=lambda stats: print(stats))
+#
+# ---------------------------------------------------------
+
+import re
+import json
+import time
+import base64
+
+
+def payload_text(message):
+    """
+    @return: the payload of a message as text, decoding base64 payloads
+    """
+    payload = message.get("payload", "")
+    if message.get("payload_encoding") == "base64":
+        return base64.b64decode(payload).decode("utf-8", "replace")
+    return payload
+
+
+def headers(message):
+    # the management API returns an empty list rather than an empty object for messages without properties
+    properties = message.get("properties") or {}
+    return properties.get("headers") or {}
+
+
+def payload_contains(text):
+    return lambda message: text in payload_text(message)
+
+
+def payload_matches(pattern):
+    regex = re.compile(pattern)
+    return lambda message: regex.search(payload_text(message)) is not None
+
+
+def json_field_equals(path, value):
+    """
+    matches messages with a json payload whose dotted path field, e.g. "job.type", equals value.
+    values are compared as strings, so that command line values match numbers and booleans.
+    """
+    keys = path.split(".")
+
+    def predicate(message):
+        try:
+            field = json.loads(payload_text(message))
+        except ValueError:
+            return False
+        for key in keys:
+            if not isinstance(field, dict) or key not in field:
+                return False
+            field = field[key]
+        # end for
+        return field == value or str(field) == str(value) or json.dumps(field) == str(value)
+
+    return predicate
+
+
+def header_equals(name, value):
+    return lambda message: name in headers(message) and str(headers(message)[name]) == str(value)
+
+
+def all_of(*predicates):
+    return lambda message: all(predicate(message) for predicate in predicates)
+
+
+def message_origin(message):
+    """
+    where a message should go back to: the queue it was dead-lettered from if it has an x-death header,
+    otherwise the exchange and routing key it was published with.
+    @return: tuple (exchange, routing_key)
+    """
+    deaths = headers(message).get("x-death")
+    if deaths:
+        # the most recent death comes first
+        return ("", deaths[0]["queue"])
+    return (message.get("exchange", ""), message.get("routing_key", ""))
+
+
+def republish_body(message, routing_key):
+    """
+    @return: body of a /api/exchanges/{vhost}/{name}/publish request that republishes a message as is.
+    """
+    return {
+        "properties": message.get("properties") or {},
+        "routing_key": routing_key,
+        "payload": message.get("payload", ""),
+        "payload_encoding": "base64" if message.get("payload_encoding") == "base64" else "string",
+    }
+
+
+class MoveStats:
+
+    __slots__ = ('total', 'fetched', 'matched', 'moved', 'requeued', 'failed', 'dry_run', 'started', 'lost')
+
+    def __init__(self, total, dry_run=False):
+        """
+        @param total: number of messages to go through.
+        """
+        self.total = total
+        self.fetched = 0
+        self.matched = 0
+        self.moved = 0
+        self.requeued = 0
+        self.failed = 0
+        self.dry_run = dry_run
+        self.started = time.monotonic()
+        # messages that could neither be moved nor put back, so that the caller can save them
+        self.lost = []
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """
+        @return: messages fetched per second
+        """
+        elapsed = self.elapsed
+        return self.fetched / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {"total": self.total, "fetched": self.fetched, "matched": self.matched, "moved": self.moved,
+                "requeued": self.requeued, "failed": self.failed, "dry_run": self.dry_run,
+                "elapsed": round(self.elapsed, 3), "rate": round(self.rate, 1)}
+
+    def __repr__(self):
+        return "MoveStats({})".format(self.to_dict())
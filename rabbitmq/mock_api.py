@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Local stand-in for the RabbitMQ management HTTP API, for benchmarks and development without a broker.
+#
+# generates queues and connections shaped like the sample payloads in RabbitMQ.py, at a configurable
+# scale, with a configurable response latency. a fraction of the queues and connections change at
+# every tick, so that the monitors' diffing has realistic work to do.
+#
+# supported:
+#   GET /api/queues/%2F/, /api/queues/%2F/<name>, /api/queues
+#   GET /api/connections/, /api/connections/<name>
+#   GET /api/channels, /api/consumers, /api/overview, /api/nodes
+#   POST /api/queues/%2F/<name>/get, /api/exchanges/%2F/<name>/publish (publishing routes to the queue named by the routing key)
+#   query options: columns, page, page_size, name, use_regex, disable_stats, enable_queue_totals
+# credentials are accepted but not checked.
+#
+# example usage:
+#   server = MockManagementAPI(queues=10000, connections=2000, latency=0.05, messages=100000)
+#   server.start()                      # serves on a background thread
+#   rbmq = RabbitMQ(server.url, "guest", "guest")
+#   ...
+#   server.stop()
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+
+import re
+import json
+import time
+import random
+import threading
+from collections import deque
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+_queue_suffixes = ("job_worker-small", "job_worker-large", "job_worker-realtime", "queue", "dataset", "trigger")
+_queue_prefixes = ("aria", "asf", "factotum", "standard_product", "urgent-response", "user_rules", "spyddder", "celery@worker")
+
+
+def make_queue(i, tick=0, rng=None):
+    """
+    @return: queue dict like the /api/queues sample in RabbitMQ.get_queues()
+    """
+    rng = rng or random
+    name = "{}-{}-{}".format(_queue_prefixes[i % len(_queue_prefixes)], _queue_suffixes[i % len(_queue_suffixes)], i)
+    ready = rng.randint(0, 50) if i % 7 else rng.randint(0, 20000)
+    unacked = rng.randint(0, 8)
+    consumers = rng.randint(0, 16)
+    return {
+        "arguments": {"x-max-priority": 10},
+        "auto_delete": False,
+        "backing_queue_status": {
+            "avg_ack_egress_rate": rng.random(), "avg_ack_ingress_rate": rng.random(),
+            "avg_egress_rate": rng.random(), "avg_ingress_rate": rng.random(),
+            "delta": ["delta", "todo", "todo", "todo", "todo"],
+            "len": ready, "mode": "default", "next_seq_id": ready + tick,
+            "priority_lengths": {str(p): (ready if p == 5 else 0) for p in range(11)},
+            "q1": 0, "q2": 0, "q3": 0, "q4": ready, "target_ram_count": "infinity",
+        },
+        "consumer_utilisation": (rng.random() if consumers else None),
+        "consumers": consumers,
+        "durable": True,
+        "exclusive": False,
+        "exclusive_consumer_tag": None,
+        "garbage_collection": {"fullsweep_after": 65535, "max_heap_size": 0, "min_bin_vheap_size": 46422,
+                               "min_heap_size": 233, "minor_gcs": rng.randint(0, 1000)},
+        "head_message_timestamp": None,
+        "idle_since": "2020-03-23 22:48:25",
+        "memory": rng.randint(10000, 200000),
+        "message_bytes": ready * 900, "message_bytes_paged_out": 0, "message_bytes_persistent": ready * 900,
+        "message_bytes_ram": ready * 900, "message_bytes_ready": ready * 900, "message_bytes_unacknowledged": unacked * 900,
+        "message_stats": {
+            "ack": tick * 3, "ack_details": {"rate": round(rng.random() * consumers * 0.05, 2)},
+            "deliver_get": tick * 3, "deliver_get_details": {"rate": round(rng.random(), 2)},
+            "publish": tick * 3 + ready, "publish_details": {"rate": round(rng.random(), 2)},
+        },
+        "messages": ready + unacked,
+        "messages_details": {"rate": 0.0},
+        "messages_paged_out": 0, "messages_persistent": ready + unacked, "messages_ram": ready + unacked,
+        "messages_ready": ready,
+        "messages_ready_details": {"rate": round(rng.uniform(-1, 1), 2)},
+        "messages_ready_ram": ready,
+        "messages_unacknowledged": unacked,
+        "messages_unacknowledged_details": {"rate": 0.0},
+        "messages_unacknowledged_ram": unacked,
+        "name": name,
+        "node": "rabbit@localhost",
+        "policy": None,
+        "recoverable_slaves": None,
+        "reductions": rng.randint(0, 10 ** 6),
+        "reductions_details": {"rate": 0.0},
+        "state": "running" if rng.random() > 0.01 else "flow",
+        "vhost": "/",
+    }
+
+
+def make_connection(i, tick=0, rng=None):
+    """
+    @return: connection dict like the /api/connections sample in RabbitMQ.get_connections()
+    """
+    rng = rng or random
+    peer_host = "100.64.{}.{}".format((i // 250) % 250, i % 250 + 1)
+    peer_port = 40000 + i % 20000
+    return {
+        "auth_mechanism": "AMQPLAIN",
+        "channel_max": 2047,
+        "channels": rng.randint(1, 3),
+        "client_properties": {
+            "capabilities": {"authentication_failure_close": True, "connection.blocked": True, "consumer_cancel_notify": True},
+            "product": "py-amqp" if i % 5 else "celery",
+            "product_version": "2.5.2",
+        },
+        "connected_at": 1586466077382 + i,
+        "frame_max": 131072,
+        "garbage_collection": {"fullsweep_after": 65535, "max_heap_size": 0, "min_bin_vheap_size": 46422,
+                               "min_heap_size": 233, "minor_gcs": rng.randint(0, 1000)},
+        "host": "127.0.0.1",
+        "name": "{}:{} -> 127.0.0.1:5672".format(peer_host, peer_port),
+        "node": "rabbit@localhost",
+        "peer_cert_issuer": None, "peer_cert_subject": None, "peer_cert_validity": None,
+        "peer_host": peer_host,
+        "peer_port": peer_port,
+        "port": 5672,
+        "protocol": "AMQP 0-9-1",
+        "recv_cnt": 7196 + tick, "recv_oct": 3069365 + tick * 100,
+        "recv_oct_details": {"rate": round(rng.random() * 10, 1)},
+        "reductions": 78732471, "reductions_details": {"rate": 180.4},
+        "send_cnt": 7196 + tick, "send_oct": 151570 + tick * 100,
+        "send_oct_details": {"rate": round(rng.random() * 50, 1)},
+        "send_pend": 0,
+        "ssl": False, "ssl_cipher": None, "ssl_hash": None, "ssl_key_exchange": None, "ssl_protocol": None,
+        "state": "running" if rng.random() > 0.01 else "blocked",
+        "timeout": 0,
+        "type": "network",
+        "user": "hysdsops" if i % 3 else "worker",
+        "user_who_performed_action": "hysdsops",
+        "vhost": "/",
+    }
+
+
+def make_message(i, queue_name):
+    """
+    @return: dead-lettered HySDS job message like the /api/queues/{vhost}/{name}/get sample in rabbitmq.messages
+    """
+    job_type = ("job-hello_world:develop", "job-topsapp:release-v2.4.0", "job-ingest:develop")[i % 3]
+    payload = json.dumps({"job_id": "{}-{}".format(job_type, i), "job": {"type": job_type, "name": "{}-{}".format(job_type, i),
+                          "priority": i % 10, "params": {"id": i}}})
+    return {"payload": payload, "payload_encoding": "string", "payload_bytes": len(payload), "redelivered": False,
+            "exchange": "", "routing_key": "jobs_failed",
+            "properties": {"priority": i % 10, "delivery_mode": 2, "content_type": "application/json",
+                           "headers": {"x-first-death-reason": "rejected", "x-death": [{"queue": queue_name, "reason": "rejected", "count": 1}]}}}
+
+
+def _select_columns(item, columns):
+    """
+    keeps only the given (possibly dotted) columns of an item, like the management API does.
+    """
+    result = {}
+    for column in columns:
+        path = column.split(".")
+        value = item
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                value = None
+                break
+            value = value[key]
+        if value is None and not (len(path) == 1 and path[0] in item):
+            continue
+        target = result
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        target[path[-1]] = value
+    # end for
+    return result
+
+
+# fields dropped by disable_stats=true
+_stats_fields = ("backing_queue_status", "garbage_collection", "message_stats", "messages_details",
+                 "messages_ready_details", "messages_unacknowledged_details", "reductions", "reductions_details",
+                 "recv_oct_details", "send_oct_details")
+
+
+class MockManagementAPI:
+
+    def __init__(self, queues=1000, connections=200, latency=0.0, change_fraction=0.05, tick_interval=1.0,
+                 host="127.0.0.1", port=0, seed=0, messages=0):
+        """
+        @param queues: number of queues.
+        @param connections: number of connections, each with one channel and consumer.
+        @param latency: seconds added before each response.
+        @param change_fraction: fraction of queues and connections whose values change at each tick.
+        @param tick_interval: seconds between ticks.
+        @param port: port to listen on. 0 picks a free port.
+        @param messages: number of dead-lettered job messages in the "jobs_failed" queue.
+        """
+        self._latency = latency
+        self._change_fraction = change_fraction
+        self._tick_interval = tick_interval
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tick = 0
+        self._tick_started = time.monotonic()
+        self._queues = [make_queue(i, 0, self._rng) for i in range(queues)]
+        self._connections = [make_connection(i, 0, self._rng) for i in range(connections)]
+        self._queue_positions = {q["name"]: i for i, q in enumerate(self._queues)}
+        # queue name -> deque of messages, for the queues that have any
+        self._messages = {}
+        if messages:
+            job_queues = [q["name"] for q in self._queues if "job_worker" in q["name"]] or ["jobs"]
+            self._add_queue("jobs_failed")
+            self._messages["jobs_failed"] = deque(make_message(i, job_queues[i % len(job_queues)]) for i in range(messages))
+            self._update_depth("jobs_failed")
+        # (resource, query) -> encoded response body, for the current tick
+        self._cache = {}
+        self.requests = 0
+        self.bytes_sent = 0
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        """
+        serves on a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-rabbitmq-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def advance(self):
+        """
+        moves to the next tick, changing change_fraction of the queues and connections.
+        """
+        with self._lock:
+            self._advance()
+
+    def _advance(self):
+        self._tick += 1
+        self._tick_started = time.monotonic()
+        self._cache = {}
+        rng = self._rng
+        for items, make in ((self._queues, make_queue), (self._connections, make_connection)):
+            if not items:
+                continue
+            for _ in range(int(len(items) * self._change_fraction)):
+                i = rng.randrange(len(items))
+                name = items[i]["name"]
+                items[i] = make(i, self._tick, rng)
+                items[i]["name"] = name
+            # end for
+        # end for
+        # queues holding messages report their actual depth
+        for name in self._messages:
+            self._update_depth(name)
+        # end for
+
+    def _add_queue(self, name):
+        queue = make_queue(len(self._queues), self._tick, self._rng)
+        queue["name"] = name
+        self._queue_positions[name] = len(self._queues)
+        self._queues.append(queue)
+        return queue
+
+    def _update_depth(self, name):
+        queue = self._queues[self._queue_positions[name]]
+        depth = len(self._messages.get(name, ()))
+        queue["messages_ready"] = queue["messages"] = depth
+        queue["messages_unacknowledged"] = 0
+        self._cache = {}
+
+    def _post(self, path, body):
+        """
+        @return: tuple (status, encoded body)
+        """
+        parts = [unquote(p) for p in path.split("/") if p]
+        names = self._queue_positions
+        if len(parts) == 5 and parts[:2] == ["api", "queues"] and parts[4] == "get":
+            if parts[3] not in names:
+                return 404, b'{"error":"Object Not Found","reason":"Not Found"}'
+            messages = self._messages.get(parts[3], deque())
+            taken = [messages.popleft() for _ in range(min(int(body.get("count", 1)), len(messages)))]
+            if body.get("ackmode") == "ack_requeue_true":
+                messages.extendleft(reversed(taken))
+            result = []
+            for i, message in enumerate(taken):
+                message = dict(message, message_count=len(messages) + len(taken) - i - 1)
+                if body.get("truncate"):
+                    message["payload"] = message["payload"][:int(body["truncate"])]
+                result.append(message)
+            # end for
+            self._update_depth(parts[3])
+            return 200, json.dumps(result).encode("utf-8")
+        if len(parts) == 5 and parts[:2] == ["api", "exchanges"] and parts[4] == "publish":
+            routing_key = body.get("routing_key", "")
+            if routing_key not in names:
+                return 200, b'{"routed":false}'
+            message = {"payload": body.get("payload", ""), "payload_encoding": body.get("payload_encoding", "string"),
+                       "payload_bytes": len(body.get("payload", "")), "redelivered": False,
+                       "exchange": "" if parts[3] == "amq.default" else parts[3], "routing_key": routing_key,
+                       "properties": body.get("properties") or []}
+            self._messages.setdefault(routing_key, deque()).append(message)
+            self._update_depth(routing_key)
+            return 200, b'{"routed":true}'
+        return 405, b'{"error":"Method Not Allowed","reason":"Method Not Allowed"}'
+
+    def _maybe_advance(self):
+        if self._tick_interval and time.monotonic() - self._tick_started >= self._tick_interval:
+            self._advance()
+
+    def _channels(self):
+        return [{"name": "{} (1)".format(c["name"]), "number": 1, "connection_details": {"name": c["name"], "peer_host": c["peer_host"], "peer_port": c["peer_port"]},
+                 "user": c["user"], "state": "running", "prefetch_count": 0 if i % 50 == 7 else 1,
+                 "global_prefetch_count": 0, "messages_unacknowledged": i % 9 if i % 50 == 7 else i % 2,
+                 "consumer_count": 1, "vhost": "/"} for i, c in enumerate(self._connections)]
+
+    def _consumers(self):
+        queues = self._queues
+        return [{"consumer_tag": "ctag{}".format(i), "prefetch_count": 0 if i % 50 == 7 else 1, "ack_required": True, "active": True,
+                 "channel_details": {"name": "{} (1)".format(c["name"]), "connection_name": c["name"], "peer_host": c["peer_host"], "peer_port": c["peer_port"], "number": 1},
+                 "queue": {"name": queues[i % len(queues)]["name"], "vhost": "/"} if queues else {}}
+                for i, c in enumerate(self._connections)]
+
+    def _overview(self):
+        return {
+            "cluster_name": "rabbit@localhost", "management_version": "3.8.2", "rabbitmq_version": "3.8.2",
+            "message_stats": {"publish_details": {"rate": 12.0}, "deliver_get_details": {"rate": 11.0}, "ack_details": {"rate": 11.0}},
+            "object_totals": {"channels": len(self._connections), "connections": len(self._connections),
+                              "consumers": len(self._connections), "exchanges": 12, "queues": len(self._queues)},
+            "queue_totals": {"messages": sum(q["messages"] for q in self._queues),
+                             "messages_ready": sum(q["messages_ready"] for q in self._queues),
+                             "messages_unacknowledged": sum(q["messages_unacknowledged"] for q in self._queues)},
+        }
+
+    def _nodes(self):
+        # memory grows with the messages held, like a broker paging messages to disk only past the watermark
+        messages = sum(q["messages"] for q in self._queues)
+        return [{"name": "rabbit@localhost", "running": True, "mem_used": 150 * 2 ** 20 + 256 * messages, "mem_limit": 1600 * 2 ** 20, "mem_alarm": False,
+                 "fd_used": 100 + len(self._connections), "fd_total": 65536, "sockets_used": len(self._connections), "sockets_total": 58893,
+                 "proc_used": 2000 + 10 * len(self._connections), "proc_total": 1048576, "disk_free": 50 * 2 ** 30, "disk_free_limit": 50 * 2 ** 20, "disk_free_alarm": False,
+                 "uptime": 1000000, "partitions": []}]
+
+    def _body(self, path, query):
+        """
+        @return: tuple (status, encoded body)
+        """
+        parts = [unquote(p) for p in path.split("/") if p]
+        if len(parts) < 2 or parts[0] != "api":
+            return 404, b'{"error":"Object Not Found","reason":"Not Found"}'
+        resource = parts[1]
+        name = None
+        if resource in ("queues",) and len(parts) >= 4:
+            name = parts[3]
+        elif resource in ("connections", "channels", "nodes") and len(parts) >= 3:
+            name = parts[2]
+
+        if resource == "overview":
+            data = self._overview()
+        elif resource == "nodes":
+            data = self._nodes()
+            if name is not None:
+                matches = [item for item in data if item["name"] == name]
+                if not matches:
+                    return 404, b'{"error":"Object Not Found","reason":"Not Found"}'
+                data = matches[0]
+        elif resource in ("queues", "connections", "channels", "consumers"):
+            items = {"queues": lambda: self._queues, "connections": lambda: self._connections,
+                     "channels": self._channels, "consumers": self._consumers}[resource]()
+            if name is not None:
+                matches = [item for item in items if item["name"] == name]
+                if not matches:
+                    return 404, b'{"error":"Object Not Found","reason":"Not Found"}'
+                data = matches[0]
+            else:
+                data = items
+        else:
+            return 404, b'{"error":"Object Not Found","reason":"Not Found"}'
+
+        if query.get("disable_stats") == "true":
+            strip = lambda item: {k: v for k, v in item.items() if k not in _stats_fields}
+            data = [strip(item) for item in data] if isinstance(data, list) else strip(data)
+
+        if "columns" in query:
+            columns = query["columns"].split(",")
+            data = [_select_columns(item, columns) for item in data] if isinstance(data, list) else _select_columns(data, columns)
+
+        if "page" in query and isinstance(data, list):
+            total = len(data)
+            name_filter = query.get("name")
+            if name_filter:
+                if query.get("use_regex") == "true":
+                    pattern = re.compile(name_filter)
+                    data = [item for item in data if pattern.search(item.get("name", ""))]
+                else:
+                    data = [item for item in data if name_filter in item.get("name", "")]
+            page = int(query["page"])
+            page_size = int(query.get("page_size", 100))
+            items = data[(page - 1) * page_size:page * page_size]
+            data = {"filtered_count": len(data), "item_count": len(items), "items": items, "page": page,
+                    "page_count": max((len(data) + page_size - 1) // page_size, 1), "page_size": page_size, "total_count": total}
+
+        return 200, json.dumps(data).encode("utf-8")
+
+    def _respond(self, raw_path):
+        split = urlsplit(raw_path)
+        query = {k: v[-1] for k, v in parse_qs(split.query).items()}
+        key = (split.path, tuple(sorted(query.items())))
+        with self._lock:
+            self._maybe_advance()
+            cached = self._cache.get(key)
+            if cached is None:
+                cached = self._cache[key] = self._body(split.path, query)
+            self.requests += 1
+            self.bytes_sent += len(cached[1])
+        return cached
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, which would otherwise stall keep-alive requests on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                status, body = api._respond(self.path)
+                if api._latency:
+                    time.sleep(api._latency)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    body = None
+                if body is None:
+                    status, data = 400, b'{"error":"bad_request","reason":"invalid json"}'
+                else:
+                    with api._lock:
+                        status, data = api._post(urlsplit(self.path).path, body)
+                        api.requests += 1
+                        api.bytes_sent += len(data)
+                if api._latency:
+                    time.sleep(api._latency)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
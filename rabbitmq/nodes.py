@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Resource headroom of the RabbitMQ cluster nodes, from RabbitMQ.node_to_tuple().
+#
+# a broker stops accepting publishes when a node reaches its memory high watermark (mem_limit) or
+# its free disk falls to disk_free_limit, and stops accepting connections when it runs out of file
+# descriptors or sockets. headroom is how far a node is from each of these limits, in percent:
+#
+#   mem:     (mem_limit - mem_used) / mem_limit
+#   fd:      (fd_total - fd_used) / fd_total
+#   sockets: (sockets_total - sockets_used) / sockets_total
+#   proc:    (proc_total - proc_used) / proc_total, erlang processes
+#   disk:    (disk_free - disk_free_limit) / disk_free, the part of the free disk usable before the alarm
+#
+# 0 means the limit is reached. headroom is None while a node is down.
+#
+# example usage:
+#   for node in rbmq.get_nodes(columns=RabbitMQ.NODE_TUPLE_COLUMNS):
+#       print(node_headroom(RabbitMQ.node_to_tuple(node)))
+#   NodeHeadroom(name='rabbit@mozart', state='running', mem=90.6, fd=99.5, sockets=99.7, proc=99.8, disk=99.9, alarms='none')
+#
+# ---------------------------------------------------------
+
+from collections import namedtuple
+
+
+# fields of the headroom tuples after the node name, in order
+HEADROOM_FIELDS = ('state', 'mem', 'fd', 'sockets', 'proc', 'disk', 'alarms')
+
+NodeHeadroom = namedtuple('NodeHeadroom', ('name',) + HEADROOM_FIELDS)
+
+
+def headroom(used, limit):
+    """
+    @return: percent of limit not used, rounded to 0.1, never negative. None if unknown.
+    """
+    if used is None or not limit:
+        return None
+    return round(max(limit - used, 0) * 100.0 / limit, 1)
+
+
+def node_headroom(node_tuple):
+    """
+    @param node_tuple: tuple from RabbitMQ.node_to_tuple()
+    @return: NodeHeadroom
+    """
+    (name, running, mem_used, mem_limit, mem_alarm, fd_used, fd_total, sockets_used, sockets_total,
+     proc_used, proc_total, disk_free, disk_free_limit, disk_free_alarm) = node_tuple
+    if not running:
+        return NodeHeadroom(name, "down", None, None, None, None, None, "none")
+    disk = None
+    if disk_free is not None and disk_free_limit is not None:
+        # usable free disk is disk_free - disk_free_limit, out of disk_free
+        disk = headroom(disk_free_limit, disk_free) if disk_free > 0 else 0.0
+    alarms = [alarm for alarm, raised in (("memory", mem_alarm), ("disk", disk_free_alarm)) if raised]
+    return NodeHeadroom(name, "running", headroom(mem_used, mem_limit), headroom(fd_used, fd_total),
+                        headroom(sockets_used, sockets_total), headroom(proc_used, proc_total), disk,
+                        ",".join(alarms) or "none")
+
+
+def min_headroom(headroom_tuple):
+    """
+    @return: tuple (lowest headroom, its field) of a NodeHeadroom, or (None, None) if none are known
+    """
+    known = [(value, field) for field, value in zip(HEADROOM_FIELDS[1:6], headroom_tuple[2:7]) if value is not None]
+    return min(known) if known else (None, None)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Compact record types for RabbitMQ queues and connections.
+#
+# QueueRecord / ConnectionRecord are __slots__ classes holding the same subset of fields as
+# RabbitMQ.queue_to_tuple() / RabbitMQ.connection_to_tuple(), without the per-instance dict.
+#
+# QueueSnapshot / ConnectionSnapshot hold a whole poll in columnar form, with the numeric fields
+# in array.array storage, so that thousands of queues cost a few flat buffers instead of
+# thousands of dicts.
+#
+# SNAPSHOT_QUEUE_COLUMNS / SNAPSHOT_CONNECTION_COLUMNS are the columns polled by the snapshot daemon
+# (rabbitmq.snapshot): the union of the columns every tool of this package asks for.
+#
+# example usage:
+#   snapshot = QueueSnapshot.from_queues(rbmq.iter_queues(columns=RabbitMQ.QUEUE_TUPLE_COLUMNS))
+#   for queue_tuple in snapshot:
+#       print(queue_tuple)
+#   ("user_rules_dataset", "running", 0, 0)
+#
+# ---------------------------------------------------------
+
+import sys
+from array import array
+
+
+# columns polled by the snapshot daemon. every column set of this package must be a subset of these:
+# RabbitMQ.QUEUE_TUPLE_COLUMNS / CONNECTION_TUPLE_COLUMNS, exporter.QUEUE_METRIC_COLUMNS / CONNECTION_METRIC_COLUMNS,
+# correlation.QUEUE_INDEX_COLUMNS / CONNECTION_INDEX_COLUMNS, autoscale.ADVISOR_COLUMNS and aggregate.AGGREGATE_COLUMNS.
+SNAPSHOT_QUEUE_COLUMNS = ('name', 'state', 'messages', 'messages_ready', 'messages_unacknowledged', 'consumers',
+                          'consumer_utilisation', 'messages_ready_details.rate', 'message_stats.ack_details.rate')
+SNAPSHOT_CONNECTION_COLUMNS = ('name', 'state', 'peer_host', 'user', 'channels', 'client_properties.product',
+                               'send_oct_details.rate', 'recv_oct_details.rate')
+
+
+class QueueRecord:
+    """
+    a queue's (queue_name, queue_state, messages_ready, messages_unacknowledged).
+    """
+
+    __slots__ = ('name', 'state', 'messages_ready', 'messages_unacknowledged')
+
+    def __init__(self, name, state, messages_ready, messages_unacknowledged):
+        self.name = name
+        self.state = state
+        self.messages_ready = messages_ready
+        self.messages_unacknowledged = messages_unacknowledged
+
+    @classmethod
+    def from_dict(cls, queue):
+        """
+        converts a queue dict from the management API.
+        @return: QueueRecord
+        """
+        return cls(queue["name"], queue["state"], queue["messages_ready"], queue["messages_unacknowledged"])
+
+    def to_tuple(self):
+        """
+        @return: tuple (queue_name, queue_state, messages_ready, messages_unacknowledged)
+        """
+        return (self.name, self.state, self.messages_ready, self.messages_unacknowledged)
+
+    def __eq__(self, other):
+        if not isinstance(other, QueueRecord):
+            return NotImplemented
+        return self.to_tuple() == other.to_tuple()
+
+    def __hash__(self):
+        return hash(self.to_tuple())
+
+    def __repr__(self):
+        return "QueueRecord{}".format(self.to_tuple())
+
+
+class ConnectionRecord:
+    """
+    a connection's (connection_name, connection_state, connection_send_rate, connection_recv_rate).
+    """
+
+    __slots__ = ('name', 'state', 'send_rate', 'recv_rate')
+
+    def __init__(self, name, state, send_rate, recv_rate):
+        self.name = name
+        self.state = state
+        self.send_rate = send_rate
+        self.recv_rate = recv_rate
+
+    @classmethod
+    def from_dict(cls, connection):
+        """
+        converts a connection dict from the management API.
+        @return: ConnectionRecord
+        """
+        return cls(connection["name"], connection["state"],
+                   connection["send_oct_details"]["rate"], connection["recv_oct_details"]["rate"])
+
+    def to_tuple(self):
+        """
+        @return: tuple (connection_name, connection_state, connection_send_rate, connection_recv_rate)
+        """
+        return (self.name, self.state, self.send_rate, self.recv_rate)
+
+    def __eq__(self, other):
+        if not isinstance(other, ConnectionRecord):
+            return NotImplemented
+        return self.to_tuple() == other.to_tuple()
+
+    def __hash__(self):
+        return hash(self.to_tuple())
+
+    def __repr__(self):
+        return "ConnectionRecord{}".format(self.to_tuple())
+
+
+class QueueSnapshot:
+    """
+    columnar snapshot of queues from one poll.
+    names and states are python lists (states are interned), counts are array('q') buffers.
+    """
+
+    __slots__ = ('names', 'states', 'messages_ready', 'messages_unacknowledged', '_index')
+
+    def __init__(self):
+        self.names = []
+        self.states = []
+        self.messages_ready = array('q')
+        self.messages_unacknowledged = array('q')
+        self._index = None
+
+    @classmethod
+    def from_queues(cls, queues):
+        """
+        builds a snapshot directly from queue dicts, without intermediate tuples or records.
+        @param queues: iterable of queue dicts, e.g. from RabbitMQ.iter_queues()
+        @return: QueueSnapshot
+        """
+        snapshot = cls()
+        names_append = snapshot.names.append
+        states_append = snapshot.states.append
+        ready_append = snapshot.messages_ready.append
+        unacked_append = snapshot.messages_unacknowledged.append
+        intern = sys.intern
+        for queue in queues:
+            names_append(queue["name"])
+            states_append(intern(queue["state"]))
+            ready_append(queue["messages_ready"])
+            unacked_append(queue["messages_unacknowledged"])
+        # end for
+        return snapshot
+
+    def append(self, name, state, messages_ready, messages_unacknowledged):
+        self.names.append(name)
+        self.states.append(sys.intern(state))
+        self.messages_ready.append(messages_ready)
+        self.messages_unacknowledged.append(messages_unacknowledged)
+        self._index = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        """
+        @return: iterator of tuples (queue_name, queue_state, messages_ready, messages_unacknowledged)
+        """
+        return zip(self.names, self.states, self.messages_ready, self.messages_unacknowledged)
+
+    def index_of(self, name):
+        """
+        @return: row index of the queue name, or None if not in the snapshot.
+        """
+        if self._index is None:
+            self._index = {name: i for i, name in enumerate(self.names)}
+        return self._index.get(name)
+
+    def get(self, name):
+        """
+        @return: QueueRecord for the queue name, or None if not in the snapshot.
+        """
+        i = self.index_of(name)
+        if i is None:
+            return None
+        return QueueRecord(self.names[i], self.states[i], self.messages_ready[i], self.messages_unacknowledged[i])
+
+    def records(self):
+        """
+        @return: generator of QueueRecord
+        """
+        for row in self:
+            yield QueueRecord(*row)
+        # end for
+
+
+class ConnectionSnapshot:
+    """
+    columnar snapshot of connections from one poll.
+    names and states are python lists (states are interned), rates are array('d') buffers.
+    """
+
+    __slots__ = ('names', 'states', 'send_rates', 'recv_rates', '_index')
+
+    def __init__(self):
+        self.names = []
+        self.states = []
+        self.send_rates = array('d')
+        self.recv_rates = array('d')
+        self._index = None
+
+    @classmethod
+    def from_connections(cls, connections):
+        """
+        builds a snapshot directly from connection dicts, without intermediate tuples or records.
+        @param connections: iterable of connection dicts, e.g. from RabbitMQ.iter_connections()
+        @return: ConnectionSnapshot
+        """
+        snapshot = cls()
+        names_append = snapshot.names.append
+        states_append = snapshot.states.append
+        send_append = snapshot.send_rates.append
+        recv_append = snapshot.recv_rates.append
+        intern = sys.intern
+        for connection in connections:
+            names_append(connection["name"])
+            states_append(intern(connection["state"]))
+            send_append(connection["send_oct_details"]["rate"])
+            recv_append(connection["recv_oct_details"]["rate"])
+        # end for
+        return snapshot
+
+    def append(self, name, state, send_rate, recv_rate):
+        self.names.append(name)
+        self.states.append(sys.intern(state))
+        self.send_rates.append(send_rate)
+        self.recv_rates.append(recv_rate)
+        self._index = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        """
+        @return: iterator of tuples (connection_name, connection_state, connection_send_rate, connection_recv_rate)
+        """
+        return zip(self.names, self.states, self.send_rates, self.recv_rates)
+
+    def index_of(self, name):
+        """
+        @return: row index of the connection name, or None if not in the snapshot.
+        """
+        if self._index is None:
+            self._index = {name: i for i, name in enumerate(self.names)}
+        return self._index.get(name)
+
+    def get(self, name):
+        """
+        @return: ConnectionRecord for the connection name, or None if not in the snapshot.
+        """
+        i = self.index_of(name)
+        if i is None:
+            return None
+        return ConnectionRecord(self.names[i], self.states[i], self.send_rates[i], self.recv_rates[i])
+
+    def records(self):
+        """
+        @return: generator of ConnectionRecord
+        """
+        for row in self:
+            yield ConnectionRecord(*row)
+        # end for
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Building blocks for bounded-latency calls to the management API: deadlines, jittered backoff
+# and per-endpoint circuit breakers.
+#
+#   Deadline:       a time budget shared by all attempts of one call.
+#   backoff_delays: exponential backoff with full jitter, so that monitors restarted together
+#                   do not retry a recovering node in lockstep.
+#   CircuitBreaker: stops sending requests to an endpoint after consecutive failures, and lets a
+#                   single trial request through once reset_timeout has passed.
+#
+# example usage:
+#   breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+#   deadline = Deadline(10.0)
+#   for delay in backoff_delays(max_retries=2, base=0.5, cap=5.0):
+#       if breaker.allow():
+#           ... call the endpoint with timeout=deadline.remaining(), then breaker.record_success() or breaker.record_failure()
+#           ... or breaker.release() if the request was not sent after all
+#       time.sleep(min(delay, deadline.remaining()))
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+import random
+import threading
+
+
+class Deadline:
+
+    def __init__(self, seconds, clock=time.monotonic):
+        """
+        @param seconds: time budget. None for no deadline.
+        """
+        self._clock = clock
+        self._expires = clock() + seconds if seconds is not None else None
+
+    def remaining(self):
+        """
+        @return: seconds left, never negative. None if there is no deadline.
+        """
+        if self._expires is None:
+            return None
+        return max(self._expires - self._clock(), 0.0)
+
+    @property
+    def expired(self):
+        return self._expires is not None and self._clock() >= self._expires
+
+    def bound(self, timeout, minimum=0.0):
+        """
+        @param minimum: (optional) lowest timeout returned, e.g. for APIs that reject a zero timeout.
+        @return: timeout, shortened so that it does not run past the deadline
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return max(remaining, minimum)
+        return max(min(timeout, remaining), minimum)
+
+
+def backoff_delays(max_retries, base=0.5, cap=10.0, rng=random):
+    """
+    full-jitter exponential backoff: the n-th delay is uniform in [0, min(cap, base * 2 ** n)].
+    @return: generator of max_retries delays, in seconds
+    """
+    for attempt in range(max_retries):
+        yield rng.uniform(0, min(cap, base * (2 ** attempt)))
+    # end for
+
+
+class CircuitBreaker:
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name="", failure_threshold=3, reset_timeout=30.0, clock=time.monotonic):
+        """
+        @param name: name used in log messages, e.g. the endpoint.
+        @param failure_threshold: consecutive failures that open the breaker.
+        @param reset_timeout: seconds the breaker stays open before letting a trial request through.
+        """
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CircuitBreaker.CLOSED
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == CircuitBreaker.OPEN and self._clock() - self._opened_at >= self._reset_timeout:
+                return CircuitBreaker.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """
+        @return: True if a request may be sent. in the half-open state, only one trial request is allowed
+        until it is recorded as a success or failure.
+        """
+        with self._lock:
+            if self._state == CircuitBreaker.CLOSED:
+                return True
+            if self._state == CircuitBreaker.OPEN and self._clock() - self._opened_at >= self._reset_timeout:
+                self._state = CircuitBreaker.HALF_OPEN
+                return True
+            return False
+
+    def release(self):
+        """
+        gives back the half-open trial slot of a request that was never sent, e.g. because the deadline expired
+        before it started, so the next request can be the trial.
+        """
+        with self._lock:
+            if self._state == CircuitBreaker.HALF_OPEN:
+                # opened_at is unchanged, so the reset_timeout has still elapsed
+                self._state = CircuitBreaker.OPEN
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CircuitBreaker.CLOSED:
+                logger.warning( "{} recovered, closing circuit breaker".format(self._name) )
+            self._state = CircuitBreaker.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == CircuitBreaker.HALF_OPEN or self._failures >= self._failure_threshold:
+                if self._state != CircuitBreaker.OPEN:
+                    logger.warning( "{} failed {} time(s), opening circuit breaker for {}s".format(self._name, self._failures, self._reset_timeout) )
+                self._state = CircuitBreaker.OPEN
+                self._opened_at = self._clock()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Fixed-rate scheduler for polling several RabbitMQ resources from one process.
+#
+# each job runs every <interval> seconds on an absolute timeline (start + k * interval), so a slow
+# request does not push back the following ticks the way time.sleep(interval) after the request does.
+# if a job overruns one or more of its ticks, the missed ticks are skipped and counted.
+# jobs that fall due within the same batch window are run together, concurrently, in one wake-up.
+#
+# example usage:
+#   scheduler = PollScheduler()
+#   scheduler.add("queues", 10, poll_queues)
+#   scheduler.add("connections", 60, poll_connections)
+#   scheduler.run_forever()
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PollScheduler:
+
+    def __init__(self, batch_window=0.5, max_workers=4, clock=time.monotonic, sleep=time.sleep):
+        """
+        @param batch_window: jobs due within this many seconds of each other are run in the same batch.
+        @param max_workers: max number of jobs of one batch run concurrently.
+        """
+        self._batch_window = batch_window
+        self._max_workers = max_workers
+        self._clock = clock
+        self._sleep = sleep
+        self._executor = None
+
+        # name -> [interval, job, next_due]
+        self._jobs = {}
+        self._missed = {}
+
+
+    def add(self, name, interval, job, start=None):
+        """
+        schedules job() to run every interval seconds, first at start (default: now).
+        """
+        if interval <= 0:
+            raise ValueError("interval of {} must be positive, got {}".format(name, interval))
+        if start is None:
+            start = self._clock()
+        self._jobs[name] = [interval, job, start]
+        self._missed[name] = 0
+
+
+    def remove(self, name):
+        self._jobs.pop(name, None)
+        self._missed.pop(name, None)
+
+
+    def set_interval(self, name, interval):
+        """
+        changes the interval of a job, counted from its last run.
+        """
+        entry = self._jobs[name]
+        entry[2] += interval - entry[0]
+        entry[0] = interval
+
+
+    def next_due(self):
+        """
+        @return: monotonic time of the earliest due job, or None if no jobs.
+        """
+        if not self._jobs:
+            return None
+        return min(entry[2] for entry in self._jobs.values())
+
+
+    def missed_ticks(self):
+        """
+        @return: dict {name: number of ticks skipped because the job overran}
+        """
+        return dict(self._missed)
+
+
+    def run_pending(self):
+        """
+        runs all jobs due now or within the batch window, as one batch.
+        @return: list of names of jobs run
+        """
+        now = self._clock()
+        due = [name for name, entry in self._jobs.items() if entry[2] <= now + self._batch_window]
+        if not due:
+            return []
+
+        if len(due) == 1:
+            self._jobs[due[0]][1]()
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="poll")
+            futures = [self._executor.submit(self._jobs[name][1]) for name in due]
+            # wait for the whole batch, then raise the first error if any
+            for future in futures:
+                future.exception()
+            for future in futures:
+                future.result()
+
+        # advance each job's timeline. skip ticks that passed while the job was running.
+        finished = self._clock()
+        for name in due:
+            entry = self._jobs.get(name)
+            if entry is None:
+                continue
+            interval = entry[0]
+            entry[2] += interval
+            if entry[2] <= finished:
+                skipped = int((finished - entry[2]) // interval) + 1
+                entry[2] += skipped * interval
+                self._missed[name] += skipped
+                logger.warning( "{} overran its interval of {}s, skipped {} tick(s)".format(name, interval, skipped) )
+        # end for
+
+        return due
+
+
+    def run_forever(self):
+        """
+        runs the jobs on schedule until interrupted.
+        """
+        try:
+            while self._jobs:
+                delay = self.next_due() - self._clock()
+                if delay > 0:
+                    self._sleep(delay)
+                self.run_pending()
+            # end while
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
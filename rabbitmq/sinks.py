@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Output sinks for the monitor scripts.
+#
+# a sink receives all the changed tuples of one poll cycle at once, formats them into a single
+# buffer, and writes and flushes it once per cycle.
+#
+#   PlainSink:    "<timestamp> <name> <state> <value1> <value2>" per tuple (the original monitor output)
+#                 or "<timestamp> <name> <added|changed|removed> <field>=<value> ..." per diff event
+#   SDSWatchSink: three SDSWatch lines per tuple, as the *_to_sdswatch.sh wrappers used to produce, e.g.
+#                 2020-05-22T03:19:04+00:00 , https://100.100.100.100:15673 , rabbitmq.queue , jobs_processed , state, running
+#                 2020-05-22T03:19:04+00:00 , https://100.100.100.100:15673 , rabbitmq.queue , jobs_processed , ready, 0
+#                 2020-05-22T03:19:04+00:00 , https://100.100.100.100:15673 , rabbitmq.queue , jobs_processed , unacked, 1
+#                 or one SDSWatch line per changed field of a diff event. removals are written as "state, removed".
+#                 connection groups (rabbitmq.aggregate) are written as connections, send_rate_to_client,
+#                 recv_rate_from_client and channels lines. nodes (rabbitmq.nodes) are written as state and
+#                 *_headroom lines, and the cluster overview as publish_rate, deliver_rate, ack_rate and totals lines.
+#
+# sinks write to stdout by default, or to a file with optional size-based rotation.
+# ---------------------------------------------------------
+
+import sys
+import logging
+import logging.handlers
+import threading
+
+
+class OutputWriter:
+    """
+    writes text batches to stdout, or to a file with optional size-based rotation.
+    one writer can be shared by several sinks, e.g. for queues and connections in one log file.
+    """
+
+    def __init__(self, output=None, max_bytes=0, backup_count=0):
+        """
+        @param output: (optional) file path. if not specified, writes to stdout.
+        @param max_bytes: (optional) rotate the file when it would grow past this size. 0 disables rotation.
+        @param backup_count: (optional) number of rotated files to keep.
+        """
+        self._stream = None
+        self._handler = None
+        # sinks sharing a writer may be written from the scheduler's worker threads
+        self._lock = threading.Lock()
+        if output:
+            # reuse the stdlib rotating file handler. one emit per batch, and no extra newline per emit.
+            self._handler = logging.handlers.RotatingFileHandler(output, maxBytes=max_bytes, backupCount=backup_count)
+            self._handler.terminator = ""
+            self._handler.setFormatter(logging.Formatter("%(message)s"))
+        else:
+            self._stream = sys.stdout
+
+    def write(self, text):
+        """
+        writes text with a single flush.
+        """
+        if not text:
+            return
+        with self._lock:
+            if self._handler is not None:
+                record = logging.LogRecord("rabbitmq.sinks", logging.INFO, __file__, 0, text, None, None)
+                self._handler.emit(record)
+            else:
+                # since the output may be streamed to another process,
+                # flush once per batch rather than waiting for the default stdout buffer to fill.
+                # https://www.turnkeylinux.org/blog/unix-buffering
+                self._stream.write(text)
+                self._stream.flush()
+
+    def close(self):
+        if self._handler is not None:
+            self._handler.close()
+
+
+class OutputSink:
+    """
+    base sink. subclasses implement format_cycle().
+    """
+
+    def __init__(self, output=None, max_bytes=0, backup_count=0, writer=None):
+        """
+        @param output: (optional) file path. if not specified, writes to stdout.
+        @param max_bytes: (optional) rotate the file when it would grow past this size. 0 disables rotation.
+        @param backup_count: (optional) number of rotated files to keep.
+        @param writer: (optional) an OutputWriter to share with other sinks. overrides output.
+        """
+        self.writer = writer or OutputWriter(output, max_bytes, backup_count)
+
+    def format_cycle(self, now, tuples):
+        """
+        @return: str of all output lines for the cycle
+        """
+        raise NotImplementedError
+
+    def format_events(self, now, events):
+        """
+        @param events: list of rabbitmq.diff.DiffEvent
+        @return: str of all output lines for the cycle
+        """
+        raise NotImplementedError
+
+    def write_cycle(self, now, tuples):
+        """
+        writes all tuples of one poll cycle as a single batch, with a single flush.
+        """
+        self.writer.write(self.format_cycle(now, tuples))
+
+    def write_events(self, now, events):
+        """
+        writes all diff events of one poll cycle as a single batch, with a single flush.
+        """
+        self.writer.write(self.format_events(now, events))
+
+    def close(self):
+        self.writer.close()
+
+
+class PlainSink(OutputSink):
+    """
+    "<timestamp> <name> <state> <value1> <value2>" per tuple.
+    """
+
+    def format_cycle(self, now, tuples):
+        # tuples may carry extra fields, e.g. the rabbitmq.history stats
+        return "".join(["{} {}\n".format(now, " ".join(map(str, i))) for i in tuples])
+
+    def format_events(self, now, events):
+        lines = []
+        for event in events:
+            fields = " ".join(["{}={}".format(k, v) for k, v in event.changes.items()])
+            lines.append("{} {} {} {}\n".format(now, event.name, event.kind, fields).replace(" \n", "\n"))
+        # end for
+        return "".join(lines)
+
+
+class SDSWatchSink(OutputSink):
+    """
+    SDSWatch log format: "<timestamp> , <endpoint> , rabbitmq.<resource> , <name> , <field>, <value>"
+    """
+
+    # field names of tuple items 1..3, and the line ending used, per resource type
+    _fields = {
+        "queue": (("state", "ready", "unacked"), "\n"),
+        "connection": (("state", "send_rate_to_client", "recv_rate_from_client"), " \n"),
+        # rabbitmq.aggregate.top_groups() tuples
+        "connection_group": (("connections", "send_rate_to_client", "recv_rate_from_client"), " \n"),
+        # rabbitmq.nodes.node_headroom() and RabbitMQ.overview_to_tuple() tuples
+        "node": (("state", "mem_headroom", "fd_headroom"), "\n"),
+        "overview": (("publish_rate", "deliver_rate", "ack_rate"), "\n"),
+    }
+
+    # names of extra tuple items after the first 4, e.g. rabbitmq.history.HISTORY_FIELDS
+    _extra_fields = {
+        "queue": ("ingress_rate", "egress_rate", "ready_avg", "time_to_drain"),
+        "connection": (),
+        "connection_group": ("channels",),
+        "node": ("sockets_headroom", "proc_headroom", "disk_headroom", "alarms"),
+        "overview": ("ready", "unacked", "connections", "consumers", "queues"),
+    }
+
+    # rabbitmq.diff field name to sdswatch field name, per resource type
+    _event_fields = {
+        "queue": {"state": "state", "messages_ready": "ready", "messages_unacknowledged": "unacked"},
+        "connection": {"state": "state", "send_rate": "send_rate_to_client", "recv_rate": "recv_rate_from_client"},
+    }
+
+    def __init__(self, api_endpoint, resource, output=None, max_bytes=0, backup_count=0, writer=None):
+        """
+        @param api_endpoint: the RabbitMQ API endpoint, written on every line.
+        @param resource: "queue", "connection", "connection_group", "node" or "overview".
+        """
+        super().__init__(output, max_bytes, backup_count, writer)
+        if resource not in SDSWatchSink._fields:
+            raise ValueError("unknown resource {}. choose from {}".format(resource, sorted(SDSWatchSink._fields)))
+        self._resource = resource
+        self._api_endpoint = api_endpoint
+
+    def format_cycle(self, now, tuples):
+        (field1, field2, field3), end = SDSWatchSink._fields[self._resource]
+        extra_fields = SDSWatchSink._extra_fields[self._resource]
+        prefix = "{} , {} , rabbitmq.{} , ".format(now, self._api_endpoint, self._resource)
+        connection = self._resource == "connection"
+        lines = []
+        append = lines.append
+        for i in tuples:
+            name = i[0]
+            if connection:
+                # "127.0.0.1:46542 -> 127.0.0.1:5672" is written as "127.0.0.1:46542->127.0.0.1:5672"
+                name = name.replace(" ", "")
+            head = prefix + name + " , "
+            append("{}{}, {}{}".format(head, field1, i[1], end))
+            append("{}{}, {}{}".format(head, field2, i[2], end))
+            append("{}{}, {}{}".format(head, field3, i[3], end))
+            for field, value in zip(extra_fields, i[4:]):
+                append("{}{}, {}{}".format(head, field, value, end))
+            # end for
+        # end for
+        return "".join(lines)
+
+    def _head(self, now, name):
+        if self._resource == "connection":
+            name = name.replace(" ", "")
+        return "{} , {} , rabbitmq.{} , {} , ".format(now, self._api_endpoint, self._resource, name)
+
+    def format_events(self, now, events):
+        end = SDSWatchSink._fields[self._resource][1]
+        labels = SDSWatchSink._event_fields[self._resource]
+        lines = []
+        append = lines.append
+        for event in events:
+            head = self._head(now, event.name)
+            if event.kind == "removed":
+                append("{}state, removed{}".format(head, end))
+                continue
+            for field, value in event.changes.items():
+                append("{}{}, {}{}".format(head, labels.get(field, field), value, end))
+            # end for
+        # end for
+        return "".join(lines)
+
+
+def make_sink(output_format, api_endpoint, resource, output=None, max_bytes=0, backup_count=0, writer=None):
+    """
+    @param output_format: "plain" or "sdswatch"
+    @return: OutputSink
+    """
+    if output_format == "plain":
+        return PlainSink(output, max_bytes, backup_count, writer)
+    if output_format == "sdswatch":
+        return SDSWatchSink(api_endpoint, resource, output, max_bytes, backup_count, writer)
+    raise ValueError("unknown output format {}. choose from plain, sdswatch".format(output_format))
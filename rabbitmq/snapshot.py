@@ -0,0 +1,603 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Local snapshot sharing: one daemon polls the management API and serves the latest queue and
+# connection listings to every local tool over a Unix domain socket, so the broker sees one poller
+# no matter how many monitors, wrappers and scripts run on the host.
+#
+#   SnapshotStore:  the latest listing of each resource keyed by name, with a version that is bumped
+#                   whenever a poll changed anything, and the recent deltas between versions.
+#   SnapshotDaemon: polls on a fixed timeline and serves the store. requests and responses are json lines:
+#       {"op": "info"}
+#           -> {"endpoints": [...], "interval": 10.0, "resources": {"queues": {"version": 42, "timestamp": ..., "count": 30, "columns": [...]}}}
+#       {"op": "get", "resource": "queues", "name": "", "columns": ["name", "state"], "filter": "^(?!celery)", "use_regex": true}
+#           -> {"version": 42, "timestamp": 1590117544.1, "items": [{"name": "jobs_processed", "state": "running"}, ...]}
+#       {"op": "subscribe", "resource": "queues", "since": 40, "columns": null}
+#           -> a full snapshot if the deltas since version 40 are no longer kept, then one line per new version:
+#              {"version": 41, "timestamp": ..., "full": false, "upserts": [{...}, ...], "removed": ["name", ...]}
+#   SnapshotClient: reads from the daemon. RabbitMQ uses it, when opted in with snapshot_socket or
+#                   $RABBITMQ_SNAPSHOT_SOCKET, for queue and connection listings when the daemon is running,
+#                   polls the same cluster, has the requested columns and its snapshot is fresh, and falls back
+#                   to the management API otherwise. the daemon's info is checked again every poll interval.
+#
+# the socket is created with owner-only permissions, and clients only trust a socket owned by themselves
+# or root, so another local user cannot serve them made-up data.
+#
+# example usage:
+#   daemon = SnapshotDaemon(RabbitMQ(endpoint, username, passwd, snapshot_socket=False), interval=10)
+#   daemon.serve_forever()
+#
+#   rbmq = RabbitMQ(endpoint, username, passwd, snapshot_socket=True)   # reads from the daemon if it is running
+#   for delta in SnapshotClient().subscribe("queues"):
+#       print(delta.version, len(delta.upserts), delta.removed)
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import re
+import json
+import time
+import socket
+import threading
+import socketserver
+from collections import namedtuple, deque
+
+from rabbitmq.records import SNAPSHOT_QUEUE_COLUMNS, SNAPSHOT_CONNECTION_COLUMNS
+
+
+# default socket path, overridden by the RABBITMQ_SNAPSHOT_SOCKET environment variable
+DEFAULT_SOCKET_PATH = "/tmp/rabbitmq-snapshot.sock"
+
+
+SnapshotDelta = namedtuple('SnapshotDelta', ['version', 'timestamp', 'full', 'upserts', 'removed'])
+
+
+def socket_path_from_env():
+    return os.environ.get("RABBITMQ_SNAPSHOT_SOCKET") or DEFAULT_SOCKET_PATH
+
+
+def select_columns(item, columns):
+    """
+    keeps only the given (possibly dotted) columns of an item, like the management API does.
+    """
+    result = {}
+    for column in columns:
+        path = column.split(".")
+        value = item
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = result
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+    # end for
+    return result
+
+
+def covers(available, requested):
+    """
+    @return: True if every requested column is one of the available columns, or nested in one of them.
+    """
+    available = set(available)
+    for column in requested:
+        path = column.split(".")
+        if not any(".".join(path[:i]) in available for i in range(1, len(path) + 1)):
+            return False
+    # end for
+    return True
+
+
+def _dumps(value):
+    return (json.dumps(value, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class _Resource:
+
+    __slots__ = ('version', 'timestamp', 'items', 'deltas', 'columns', 'responses')
+
+    def __init__(self, columns, history):
+        self.version = 0
+        self.timestamp = None
+        # name -> item. replaced, never mutated, once published, so readers need no lock.
+        self.items = {}
+        self.deltas = deque(maxlen=history)
+        self.columns = columns
+        # serialized responses of the current version, shared by clients making the same request
+        self.responses = {}
+
+
+class SnapshotStore:
+
+    # max number of distinct cached responses per resource and version
+    _max_responses = 64
+
+    def __init__(self, history=100, clock=time.time):
+        """
+        @param history: number of deltas kept per resource, for subscribers resuming from an older version.
+        """
+        self._history = history
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._resources = {}
+
+    def update(self, resource, items, columns=None):
+        """
+        replaces the listing of a resource. the version is bumped only if an item changed, appeared or disappeared.
+        @param items: iterable of dicts with a "name"
+        @param columns: columns the items were fetched with. None for all fields.
+        @return: the resource's version
+        """
+        new_items = dict((item["name"], item) for item in items)
+        with self._condition:
+            state = self._resources.get(resource)
+            if state is None:
+                state = self._resources[resource] = _Resource(columns, self._history)
+            old_items = state.items
+            upserts = [item for name, item in new_items.items() if old_items.get(name) != item]
+            removed = [name for name in old_items if name not in new_items]
+            state.timestamp = self._clock()
+            if upserts or removed or state.version == 0:
+                state.version += 1
+                state.items = new_items
+                state.columns = columns
+                state.deltas.append(SnapshotDelta(state.version, state.timestamp, False, upserts, removed))
+                state.responses = {}
+                self._condition.notify_all()
+            return state.version
+
+    def resources(self):
+        with self._condition:
+            return dict((name, (s.version, s.timestamp, len(s.items), s.columns)) for name, s in self._resources.items())
+
+    def get(self, resource):
+        """
+        @return: tuple (version, timestamp, dict of name -> item, columns), or None if the resource was never polled
+        """
+        with self._condition:
+            state = self._resources.get(resource)
+            if state is None:
+                return None
+            return (state.version, state.timestamp, state.items, state.columns)
+
+    def cached_response(self, resource, key, build):
+        """
+        @param build: function(items) -> serialized json list of the selected items, called once per version and key.
+        @return: serialized response {"version", "timestamp", "items"}, or None if the resource was never polled
+        """
+        with self._condition:
+            state = self._resources.get(resource)
+            if state is None:
+                return None
+            version, items = state.version, state.items
+            selected = state.responses.get(key)
+        if selected is None:
+            selected = build(items)
+            with self._condition:
+                if state.version == version and len(state.responses) < SnapshotStore._max_responses:
+                    state.responses[key] = selected
+        # the timestamp moves on with every poll, even when the version does not
+        return b'{"version":%d,"timestamp":%r,"items":%s}\n' % (version, state.timestamp, selected)
+
+    def deltas_since(self, resource, since):
+        """
+        @return: list of SnapshotDelta after version since, or None if some of them are no longer kept
+        """
+        with self._condition:
+            state = self._resources.get(resource)
+            if state is None:
+                return None
+            if since == state.version:
+                return []
+            if since > state.version:
+                # e.g. the daemon restarted
+                return None
+            deltas = [d for d in state.deltas if d.version > since]
+            if not deltas or deltas[0].version != since + 1:
+                return None
+            return deltas
+
+    def wait(self, resource, version, timeout=None):
+        """
+        waits until the resource is past version, or timeout.
+        @return: the resource's current version, 0 if never polled
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: resource in self._resources and self._resources[resource].version > version, timeout)
+            state = self._resources.get(resource)
+            return state.version if state else 0
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        daemon = self.server.snapshot_daemon
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self.wfile.write(_dumps({"error": "invalid request"}))
+                continue
+            daemon.requests += 1
+            if request.get("op") == "subscribe":
+                daemon._stream(self.wfile, request)
+                return
+            self.wfile.write(daemon._respond(request))
+            self.wfile.flush()
+        # end for
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class SnapshotDaemon:
+
+    def __init__(self, rbmq, socket_path=None, interval=10.0, queue_columns=SNAPSHOT_QUEUE_COLUMNS,
+                 connection_columns=SNAPSHOT_CONNECTION_COLUMNS, history=100, mode=0o600, lightweight=False):
+        """
+        @param rbmq: RabbitMQ client that queries the management API, created with snapshot_socket=False.
+        @param socket_path: (optional) path of the Unix socket. (default=$RABBITMQ_SNAPSHOT_SOCKET or DEFAULT_SOCKET_PATH)
+        @param interval: seconds between polls.
+        @param queue_columns: columns polled for queues. None for all fields.
+        @param connection_columns: columns polled for connections. None for all fields, 0 or () to not poll connections.
+        @param history: number of deltas kept per resource for resuming subscribers.
+        @param mode: permissions of the socket file. clients of other users need e.g. 0o660 and a shared group.
+        @param lightweight: ask the broker to skip per-queue stats. only useful if queue_columns does not need them.
+        """
+        if getattr(rbmq, "snapshot", None) is not None:
+            raise ValueError("the daemon's client must query the management API. create it with snapshot_socket=False")
+        self._rbmq = rbmq
+        self.socket_path = socket_path or socket_path_from_env()
+        self.interval = interval
+        self._mode = mode
+        self.store = SnapshotStore(history)
+        self._fetches = {
+            "queues": (queue_columns, lambda: rbmq.iter_queues_paged(columns=queue_columns, lightweight=lightweight)),
+        }
+        if connection_columns != () and connection_columns != 0:
+            self._fetches["connections"] = (connection_columns, lambda: rbmq.iter_connections(columns=connection_columns))
+        self._server = None
+        self._stopped = threading.Event()
+        self.polls = 0
+        self.requests = 0
+
+    def poll(self):
+        """
+        polls every resource once. a resource that fails keeps its last snapshot, which ages until clients stop trusting it.
+        """
+        from rabbitmq.RabbitMQ import RabbitMQUnavailable
+        for resource, (columns, fetch) in self._fetches.items():
+            try:
+                version = self.store.update(resource, fetch(), columns)
+                logger.debug("%s version %s", resource, version)
+            except RabbitMQUnavailable as e:
+                logger.warning("skipping {} poll: {}".format(resource, e))
+        # end for
+        self.polls += 1
+
+    def _info(self):
+        return {
+            "endpoints": self._rbmq.endpoints,
+            "interval": self.interval,
+            "resources": dict((name, {"version": version, "timestamp": timestamp, "count": count, "columns": columns})
+                              for name, (version, timestamp, count, columns) in self.store.resources().items()),
+        }
+
+    def _respond(self, request):
+        """
+        @return: serialized response to an info or get request
+        """
+        op = request.get("op")
+        if op == "info":
+            return _dumps(self._info())
+        if op != "get":
+            return _dumps({"error": "unknown op {}".format(op)})
+
+        resource = request.get("resource")
+        name = request.get("name") or ""
+        columns = request.get("columns")
+        name_filter = request.get("filter")
+        use_regex = bool(request.get("use_regex"))
+        snapshot = self.store.get(resource)
+        if snapshot is None:
+            return _dumps({"error": "no snapshot of {}".format(resource)})
+        if columns and snapshot[3] is not None and not covers(snapshot[3], columns):
+            return _dumps({"error": "columns {} are not polled".format(columns)})
+
+        def build(items):
+            if name:
+                selected = [items[name]] if name in items else []
+            elif name_filter:
+                if use_regex:
+                    pattern = re.compile(name_filter)
+                    selected = [item for n, item in items.items() if pattern.search(n)]
+                else:
+                    selected = [item for n, item in items.items() if name_filter in n]
+            else:
+                selected = items.values()
+            if columns:
+                selected = [select_columns(item, columns) for item in selected]
+            return json.dumps(list(selected), separators=(",", ":")).encode("utf-8")
+
+        key = (name, tuple(columns or ()), name_filter, use_regex)
+        try:
+            return self.store.cached_response(resource, key, build)
+        except re.error as e:
+            return _dumps({"error": "invalid regex {}: {}".format(name_filter, e)})
+
+    def _stream(self, wfile, request):
+        """
+        serves a subscription until the client disconnects or the daemon stops.
+        """
+        resource = request.get("resource")
+        columns = request.get("columns")
+        sent = int(request.get("since") or 0)
+        project = (lambda items: [select_columns(item, columns) for item in items]) if columns else list
+        try:
+            while not self._stopped.is_set():
+                deltas = self.store.deltas_since(resource, sent) if sent else None
+                if deltas is None:
+                    snapshot = self.store.get(resource)
+                    if snapshot is not None:
+                        version, timestamp, items, _ = snapshot
+                        wfile.write(_dumps({"version": version, "timestamp": timestamp, "full": True,
+                                            "items": project(items.values()), "removed": []}))
+                        sent = version
+                    deltas = []
+                for delta in deltas:
+                    wfile.write(_dumps({"version": delta.version, "timestamp": delta.timestamp, "full": False,
+                                        "upserts": project(delta.upserts), "removed": delta.removed}))
+                    sent = delta.version
+                # end for
+                wfile.flush()
+                self.store.wait(resource, sent, timeout=1.0)
+            # end while
+        except (BrokenPipeError, ConnectionResetError):
+            # the subscriber went away
+            pass
+
+    def start(self):
+        """
+        binds the socket and serves clients in the background.
+        """
+        if os.path.exists(self.socket_path):
+            # a stale socket of a daemon that did not shut down cleanly
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError("a snapshot daemon is already serving {}".format(self.socket_path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.socket_path)
+            finally:
+                probe.close()
+        old_umask = os.umask(0o777 & ~self._mode)
+        try:
+            self._server = _UnixServer(self.socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.socket_path, self._mode)
+        self._server.snapshot_daemon = self
+        threading.Thread(target=self._server.serve_forever, name="snapshot-server", daemon=True).start()
+        logger.info("serving snapshots on {}".format(self.socket_path))
+
+    def serve_forever(self):
+        """
+        polls on a fixed timeline and serves the snapshots until stop().
+        """
+        if self._server is None:
+            self.start()
+        started = time.monotonic()
+        ticks = 0
+        while not self._stopped.is_set():
+            self.poll()
+            ticks += 1
+            # ticks are on a fixed timeline, so slow polls do not make the period drift
+            next_tick = started + ticks * self.interval
+            now = time.monotonic()
+            if next_tick < now:
+                ticks = int((now - started) // self.interval) + 1
+                next_tick = started + ticks * self.interval
+            self._stopped.wait(next_tick - now)
+        # end while
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+
+class SnapshotClient:
+
+    def __init__(self, socket_path=None, endpoints=None, max_age=None, timeout=5.0, retry_interval=10.0, info_ttl=None):
+        """
+        @param socket_path: (optional) path of the daemon's socket. (default=$RABBITMQ_SNAPSHOT_SOCKET or DEFAULT_SOCKET_PATH)
+        @param endpoints: (optional) management API endpoints of the caller. the daemon is only used if it polls one of them.
+        @param max_age: (optional) seconds after which a snapshot is too old to use. (default=2 poll intervals of the daemon + 5)
+        @param timeout: seconds to wait for the daemon's response.
+        @param retry_interval: seconds to wait before looking for the daemon again after it was not available.
+        @param info_ttl: (optional) seconds the daemon's endpoints and polled columns are trusted before they are checked again,
+            e.g. after the daemon was restarted for another cluster. (default=the daemon's poll interval)
+        """
+        self.socket_path = socket_path or socket_path_from_env()
+        self._endpoints = set(endpoints or ())
+        self._max_age = max_age
+        self._timeout = timeout
+        self._retry_interval = retry_interval
+        self._info_ttl = info_ttl
+        self._lock = threading.Lock()
+        self._socket = None
+        self._reader = None
+        self._info = None
+        self._info_expires = 0.0
+        self._retry_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _trusted(self):
+        try:
+            st = os.stat(self.socket_path)
+        except OSError:
+            return False
+        return st.st_uid in (os.getuid(), 0)
+
+    def _close(self):
+        if self._socket is not None:
+            try:
+                self._reader.close()
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = None
+        self._reader = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        sock.connect(self.socket_path)
+        self._socket = sock
+        self._reader = sock.makefile("rb")
+
+    def _call(self, request):
+        """
+        @return: decoded response. raises OSError or ValueError if the daemon is gone.
+        """
+        if self._socket is None:
+            self._connect()
+        try:
+            self._socket.sendall(_dumps(request))
+            line = self._reader.readline()
+            if not line:
+                raise ConnectionResetError("snapshot daemon closed the connection")
+            return json.loads(line)
+        except (OSError, ValueError):
+            self._close()
+            raise
+
+    def _unavailable(self, reason):
+        if self._info is not None:
+            logger.warning("snapshot daemon on {} not available, querying the management API: {}".format(self.socket_path, reason))
+        self._close()
+        self._info = None
+        self._retry_at = time.monotonic() + self._retry_interval
+
+    def available(self):
+        """
+        @return: True if a trusted daemon is serving the socket, for the caller's endpoints.
+        """
+        with self._lock:
+            return self._available()
+
+    def _available(self):
+        if self._info is not None and time.monotonic() < self._info_expires:
+            return True
+        # (re)validate the daemon: the socket may have been replaced, or the daemon restarted with other endpoints or columns
+        if self._info is None and time.monotonic() < self._retry_at:
+            return False
+        if not self._trusted():
+            self._unavailable("socket missing or not owned by this user or root")
+            return False
+        # reconnect, so the info comes from whoever serves the socket now
+        self._close()
+        try:
+            info = self._call({"op": "info"})
+        except (OSError, ValueError) as e:
+            self._unavailable(e)
+            return False
+        if self._endpoints and not self._endpoints.intersection(info.get("endpoints", ())):
+            logger.info("snapshot daemon on {} polls {}, not {}".format(self.socket_path, info.get("endpoints"), sorted(self._endpoints)))
+            self._info = None
+            self._retry_at = time.monotonic() + self._retry_interval
+            self._close()
+            return False
+        if self._info is None:
+            logger.info("reading snapshots from the daemon on {}".format(self.socket_path))
+        self._info = info
+        self._info_expires = time.monotonic() + (self._info_ttl if self._info_ttl is not None else info.get("interval", 10.0))
+        return True
+
+    def info(self):
+        """
+        @return: dict of the daemon's endpoints, interval, and resource versions
+        """
+        with self._lock:
+            return self._call({"op": "info"})
+
+    def get(self, resource, name='', columns=None, name_filter=None, use_regex=False):
+        """
+        @return: tuple (version, timestamp, list of items). raises ValueError if the daemon cannot serve the request.
+        """
+        with self._lock:
+            response = self._call({"op": "get", "resource": resource, "name": name, "columns": list(columns) if columns else None,
+                                   "filter": name_filter, "use_regex": use_regex})
+        if "error" in response:
+            raise ValueError(response["error"])
+        return (response["version"], response["timestamp"], response["items"])
+
+    def select(self, resource, name='', columns=None, name_filter=None, use_regex=False):
+        """
+        reads a listing from the daemon if it can serve it, for RabbitMQ's transparent use. never raises.
+        @return: list of dicts, or None to query the management API instead
+        """
+        with self._lock:
+            if not self._available():
+                return None
+            polled = self._info["resources"].get(resource)
+            if polled is None or (polled["columns"] is not None and (not columns or not covers(polled["columns"], columns))):
+                # e.g. all fields were requested, but the daemon only polls some
+                self.misses += 1
+                return None
+            try:
+                response = self._call({"op": "get", "resource": resource, "name": name, "columns": list(columns) if columns else None,
+                                       "filter": name_filter, "use_regex": use_regex})
+            except (OSError, ValueError) as e:
+                self._unavailable(e)
+                return None
+        if "error" in response:
+            logger.debug("snapshot daemon: %s", response["error"])
+            self.misses += 1
+            return None
+        max_age = self._max_age if self._max_age is not None else 2 * self._info.get("interval", 10.0) + 5.0
+        if time.time() - response["timestamp"] > max_age:
+            logger.debug("snapshot of %s is older than %ss", resource, max_age)
+            self.misses += 1
+            return None
+        if name and not response["items"]:
+            # let the management API report the missing item
+            self.misses += 1
+            return None
+        self.hits += 1
+        return response["items"]
+
+    def subscribe(self, resource, since=0, columns=None):
+        """
+        streams the changes of a resource over a dedicated connection, starting with a full snapshot
+        unless the deltas since version since are still kept by the daemon.
+        @return: generator of SnapshotDelta. full snapshots have all items in upserts.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        try:
+            sock.sendall(_dumps({"op": "subscribe", "resource": resource, "since": since, "columns": list(columns) if columns else None}))
+            for line in sock.makefile("rb"):
+                message = json.loads(line)
+                yield SnapshotDelta(message["version"], message["timestamp"], message["full"],
+                                    message.get("items") if message["full"] else message["upserts"], message["removed"])
+            # end for
+        finally:
+            sock.close()
+
+    def close(self):
+        with self._lock:
+            self._close()
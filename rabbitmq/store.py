@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# Compact on-disk history of queue and connection samples.
+#
+# samples are appended to a column-oriented, day-partitioned (UTC) layout:
+#   <root>/<resource>/<YYYY-MM-DD>/time.d                    float64 unix timestamps
+#   <root>/<resource>/<YYYY-MM-DD>/name.I                    uint32 index into names.txt
+#   <root>/<resource>/<YYYY-MM-DD>/state.B                   uint8 index into states.txt
+#   <root>/<resource>/<YYYY-MM-DD>/<field>.q or <field>.d    int64 counts or float64 rates
+#   <root>/<resource>/<YYYY-MM-DD>/names.txt, states.txt     one dictionary entry per line
+# each column file is a flat array in native byte order, with one entry per sample. rows are appended
+# in time order, so a time range is found by binary search on time.d. readers memory-map the column
+# files and only touch the pages of the rows they read.
+#
+# the monitors append the records that changed at each poll, so a series is a step function:
+# a value holds until the next sample of the same name. to keep each partition self-contained, the
+# writer starts a new partition with a checkpoint of the last values of every name, at midnight,
+# and a name that disappeared gets a row with the state "removed". queries then carry in the value a
+# name held at the start of the range from the partition's earlier rows.
+#
+# queries scan whole column ranges with numpy if it is installed, or with C-level searches of the
+# column bytes otherwise, rather than looping over every row in python.
+#
+# example usage:
+#   writer = HistoryWriter("/data/rabbitmq-history", "queue")
+#   writer.append(time.time(), queue_tuples)
+#   reader = HistoryReader("/data/rabbitmq-history", "queue")
+#   reader.series("jobs_processed", "messages_ready", start, end)
+#   [(1590117544.0, 0), (1590117604.0, 1)]
+#   reader.top("messages_ready", start, end, 10)
+#   [("urgent-response-job_worker-large", 13090), ...]
+#
+# ---------------------------------------------------------
+
+import os
+import mmap
+import heapq
+import bisect
+from array import array
+from datetime import datetime, timezone, timedelta
+
+# numpy is optional, and only used to scan columns faster if installed
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# value columns after the name and state of queue and connection tuples, and their array typecodes
+RESOURCE_COLUMNS = {
+    "queue": (("messages_ready", "q"), ("messages_unacknowledged", "q")),
+    "connection": (("send_rate", "d"), ("recv_rate", "d")),
+}
+
+
+# state of the row written for a name that disappeared
+REMOVED_STATE = "removed"
+
+
+def _partition_name(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d")
+
+
+def _partition_start(partition):
+    return datetime.strptime(partition, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+def _find_rows(column, key, lo, hi):
+    """
+    @return: list of the rows in [lo, hi) of a uint32 column that are equal to key
+    """
+    if lo >= hi:
+        return []
+    if numpy is not None:
+        return (numpy.flatnonzero(numpy.asarray(column[lo:hi]) == key) + lo).tolist()
+    # bytes.find scans in C. a match that is not aligned to an entry spans two entries, so it is skipped.
+    itemsize = column.itemsize
+    needle = array(column.format, [key]).tobytes()
+    data = column[lo:hi].tobytes()
+    rows = []
+    i = data.find(needle)
+    while i != -1:
+        if i % itemsize:
+            i = data.find(needle, i + 1)
+            continue
+        rows.append(lo + i // itemsize)
+        i = data.find(needle, i + itemsize)
+    # end while
+    return rows
+
+
+def _find_last_row(column, key, end):
+    """
+    @return: the last row before end of a uint32 column that is equal to key, or None
+    """
+    if end <= 0:
+        return None
+    if numpy is not None:
+        rows = numpy.flatnonzero(numpy.asarray(column[:end]) == key)
+        return int(rows[-1]) if len(rows) else None
+    itemsize = column.itemsize
+    needle = array(column.format, [key]).tobytes()
+    data = column[:end].tobytes()
+    i = data.rfind(needle)
+    while i != -1 and i % itemsize:
+        i = data.rfind(needle, 0, i + itemsize - 1)
+    # end while
+    return None if i == -1 else i // itemsize
+
+
+def _last_rows(column, end):
+    """
+    @return: dict {key: its last row before end} of a uint32 column
+    """
+    if end <= 0:
+        return {}
+    if numpy is not None:
+        # the first occurrence in the reversed column is the last one
+        keys, reversed_rows = numpy.unique(numpy.asarray(column[:end])[::-1], return_index=True)
+        return dict(zip(keys.tolist(), (end - 1 - reversed_rows).tolist()))
+    # later rows overwrite earlier ones
+    return dict(zip(column[:end], range(end)))
+
+
+def _peaks(keys, values, size):
+    """
+    @param keys: uint32 column slice of dictionary indexes, less than size
+    @param values: numeric column slice of the same rows
+    @return: dict {key: max value} of the keys in the slice
+    """
+    if numpy is not None:
+        keys = numpy.asarray(keys)
+        values = numpy.asarray(values)
+        if not len(keys):
+            return {}
+        lowest = -numpy.inf if values.dtype.kind == "f" else numpy.iinfo(values.dtype).min
+        peaks = numpy.full(size, lowest, dtype=values.dtype)
+        numpy.maximum.at(peaks, keys, values)
+        seen = numpy.zeros(size, dtype=bool)
+        seen[keys] = True
+        present = numpy.flatnonzero(seen)
+        return dict(zip(present.tolist(), peaks[present].tolist()))
+    peaks = {}
+    get = peaks.get
+    for key, value in zip(keys, values):
+        peak = get(key)
+        if peak is None or value > peak:
+            peaks[key] = value
+    # end for
+    return peaks
+
+
+class HistoryWriter:
+
+    def __init__(self, root, resource):
+        """
+        @param root: directory of the history store. created if missing.
+        @param resource: "queue" or "connection"
+        """
+        if resource not in RESOURCE_COLUMNS:
+            raise ValueError("unknown resource {}. choose from {}".format(resource, sorted(RESOURCE_COLUMNS)))
+        self._dir = os.path.join(root, resource)
+        self._columns = RESOURCE_COLUMNS[resource]
+        self._partition = None
+        self._files = None
+        self._names = None
+        self._states = None
+        # name -> last tuple written, checkpointed at the start of the next partition
+        self._last = {}
+
+    def _open_partition(self, partition):
+        """
+        @return: True if the partition is new, i.e. has no rows yet
+        """
+        self.close()
+        path = os.path.join(self._dir, partition)
+        os.makedirs(path, exist_ok=True)
+        time_path = os.path.join(path, "time.d")
+        new = not os.path.exists(time_path) or os.path.getsize(time_path) == 0
+        self._names = {}
+        self._states = {}
+        for dictionary, file_name in ((self._names, "names.txt"), (self._states, "states.txt")):
+            file_path = os.path.join(path, file_name)
+            if os.path.exists(file_path):
+                with open(file_path, encoding="utf-8") as f:
+                    for i, line in enumerate(f):
+                        dictionary[line.rstrip("\n")] = i
+        # end for
+        self._files = {
+            "names.txt": open(os.path.join(path, "names.txt"), "a", encoding="utf-8"),
+            "states.txt": open(os.path.join(path, "states.txt"), "a", encoding="utf-8"),
+            "time": open(os.path.join(path, "time.d"), "ab"),
+            "name": open(os.path.join(path, "name.I"), "ab"),
+            "state": open(os.path.join(path, "state.B"), "ab"),
+        }
+        for field, typecode in self._columns:
+            self._files[field] = open(os.path.join(path, "{}.{}".format(field, typecode)), "ab")
+        self._partition = partition
+        return new
+
+    def _lookup(self, dictionary, file_name, value):
+        index = dictionary.get(value)
+        if index is None:
+            index = dictionary[value] = len(dictionary)
+            self._files[file_name].write(value.replace("\n", " ") + "\n")
+        return index
+
+    def append(self, timestamp, tuples, removed=()):
+        """
+        appends one poll of tuples (name, state, value1, value2), all with the same timestamp.
+        each column gets one write per call.
+        @param removed: (optional) names that disappeared in this poll. they get a row with the state "removed".
+        """
+        tuples = list(tuples)
+        tuples.extend((name, REMOVED_STATE) + (0,) * len(self._columns) for name in removed)
+        if not tuples:
+            return
+        partition = _partition_name(timestamp)
+        if partition != self._partition:
+            if self._open_partition(partition) and self._last:
+                self._write(_partition_start(partition), list(self._last.values()))
+        self._write(timestamp, tuples)
+
+        for t in tuples:
+            if t[1] == REMOVED_STATE:
+                self._last.pop(t[0], None)
+            else:
+                self._last[t[0]] = t
+        # end for
+
+    def _write(self, timestamp, tuples):
+        names = array('I', [self._lookup(self._names, "names.txt", t[0]) for t in tuples])
+        states = array('B', [self._lookup(self._states, "states.txt", t[1]) for t in tuples])
+        # dictionaries first, so that a reader never sees an index without its entry
+        self._files["names.txt"].flush()
+        self._files["states.txt"].flush()
+
+        self._files["time"].write(array('d', [timestamp]) * len(tuples))
+        self._files["name"].write(names)
+        self._files["state"].write(states)
+        for i, (field, typecode) in enumerate(self._columns):
+            self._files[field].write(array(typecode, [t[2 + i] if t[2 + i] is not None else 0 for t in tuples]))
+        # end for
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        if self._files:
+            for f in self._files.values():
+                f.close()
+        self._files = None
+        self._partition = None
+
+
+class _Partition:
+    """
+    read-only memory-mapped view of one day partition.
+    """
+
+    def __init__(self, path, columns):
+        self._maps = []
+        self.names = self._read_lines(os.path.join(path, "names.txt"))
+        self.states = self._read_lines(os.path.join(path, "states.txt"))
+        self.columns = {
+            "time": self._map(os.path.join(path, "time.d"), "d"),
+            "name": self._map(os.path.join(path, "name.I"), "I"),
+            "state": self._map(os.path.join(path, "state.B"), "B"),
+        }
+        for field, typecode in columns:
+            self.columns[field] = self._map(os.path.join(path, "{}.{}".format(field, typecode)), typecode)
+        # a writer may have been interrupted between column writes, so only read complete rows
+        self.rows = min(len(column) for column in self.columns.values())
+
+    @staticmethod
+    def _read_lines(file_path):
+        if not os.path.exists(file_path):
+            return []
+        with open(file_path, encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f]
+
+    def _map(self, file_path, typecode):
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        itemsize = array(typecode).itemsize
+        size -= size % itemsize
+        if size == 0:
+            return memoryview(b"").cast(typecode)
+        with open(file_path, "rb") as f:
+            m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        view = memoryview(m)
+        self._maps.append((m, view))
+        return view.cast(typecode)
+
+    def row_range(self, start, end):
+        """
+        @return: tuple (first row, last row + 1) with start <= time < end
+        """
+        times = self.columns["time"]
+        lo = bisect.bisect_left(times, start, 0, self.rows) if start is not None else 0
+        hi = bisect.bisect_left(times, end, lo, self.rows) if end is not None else self.rows
+        return lo, hi
+
+    def close(self):
+        for column in self.columns.values():
+            column.release()
+        for m, view in self._maps:
+            view.release()
+            m.close()
+
+
+class HistoryReader:
+
+    def __init__(self, root, resource):
+        """
+        @param root: directory of the history store.
+        @param resource: "queue" or "connection"
+        """
+        if resource not in RESOURCE_COLUMNS:
+            raise ValueError("unknown resource {}. choose from {}".format(resource, sorted(RESOURCE_COLUMNS)))
+        self._dir = os.path.join(root, resource)
+        self._columns = RESOURCE_COLUMNS[resource]
+        self.fields = ("state",) + tuple(field for field, typecode in self._columns)
+
+    def partitions(self, start=None, end=None):
+        """
+        @return: sorted list of partition names overlapping [start, end)
+        """
+        if not os.path.isdir(self._dir):
+            return []
+        partitions = sorted(os.listdir(self._dir))
+        if start is not None:
+            first = _partition_name(start)
+            partitions = [p for p in partitions if p >= first]
+        if end is not None:
+            # end is exclusive, so a range ending at midnight does not open the next partition
+            last = _partition_name(end - 1e-6)
+            partitions = [p for p in partitions if p <= last]
+        return partitions
+
+    def _iter_partitions(self, start, end):
+        for name in self.partitions(start, end):
+            partition = _Partition(os.path.join(self._dir, name), self._columns)
+            try:
+                yield partition
+            finally:
+                partition.close()
+        # end for
+
+    def _check_field(self, field):
+        if field not in self.fields:
+            raise ValueError("unknown field {}. choose from {}".format(field, self.fields))
+
+    def series(self, name, field, start=None, end=None):
+        """
+        @param start: (optional) unix timestamp, inclusive
+        @param end: (optional) unix timestamp, exclusive
+        @return: list of (timestamp, value) samples of name in [start, end). if the name had a value before start,
+                 the first sample is (start, that value).
+        """
+        self._check_field(field)
+        result = []
+        for partition in self._iter_partitions(start, end):
+            try:
+                key = partition.names.index(name)
+            except ValueError:
+                continue
+            lo, hi = partition.row_range(start, end)
+            names = partition.columns["name"]
+            times = partition.columns["time"]
+            values = partition.columns[field]
+            rows = _find_rows(names, key, lo, hi)
+            samples = [(times[row], values[row]) for row in rows]
+            if not result and start is not None and (not rows or times[rows[0]] > start):
+                # the value held at the start of the range, unless the name was removed before it
+                row = _find_last_row(names, key, lo)
+                if row is not None and partition.states[partition.columns["state"][row]] != REMOVED_STATE:
+                    samples.insert(0, (start, values[row]))
+            if field == "state":
+                samples = [(timestamp, partition.states[value]) for timestamp, value in samples]
+            result.extend(samples)
+        # end for
+        return result
+
+    def top(self, field, start=None, end=None, n=10):
+        """
+        @return: list of (name, peak value) of the n names with the highest peak of a numeric field in [start, end),
+                 including the values held at start
+        """
+        self._check_field(field)
+        if field == "state":
+            raise ValueError("top needs a numeric field, not state")
+        peaks = {}
+        for partition in self._iter_partitions(start, end):
+            lo, hi = partition.row_range(start, end)
+            names = partition.columns["name"]
+            values = partition.columns[field]
+            # peak per dictionary index first, then map to names, since indexes are per partition
+            partition_peaks = _peaks(names[lo:hi], values[lo:hi], len(partition.names))
+            if lo > 0:
+                # the values held at the start of the range count too, except of names removed before it
+                states = partition.columns["state"]
+                removed = partition.states.index(REMOVED_STATE) if REMOVED_STATE in partition.states else None
+                for key, row in _last_rows(names, lo).items():
+                    if states[row] == removed:
+                        continue
+                    value = values[row]
+                    peak = partition_peaks.get(key)
+                    if peak is None or value > peak:
+                        partition_peaks[key] = value
+                # end for
+            for key, value in partition_peaks.items():
+                name = partition.names[key]
+                if name not in peaks or value > peaks[name]:
+                    peaks[name] = value
+            # end for
+        # end for
+        return heapq.nlargest(n, peaks.items(), key=lambda item: item[1])
+
+
+def parse_time(value):
+    """
+    parses a unix timestamp, an ISO 8601 timestamp, or "yesterday" / "today" (UTC midnight).
+    @return: unix timestamp
+    """
+    if value in ("today", "yesterday"):
+        midnight = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        if value == "yesterday":
+            midnight -= timedelta(days=1)
+        return midnight.timestamp()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
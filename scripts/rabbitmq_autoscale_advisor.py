@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script calls RabbitMQ REST API to recommend a worker count for each HySDS job queue ("*-job_worker-*"),
+# from the queue backlog, consumers and job completion rate, with hysteresis on scale-downs.
+#
+# input arguments:
+#   --endpoint: the RabbitMQ API endpoint. e.g. "https://mozart.mycluster.hysds.io:15673" see http://e-jobs.aria.hysds.io:15672/api/
+#               for a cluster, a comma-separated list of the endpoints of each node. polls fail over between them.
+#   --username: username for rabbitmq
+#   --passwd: password for rabbitmq
+#   --pattern: (optional) pattern of the job queue names. (default="*-job_worker-*")
+#   --min-workers: (optional) lowest recommended worker count. (default=0)
+#   --max-workers: (optional) highest recommended worker count. (default=100)
+#   --target-drain: (optional) seconds in which the current backlog should be drained. (default=600)
+#   --down-stable: (optional) number of consecutive polls a lower count must be wanted before scaling down. (default=5)
+#   --idle-utilisation: (optional) consumer utilisation from which the workers of a queue with a backlog are idle rather than
+#                       saturated, so the queue is not scaled up. -1 to ignore the consumer utilisation. (default=0.9)
+#   --interval: (optional) frequency of how often to check rabbitmq in unit seconds. (default=10)
+#   --once: (optional) output one set of recommendations and exit.
+#
+# outputs to stdout, one json document per poll:
+#   {"timestamp": ..., "endpoint": ..., "recommendations": [{"queue": ..., "current": ..., "recommended": ..., ...}]}
+#
+# example usage:
+#   rabbitmq_autoscale_advisor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --max-workers=50 --once
+#   {"timestamp": "2020-05-22T03:19:04+00:00", "endpoint": "https://mozart.mycluster.hysds.io:15673", "recommendations": [{"queue": "urgent-response-job_worker-large", "current": 10, "recommended": 25, "wanted": 25, "messages_ready": 12349, "messages_unacknowledged": 10, "ack_rate": 0.2, "consumer_utilisation": 0.0, "reason": "drain backlog in 600s"}]}
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_autoscale_advisor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest [--pattern="*-job_worker-*"] [--min-workers=0] [--max-workers=100] [--target-drain=600] [--once] \n' )
+
+
+import sys, getopt
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    # rabbitmq credentials
+    username = ''
+    passwd = ''
+
+    api_endpoint = ''
+    pattern = '*-job_worker-*'
+    min_workers = 0
+    max_workers = 100
+    target_drain = 600.0
+    down_stable = 5
+    idle_utilisation = 0.9
+    interval = 10
+    once = False
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"he:u:p:i:",["endpoint=","username=","passwd=","pattern=","min-workers=","max-workers=","target-drain=","down-stable=","idle-utilisation=","interval=","once"])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt in ("-e", "--endpoint"):
+            api_endpoint = arg
+        elif opt in ("-u", "--username"):
+            username = arg
+        elif opt in ("-p", "--passwd"):
+            passwd = arg
+        elif opt == "--pattern":
+            pattern = arg
+        elif opt == "--min-workers":
+            min_workers = int(arg)
+        elif opt == "--max-workers":
+            max_workers = int(arg)
+        elif opt == "--target-drain":
+            target_drain = float(arg)
+        elif opt == "--down-stable":
+            down_stable = int(arg)
+        elif opt == "--idle-utilisation":
+            idle_utilisation = float(arg) if float(arg) >= 0 else None
+        elif opt in ("-i", "--interval"):
+            interval = float(arg)
+        elif opt == "--once":
+            once = True
+
+    # check if non-null string
+    if not api_endpoint.strip():
+        show_usage()
+        sys.exit(2)
+
+    import json
+    import time
+    from datetime import datetime
+
+    from rabbitmq.RabbitMQ import RabbitMQ, RabbitMQUnavailable
+    from rabbitmq.autoscale import AutoscaleAdvisor, ADVISOR_COLUMNS
+
+    rbmq = RabbitMQ(api_endpoint, username, passwd)
+    advisor = AutoscaleAdvisor(pattern, min_workers, max_workers, target_drain, down_stable=down_stable,
+                               idle_utilisation=idle_utilisation)
+
+    while True:
+        # timestamp of query
+        now = datetime.now().astimezone().replace(microsecond=0).isoformat()
+
+        try:
+            recommendations = advisor.evaluate(rbmq.iter_queues(columns=ADVISOR_COLUMNS))
+        except RabbitMQUnavailable as e:
+            # e.g. the cluster nodes are restarting. try again at the next poll.
+            if once:
+                raise
+            logger.warning("skipping poll: {}".format(e))
+            time.sleep(interval)
+            continue
+
+        sys.stdout.write(json.dumps({
+            "timestamp": now,
+            "endpoint": api_endpoint,
+            "recommendations": [r.to_dict() for r in recommendations],
+        }) + "\n")
+        sys.stdout.flush()
+
+        if once:
+            break
+        time.sleep(interval)
+    # end while
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script benchmarks the fetch, decode, convert and diff stages of the monitors, and their peak memory,
+# against a mock management API (see rabbitmq_mock_api_server.py) or a given endpoint.
+# Results can be saved as a baseline, and later runs compared against it to catch regressions.
+#
+# benchmarks, each the best of --repeat runs:
+#   fetch_queues_full, fetch_queues_columns, fetch_queues_paged, fetch_queues_stream, fetch_connections_columns:
+#       seconds to fetch and decode the listing with get_queues()/iter_queues()/get_connections()
+#   decode_<backend>: seconds to decode the full queue listing with each available json backend
+#   convert_queue_tuple, convert_queue_record, convert_queue_snapshot: seconds to convert the queue dicts
+#   diff_set, diff_engine: seconds to diff two consecutive polls of queue tuples
+#   memory_queues_list, memory_queues_snapshot: peak bytes allocated while fetching into a list of dicts
+#       vs streaming into a QueueSnapshot
+#
+# input arguments:
+#   --queues: (optional) number of mock queues. (default=10000)
+#   --connections: (optional) number of mock connections. (default=2000)
+#   --latency: (optional) mock response latency, in unit seconds. (default=0)
+#   --endpoint: (optional) benchmark this API endpoint instead of starting a mock server.
+#   --username: (optional) username for --endpoint. (default=guest)
+#   --passwd: (optional) password for --endpoint. (default=guest)
+#   --repeat: (optional) number of runs of each benchmark. (default=5)
+#   --save: (optional) file to save the results to, as a baseline.
+#   --baseline: (optional) baseline file to compare the results against.
+#   --threshold: (optional) slowdown or memory growth over the baseline reported as a regression, as a fraction. (default=0.2)
+#
+# outputs to stdout:
+#   benchmark, value, unit, items per second, change from the baseline
+# exits with status 1 if any benchmark regressed.
+#
+# example usage:
+#   rabbitmq_benchmark.py --queues=50000 --connections=5000 --save=baseline.json
+#   rabbitmq_benchmark.py --queues=50000 --connections=5000 --baseline=baseline.json
+#   fetch_queues_columns 0.412318 s 121266 -3.1%
+#   diff_engine 0.061240 s 816459 +27.5% REGRESSION
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+import gc
+import json
+import time
+import tracemalloc
+
+
+def best_of(repeat, func):
+    """
+    @return: tuple (fastest run in seconds, result of the last run)
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    # end for
+    return best, result
+
+
+def peak_memory(func):
+    """
+    @return: peak bytes allocated by python while running func
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def run_benchmarks(rbmq, repeat, advance=None):
+    """
+    @param advance: (optional) function moving the mock server to its next tick, for the diff benchmarks.
+    @return: list of (benchmark, value, unit, item count)
+    """
+    from rabbitmq.RabbitMQ import RabbitMQ, _json_backends
+    from rabbitmq.records import QueueRecord, QueueSnapshot
+    from rabbitmq.diff import DiffEngine, QUEUE_FIELDS
+
+    results = []
+    columns = RabbitMQ.QUEUE_TUPLE_COLUMNS
+
+    seconds, queues = best_of(repeat, lambda: rbmq.get_queues())
+    results.append(("fetch_queues_full", seconds, "s", len(queues)))
+    seconds, projected = best_of(repeat, lambda: rbmq.get_queues(columns=columns))
+    results.append(("fetch_queues_columns", seconds, "s", len(projected)))
+    seconds, paged = best_of(repeat, lambda: rbmq.get_queues(columns=columns, page_size=RabbitMQ._default_page_size))
+    results.append(("fetch_queues_paged", seconds, "s", len(paged)))
+    seconds, streamed = best_of(repeat, lambda: list(rbmq.iter_queues(columns=columns)))
+    results.append(("fetch_queues_stream", seconds, "s", len(streamed)))
+    seconds, connections = best_of(repeat, lambda: rbmq.get_connections(columns=RabbitMQ.CONNECTION_TUPLE_COLUMNS))
+    results.append(("fetch_connections_columns", seconds, "s", len(connections)))
+
+    content = rbmq._get(RabbitMQ._api_queues_path).content
+    for backend in sorted(_json_backends):
+        loads = _json_backends[backend]
+        seconds, decoded = best_of(repeat, lambda: loads(content))
+        results.append(("decode_{}".format(backend), seconds, "s", len(decoded)))
+    # end for
+
+    seconds, tuples = best_of(repeat, lambda: [RabbitMQ.queue_to_tuple(q) for q in queues])
+    results.append(("convert_queue_tuple", seconds, "s", len(tuples)))
+    seconds, records = best_of(repeat, lambda: [QueueRecord.from_dict(q) for q in queues])
+    results.append(("convert_queue_record", seconds, "s", len(records)))
+    seconds, snapshot = best_of(repeat, lambda: QueueSnapshot.from_queues(queues))
+    results.append(("convert_queue_snapshot", seconds, "s", len(snapshot)))
+
+    # two consecutive polls, with the mock's next tick in between
+    if advance is not None:
+        advance()
+    new_tuples = [RabbitMQ.queue_to_tuple(q) for q in rbmq.get_queues(columns=columns)]
+
+    def diff_set():
+        old, new = set(tuples), set(new_tuples)
+        return (new - old) | (old - new)
+    seconds, changed = best_of(repeat, diff_set)
+    results.append(("diff_set", seconds, "s", len(new_tuples)))
+
+    def diff_engine():
+        engine = DiffEngine(QUEUE_FIELDS)
+        engine.update(tuples)
+        start = time.perf_counter()
+        events = engine.update(new_tuples)
+        return time.perf_counter() - start, events
+    # time only the second update, which is the steady-state cost per poll
+    best = min(diff_engine()[0] for _ in range(repeat))
+    results.append(("diff_engine", best, "s", len(new_tuples)))
+
+    results.append(("memory_queues_list", peak_memory(lambda: rbmq.get_queues(columns=columns)), "B", len(tuples)))
+    results.append(("memory_queues_snapshot", peak_memory(lambda: rbmq.get_queue_snapshot()), "B", len(tuples)))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    @return: list of (benchmark, value, unit, items per second, change from the baseline or None, regressed)
+    """
+    rows = []
+    for name, value, unit, items in results:
+        per_second = int(items / value) if unit == "s" and value > 0 else None
+        previous = baseline.get(name)
+        change = None
+        regressed = False
+        if previous:
+            # for both seconds and bytes, lower is better
+            change = value / previous - 1.0
+            regressed = change > threshold
+        rows.append((name, value, unit, per_second, change, regressed))
+    # end for
+    return rows
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_benchmark.py [--queues=10000] [--connections=2000] [--latency=0] [--endpoint="http://127.0.0.1:15672" --username=guest --passwd=guest] [--repeat=5] [--save=baseline.json] [--baseline=baseline.json] [--threshold=0.2] \n' )
+
+
+import sys, getopt
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    queues = 10000
+    connections = 2000
+    latency = 0.0
+    api_endpoint = ''
+    username = 'guest'
+    passwd = 'guest'
+    repeat = 5
+    save_file = None
+    baseline_file = None
+    threshold = 0.2
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"he:u:p:",["queues=","connections=","latency=","endpoint=","username=","passwd=","repeat=","save=","baseline=","threshold="])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt == "--queues":
+            queues = int(arg)
+        elif opt == "--connections":
+            connections = int(arg)
+        elif opt == "--latency":
+            latency = float(arg)
+        elif opt in ("-e", "--endpoint"):
+            api_endpoint = arg
+        elif opt in ("-u", "--username"):
+            username = arg
+        elif opt in ("-p", "--passwd"):
+            passwd = arg
+        elif opt == "--repeat":
+            repeat = int(arg)
+        elif opt == "--save":
+            save_file = arg
+        elif opt == "--baseline":
+            baseline_file = arg
+        elif opt == "--threshold":
+            threshold = float(arg)
+
+    from rabbitmq.RabbitMQ import RabbitMQ
+    from rabbitmq.mock_api import MockManagementAPI
+
+    server = None
+    if not api_endpoint.strip():
+        # ticks are advanced by the benchmark, so that every run of a benchmark sees the same payload
+        server = MockManagementAPI(queues, connections, latency, tick_interval=0).start()
+        api_endpoint = server.url
+
+    baseline = {}
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = json.load(f)["results"]
+
+    rbmq = RabbitMQ(api_endpoint, username, passwd, snapshot_socket=False)
+    try:
+        results = run_benchmarks(rbmq, repeat, server.advance if server is not None else None)
+    finally:
+        rbmq.close()
+        if server is not None:
+            server.stop()
+
+    regressed = False
+    lines = []
+    for name, value, unit, per_second, change, is_regression in compare(results, baseline, threshold):
+        line = "{} {} {}".format(name, "{:.6f}".format(value) if unit == "s" else value, unit)
+        if per_second is not None:
+            line += " {}".format(per_second)
+        if change is not None:
+            line += " {:+.1%}".format(change)
+        if is_regression:
+            line += " REGRESSION"
+            regressed = True
+        lines.append(line + "\n")
+    # end for
+    sys.stdout.write("".join(lines))
+
+    if save_file:
+        with open(save_file, "w") as f:
+            json.dump({"params": {"queues": queues, "connections": connections, "latency": latency, "endpoint": api_endpoint if server is None else None},
+                       "results": {name: value for name, value, unit, items in results}}, f, indent=2)
+
+    if regressed:
+        sys.exit(1)
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -6,14 +6,37 @@
 # 
 # input arguments:
 #   --endpoint: the RabbitMQ API endpoint. e.g. "https://mozart.mycluster.hysds.io:15673" see http://e-jobs.aria.hysds.io:15672/api/
+#               for a cluster, a comma-separated list of the endpoints of each node. polls fail over between them.
 #   --username: username for rabbitmq
 #   --passwd: password for rabbitmq
 #   --connection: (optional) name of connection. if specified, it will only return info for this queue name. if not specified, then all connections will be shown.
 #                 format of this string is "127.0.0.1:46542 -> 127.0.0.1:5672"
 #   --interval: (optional) frequency of how often to check rabbitmq in unit seconds. (default=10)
+#   --format: (optional) output format, "plain" or "sdswatch". (default=plain)
+#   --output: (optional) file to write to instead of stdout.
+#   --max-bytes: (optional) rotate the output file when it reaches this size in bytes. (default=0, no rotation)
+#   --backup-count: (optional) number of rotated output files to keep. (default=0)
+#   --store: (optional) directory of a compact on-disk history. the changed records of each poll are appended to it,
+#            and can be queried with rabbitmq_history_query.py.
+#   --diff: (optional) "record" outputs whole records that changed, "field" outputs only the fields that changed
+#           and the connections that disappeared. (default=record)
+#   --deadband: (optional, repeatable, with --diff=field) ignore changes of a numeric field smaller than an absolute
+#               or relative amount, as field:abs:value or field:rel:value. fields are send_rate, recv_rate.
+#   --group-by: (optional) "host", "user" or "product". if specified, sums the connections per client host, user or
+#               client product, and outputs the --top heaviest groups every poll instead of the changed connections.
+#   --top: (optional, with --group-by) number of groups to output per poll. 0 for all groups. (default=10)
+#   --top-by: (optional, with --group-by) field to rank the groups by: connections, send_rate, recv_rate or channels. (default=send_rate)
+#   --alerts: (optional) json rule file of alerts evaluated on the changed connections of each poll, see rabbitmq/alerts.py.
+#             notifications go to the rule file's sinks, e.g. the log or a webhook. not with --group-by.
+#   --stats-interval: (optional) log a line of per-phase timings (fetch, convert, diff, write, ...), record counts,
+#                     payload bytes and missed deadlines every this many seconds, see rabbitmq/instrumentation.py. (default=0, disabled)
+#   --profile-dir: (optional) sample the stack of each poll, and keep the profiles of the slowest polls in this directory
+#                  as folded stacks, e.g. for flamegraph.pl.
+#   --profile-top: (optional) number of slowest polls to keep profiles of. (default=5)
 #
 # outputs to stdout:
 #   timestamp, connection_name, connection_state, connection_send_rate, connection_recv_rate
+#   with --group-by: timestamp, group, connections, send_rate, recv_rate, channels
 # note that
 #   * the connection_name is:  "client_host:client_port -> server_host:server_port"
 #   * send/receive rates are in B/s units.
@@ -26,6 +49,10 @@
 # 2020-05-22T02:24:32+00:00 , https://100.67.33.56:15673 , rabbitmq.connection , 127.0.0.1:41454->127.0.0.1:5672 , state, running 
 # 2020-05-22T02:24:32+00:00 , https://100.67.33.56:15673 , rabbitmq.connection , 127.0.0.1:41454->127.0.0.1:5672 , send_rate_to_client, 0.0 
 # 2020-05-22T02:24:32+00:00 , https://100.67.33.56:15673 , rabbitmq.connection , 127.0.0.1:41454->127.0.0.1:5672 , recv_rate_from_client, 0.0 
+#
+# rabbitmq_connection_monitor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --group-by=host --top=2
+# 2020-05-22T02:24:32+00:00 host=100.64.1.17 12 4410.3 120.5 12
+# 2020-05-22T02:24:32+00:00 host=100.64.1.18 10 1450.0 98.1 10
 
 #
 # ---------------------------------------------------------
@@ -39,7 +66,7 @@ logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcNa
 
 def show_usage():
     print('Usage:\n')
-    print('rabbitmq_connection_monitor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest [--connection=] \n' )
+    print('rabbitmq_connection_monitor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest [--connection=] [--group-by=host] [--top=10] [--top-by=send_rate] \n' )
 
 
 import sys, getopt
@@ -56,11 +83,25 @@ def main(argv):
     api_endpoint = ''
     connection_name = ''
     interval = 10
+    output_format = 'plain'
+    output = None
+    max_bytes = 0
+    backup_count = 0
+    diff_mode = 'record'
+    store_dir = None
+    deadbands = []
+    group_by = None
+    top = 10
+    top_by = 'send_rate'
+    alerts_file = None
+    stats_interval = 0
+    profile_dir = None
+    profile_top = 5
 
     # ---------------------------------------------------------
 
     try:
-        opts, args = getopt.getopt(argv,"he:u:p:c:i:",["endpoint=","username=","passwd=","connection=","interval="])
+        opts, args = getopt.getopt(argv,"he:u:p:c:i:f:o:",["endpoint=","username=","passwd=","connection=","interval=","format=","output=","max-bytes=","backup-count=","diff=","deadband=","store=","group-by=","top=","top-by=","alerts=","stats-interval=","profile-dir=","profile-top="])
     except getopt.GetoptError:
         show_usage()
         sys.exit(2)
@@ -78,55 +119,167 @@ def main(argv):
             connection_name = arg
         elif opt in ("-i", "--interval"):
             interval = int(arg)
+        elif opt in ("-f", "--format"):
+            output_format = arg
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt == "--max-bytes":
+            max_bytes = int(arg)
+        elif opt == "--backup-count":
+            backup_count = int(arg)
+        elif opt == "--diff":
+            diff_mode = arg
+        elif opt == "--store":
+            store_dir = arg
+        elif opt == "--deadband":
+            deadbands.append(arg)
+        elif opt == "--group-by":
+            group_by = arg
+        elif opt == "--top":
+            top = int(arg)
+        elif opt == "--top-by":
+            top_by = arg
+        elif opt == "--alerts":
+            alerts_file = arg
+        elif opt == "--stats-interval":
+            stats_interval = float(arg)
+        elif opt == "--profile-dir":
+            profile_dir = arg
+        elif opt == "--profile-top":
+            profile_top = int(arg)
 
-    # check if non-null string
-    if not api_endpoint.strip():
+    # check if non-null string. groups are output every poll, so they are neither diffed, stored nor alerted on.
+    if not api_endpoint.strip() or (group_by and (diff_mode != "record" or store_dir or alerts_file)):
         show_usage()
         sys.exit(2)
 
-    from rabbitmq.RabbitMQ import RabbitMQ
+    # check the grouping before the first poll rather than failing in it
+    from rabbitmq.aggregate import GROUP_KEYS, GROUP_FIELDS
+    if (group_by and group_by not in GROUP_KEYS) or top_by not in GROUP_FIELDS:
+        print("--group-by must be one of {} and --top-by one of {}".format(", ".join(GROUP_KEYS), ", ".join(GROUP_FIELDS)))
+        show_usage()
+        sys.exit(2)
+
+    from rabbitmq.RabbitMQ import RabbitMQ, RabbitMQUnavailable
     rbmq = RabbitMQ(api_endpoint, username, passwd)
 
-    import sys
+    from rabbitmq.sinks import make_sink
+    sink = make_sink(output_format, api_endpoint, "connection_group" if group_by else "connection", output, max_bytes, backup_count)
+
+    # on-disk history of the changed records
+    store = None
+    if store_dir:
+        from rabbitmq.store import HistoryWriter
+        store = HistoryWriter(store_dir, "connection")
+
+    # field-level diff keyed by connection name
+    engine = None
+    if diff_mode == "field":
+        from rabbitmq.diff import DiffEngine, CONNECTION_FIELDS, parse_deadband
+        abs_deadbands = {}
+        rel_deadbands = {}
+        for field, mode, value in map(parse_deadband, deadbands):
+            (abs_deadbands if mode == "abs" else rel_deadbands)[field] = value
+        engine = DiffEngine(CONNECTION_FIELDS, abs_deadbands, rel_deadbands)
+    elif diff_mode != "record":
+        show_usage()
+        sys.exit(2)
+
     import time
     from datetime import datetime
 
+    if group_by:
+        from rabbitmq.aggregate import AGGREGATE_COLUMNS, aggregate_connections, top_groups
+
+    # alert rules, evaluated on the changed connections only
+    alerts = None
+    if alerts_file:
+        from rabbitmq.alerts import AlertEngine
+        alerts = AlertEngine.from_file(alerts_file)
+
+    # per-phase timings of each poll
+    from rabbitmq.instrumentation import PhaseStats, PollCycle, SlowCycleProfiles, timed_map
+    # this script only logs warnings by default, but the stats lines and profiles are logged at info level
+    if stats_interval or profile_dir:
+        logging.getLogger("rabbitmq.instrumentation").setLevel(logging.INFO)
+    profiles = SlowCycleProfiles(profile_dir, profile_top) if profile_dir else None
+    cycle = PollCycle(PhaseStats(), interval, rbmq.stats, stats_interval, profiles, "connections")
+    stats = cycle.stats
+
     previous = set()
     while True:
         # timestamp of query
         now = datetime.now().astimezone().replace(microsecond=0).isoformat()
+        cycle.begin()
 
-        # query rabbitmq for latest connection state
-        connections_list = rbmq.get_connections(connection_name)
+        if group_by:
+            # output grows with the number of groups, not connections: sum the connections as they stream in,
+            # then output the top groups of this poll.
+            try:
+                with stats.phase("aggregate"):
+                    groups = aggregate_connections(rbmq.iter_connections(connection_name, columns=AGGREGATE_COLUMNS), group_by)
+            except RabbitMQUnavailable as e:
+                logger.warning("skipping poll: {}".format(e))
+                cycle.end()
+                time.sleep(interval)
+                continue
+            top_tuples = [("{}={}".format(group_by, t[0]),) + t[1:] for t in top_groups(groups, top, top_by)]
+            with stats.phase("write"):
+                sink.write_cycle(now, top_tuples)
+            cycle.end()
+            time.sleep(interval)
+            continue
+
+        try:
+            # query rabbitmq for latest connection state
+            # only fetch the fields used by connection_to_tuple(), and decode connections as they stream in.
+            connections_list = rbmq.iter_connections(connection_name, columns=RabbitMQ.CONNECTION_TUPLE_COLUMNS)
 
-        current = set()
-        for connection_item in connections_list:
             # (connection_name, connection_state, connection_channels, connection_send_rate, connection_recv_rate)
-            connection_tuple = RabbitMQ.connection_to_tuple(connection_item)
-            current.add(connection_tuple)
-        # end for
+            current = set(timed_map(RabbitMQ.connection_to_tuple, connections_list, stats, "convert", "fetch"))
+        except RabbitMQUnavailable as e:
+            # e.g. the cluster nodes are restarting. keep the last known state and try again at the next poll.
+            logger.warning("skipping poll: {}".format(e))
+            cycle.end()
+            time.sleep(interval)
+            continue
         #print("current: {}".format(current))
 
-        # new that is not in old
-        new = current.difference(previous)
-        logger.debug("new: {}".format(new))
-
-        # old that is not in new
-        old = previous.difference(current)
-        logger.debug("old: {}".format(old))
-
-        # output only new changes
-        for i in new:
-            # output tokens: timestamp, connection_name, connection_state, connection_send_rate, connection_recv_rate
-            # since we use the output in wrapper script to stream and convert to sdswatch,
-            # we need to ensure that it is it does not wait until default stdout buffer filled before flushing.
-            # so specifically flush after write.
-            # https://www.turnkeylinux.org/blog/unix-buffering
-            sys.stdout.write("{} {} {} {} {}\n".format(now, i[0], i[1], i[2], i[3]))
-            sys.stdout.flush()
-        # end for
+        with stats.phase("diff"):
+            # new that is not in old
+            new = current.difference(previous)
+            logger.debug("new: %s", new)
+
+            # old that is not in new
+            old = previous.difference(current)
+            logger.debug("old: %s", old)
+
+            # a changed connection is in both old and new, so only names missing from current were removed
+            removed = set()
+            if old and (store is not None or alerts is not None):
+                current_names = set(t[0] for t in current)
+                removed = set(t[0] for t in old if t[0] not in current_names)
+
+        if store is not None:
+            with stats.phase("store"):
+                store.append(time.time(), new, removed)
+
+        if alerts is not None:
+            with stats.phase("alerts"):
+                alerts.update("connection", time.time(), new, removed)
+
+        # output only new changes, as one batch per cycle
+        if engine is None:
+            with stats.phase("write"):
+                sink.write_cycle(now, new)
+        else:
+            with stats.phase("field_diff"):
+                events = engine.update(current)
+            with stats.phase("write"):
+                sink.write_events(now, events)
 
         previous = current
+        cycle.end()
 
         time.sleep(interval)
     # end while
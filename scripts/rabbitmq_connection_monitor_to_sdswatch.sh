@@ -43,13 +43,5 @@ if [ ! -f "${RABBITMQ_CONNECTION_PY}" ]; then
     exit 1
 fi
 
-# convert output streamed to sdswatch format
-${RABBITMQ_CONNECTION_PY} --endpoint="${RABBITMQ_API_ENDPOINT}" --username="${RABBITMQ_USERNAME}" --passwd="${RABBITMQ_PASSWD}" --interval="${INTERVAL}" 2> ${BASE_NAME}.stderr | while IFS= read -r LINE; do
-    # timestamp, connection_name, connection_state, connection_send_rate, connection_recv_rate
-    IFS=" " read TIMESTAMP CLIENT ARROW SERVER STATE CONN_SEND_RATE CONN_RECV_RATE <<< ${LINE}
-    NAME="${CLIENT}->${SERVER}"
-    echo "${TIMESTAMP} , ${RABBITMQ_API_ENDPOINT} , rabbitmq.connection , ${NAME} , state, ${STATE} "
-    echo "${TIMESTAMP} , ${RABBITMQ_API_ENDPOINT} , rabbitmq.connection , ${NAME} , send_rate_to_client, ${CONN_SEND_RATE} "
-    echo "${TIMESTAMP} , ${RABBITMQ_API_ENDPOINT} , rabbitmq.connection , ${NAME} , recv_rate_from_client, ${CONN_RECV_RATE} "
-done
-
+# output directly in sdswatch format, one buffered batch per poll cycle
+${RABBITMQ_CONNECTION_PY} --endpoint="${RABBITMQ_API_ENDPOINT}" --username="${RABBITMQ_USERNAME}" --passwd="${RABBITMQ_PASSWD}" --interval="${INTERVAL}" --format=sdswatch 2> ${BASE_NAME}.stderr
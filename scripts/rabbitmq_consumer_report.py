@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script reports which worker hosts hold unacked messages on which queues, by joining the
+# connections, channels, consumers and queues of the RabbitMQ REST API (see rabbitmq/correlation.py).
+#
+# input arguments:
+#   --endpoint: the RabbitMQ API endpoint. e.g. "https://mozart.mycluster.hysds.io:15673" see http://e-jobs.aria.hysds.io:15672/api/
+#               for a cluster, a comma-separated list of the endpoints of each node. polls fail over between them.
+#   --username: username for rabbitmq
+#   --passwd: password for rabbitmq
+#   --report: (optional) one of:
+#               unacked-by-host: hosts holding unacked messages, most first. (default)
+#               hoarders: channels holding more than --max-prefetch unacked messages, or any with an unlimited prefetch.
+#               holders: channels consuming from --queue, most unacked first.
+#               idle: channels consuming from queues with messages ready, but holding none. e.g. stuck workers.
+#   --queue: (optional) name of the queue, for the holders and idle reports.
+#   --max-prefetch: (optional) prefetch of a well-behaved worker, for the hoarders report. (default=1)
+#
+# outputs to stdout:
+#   unacked-by-host: <peer_host> <unacked> <channels> <queues>
+#   hoarders, holders, idle: <peer_host> <unacked> <prefetch> <queues> <channel>
+#
+# example usage:
+#   rabbitmq_consumer_report.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --report=unacked-by-host
+#   100.64.1.17 12 3 urgent-response-job_worker-large
+#
+#   rabbitmq_consumer_report.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --report=hoarders
+#   100.64.1.17 10 0 urgent-response-job_worker-large 100.64.1.17:40012 -> 127.0.0.1:5672 (1)
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_consumer_report.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest [--report=unacked-by-host|hoarders|holders|idle] [--queue=name] [--max-prefetch=1] \n' )
+
+
+import sys, getopt
+
+REPORTS = ("unacked-by-host", "hoarders", "holders", "idle")
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    # rabbitmq credentials
+    username = ''
+    passwd = ''
+
+    api_endpoint = ''
+    report = 'unacked-by-host'
+    queue_name = None
+    max_prefetch = 1
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"he:u:p:q:",["endpoint=","username=","passwd=","report=","queue=","max-prefetch="])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt in ("-e", "--endpoint"):
+            api_endpoint = arg
+        elif opt in ("-u", "--username"):
+            username = arg
+        elif opt in ("-p", "--passwd"):
+            passwd = arg
+        elif opt == "--report":
+            report = arg
+        elif opt in ("-q", "--queue"):
+            queue_name = arg
+        elif opt == "--max-prefetch":
+            max_prefetch = int(arg)
+
+    # check if non-null string, and a queue for the holders report
+    if not api_endpoint.strip() or report not in REPORTS or (report == "holders" and not queue_name):
+        show_usage()
+        sys.exit(2)
+
+    from rabbitmq.RabbitMQ import RabbitMQ
+    from rabbitmq.correlation import CorrelationIndex
+
+    rbmq = RabbitMQ(api_endpoint, username, passwd)
+    index = CorrelationIndex.from_client(rbmq, queues=(report == "idle"))
+
+    lines = []
+    if report == "unacked-by-host":
+        for host in index.unacked_by_host():
+            lines.append("{} {} {} {}\n".format(host.peer_host, host.unacked, host.channels, ",".join(host.queues)))
+        # end for
+    else:
+        if report == "hoarders":
+            holders = index.prefetch_hoarders(max_prefetch)
+        elif report == "holders":
+            holders = index.holders(queue_name)
+        else:
+            holders = index.idle_consumers(queue_name)
+        for holder in holders:
+            lines.append("{} {} {} {} {}\n".format(holder.peer_host, holder.unacked, holder.prefetch, ",".join(holder.queues), holder.channel))
+        # end for
+
+    sys.stdout.write("".join(lines))
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script serves RabbitMQ queue and connection state as Prometheus metrics.
+# Scrapes are served from a snapshot cached for --ttl seconds, and concurrent scrapes of a stale
+# snapshot are coalesced into one query of the RabbitMQ REST API, so several Prometheus replicas
+# can scrape at high frequency without multiplying the load on the management API.
+#
+# input arguments:
+#   --endpoint: the RabbitMQ API endpoint. e.g. "https://mozart.mycluster.hysds.io:15673" see http://e-jobs.aria.hysds.io:15672/api/
+#               for a cluster, a comma-separated list of the endpoints of each node. polls fail over between them.
+#   --username: username for rabbitmq
+#   --passwd: password for rabbitmq
+#   --bind: (optional) address to listen on. (default=0.0.0.0)
+#   --port: (optional) port to listen on. (default=9419)
+#   --ttl: (optional) how long a snapshot is served before querying rabbitmq again, in unit seconds. (default=5)
+#
+# example usage:
+#   rabbitmq_exporter.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --port=9419 --ttl=5
+#   curl http://localhost:9419/metrics
+#   rabbitmq_queue_messages_ready{queue="user_rules_dataset"} 0
+#   rabbitmq_queue_state{queue="user_rules_dataset",state="running"} 1
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_exporter.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest [--bind=0.0.0.0] [--port=9419] [--ttl=5] \n' )
+
+
+import sys, getopt
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    # rabbitmq credentials
+    username = ''
+    passwd = ''
+
+    api_endpoint = ''
+    bind = '0.0.0.0'
+    port = 9419
+    ttl = 5.0
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"he:u:p:",["endpoint=","username=","passwd=","bind=","port=","ttl="])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt in ("-e", "--endpoint"):
+            api_endpoint = arg
+        elif opt in ("-u", "--username"):
+            username = arg
+        elif opt in ("-p", "--passwd"):
+            passwd = arg
+        elif opt == "--bind":
+            bind = arg
+        elif opt == "--port":
+            port = int(arg)
+        elif opt == "--ttl":
+            ttl = float(arg)
+
+    # check if non-null string
+    if not api_endpoint.strip():
+        show_usage()
+        sys.exit(2)
+
+    from rabbitmq.RabbitMQ import RabbitMQ
+    from rabbitmq.exporter import MetricsExporter
+
+    rbmq = RabbitMQ(api_endpoint, username, passwd)
+    MetricsExporter(rbmq, ttl).serve(bind, port)
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
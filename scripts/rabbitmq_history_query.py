@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script queries the on-disk history written by the monitors' --store option.
+# Column files are memory-mapped and time ranges are found by binary search,
+# so queries over weeks of history only read the rows in the requested range.
+#
+# input arguments:
+#   --store: directory of the history store, as given to the monitor's --store.
+#   --resource: (optional) "queue" or "connection". (default=queue)
+#   --field: (optional) field to query. for queues: state, messages_ready, messages_unacknowledged.
+#            for connections: state, send_rate, recv_rate. (default=messages_ready)
+#   --name: (optional) name of the queue or connection. if specified, outputs its samples in the time range,
+#           starting with the value it held at --start.
+#   --top: (optional) if specified, outputs the N names with the highest peak of the field in the time range.
+#   --start: (optional) start of the time range, inclusive. unix timestamp, ISO 8601, "today" or "yesterday".
+#   --end: (optional) end of the time range, exclusive. unix timestamp, ISO 8601, "today" or "yesterday".
+#
+# outputs to stdout:
+#   with --name: timestamp, value
+#   with --top:  name, peak value
+#
+# example usage:
+#   rabbitmq_history_query.py --store=/data/rabbitmq-history --name=jobs_processed --field=messages_ready --start=2020-05-22T03:00:00+00:00 --end=2020-05-22T04:00:00+00:00
+#   2020-05-22T03:18:03+00:00 0
+#   2020-05-22T03:19:04+00:00 1
+#
+#   rabbitmq_history_query.py --store=/data/rabbitmq-history --top=10 --field=messages_ready --start=yesterday --end=today
+#   urgent-response-job_worker-large 13090
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_history_query.py --store=/data/rabbitmq-history [--resource=queue] [--field=messages_ready] (--name=jobs_processed | --top=10) [--start=yesterday] [--end=today] \n' )
+
+
+import sys, getopt
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    store_dir = ''
+    resource = 'queue'
+    field = 'messages_ready'
+    name = None
+    top = None
+    start = None
+    end = None
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"hs:r:f:n:",["store=","resource=","field=","name=","top=","start=","end="])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+
+    from rabbitmq.store import HistoryReader, parse_time
+
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt in ("-s", "--store"):
+            store_dir = arg
+        elif opt in ("-r", "--resource"):
+            resource = arg
+        elif opt in ("-f", "--field"):
+            field = arg
+        elif opt in ("-n", "--name"):
+            name = arg
+        elif opt == "--top":
+            top = int(arg)
+        elif opt == "--start":
+            start = parse_time(arg)
+        elif opt == "--end":
+            end = parse_time(arg)
+
+    # check if non-null string, and exactly one kind of query
+    if not store_dir.strip() or (name is None) == (top is None):
+        show_usage()
+        sys.exit(2)
+
+    from datetime import datetime
+
+    reader = HistoryReader(store_dir, resource)
+
+    lines = []
+    if name is not None:
+        for timestamp, value in reader.series(name, field, start, end):
+            lines.append("{} {}\n".format(datetime.fromtimestamp(timestamp).astimezone().replace(microsecond=0).isoformat(), value))
+        # end for
+    else:
+        for top_name, value in reader.top(field, start, end, top):
+            lines.append("{} {}\n".format(top_name, value))
+        # end for
+
+    sys.stdout.write("".join(lines))
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
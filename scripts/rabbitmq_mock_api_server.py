@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script serves a mock RabbitMQ management API, for developing and benchmarking the monitors
+# without a broker. Payloads are shaped like a real broker's, at the requested scale and latency,
+# and a fraction of the queues and connections change at every tick.
+#
+# input arguments:
+#   --queues: (optional) number of queues. (default=1000)
+#   --connections: (optional) number of connections. (default=200)
+#   --latency: (optional) delay added to every response, in unit seconds. (default=0)
+#   --messages: (optional) number of dead-lettered job messages in the "jobs_failed" queue. (default=0)
+#   --change-fraction: (optional) fraction of queues and connections changed at every tick. (default=0.05)
+#   --tick: (optional) seconds between ticks. (default=1)
+#   --bind: (optional) address to listen on. (default=127.0.0.1)
+#   --port: (optional) port to listen on. (default=15672)
+#
+# example usage:
+#   rabbitmq_mock_api_server.py --queues=50000 --connections=5000 --latency=0.05 --port=15672
+#   rabbitmq_queue_monitor.py --endpoint="http://127.0.0.1:15672" --username=guest --passwd=guest --interval=1
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_mock_api_server.py [--queues=1000] [--connections=200] [--latency=0] [--messages=0] [--change-fraction=0.05] [--tick=1] [--bind=127.0.0.1] [--port=15672] \n' )
+
+
+import sys, getopt
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    queues = 1000
+    connections = 200
+    latency = 0.0
+    messages = 0
+    change_fraction = 0.05
+    tick = 1.0
+    bind = '127.0.0.1'
+    port = 15672
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"h",["queues=","connections=","latency=","messages=","change-fraction=","tick=","bind=","port="])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt == "--queues":
+            queues = int(arg)
+        elif opt == "--connections":
+            connections = int(arg)
+        elif opt == "--latency":
+            latency = float(arg)
+        elif opt == "--messages":
+            messages = int(arg)
+        elif opt == "--change-fraction":
+            change_fraction = float(arg)
+        elif opt == "--tick":
+            tick = float(arg)
+        elif opt == "--bind":
+            bind = arg
+        elif opt == "--port":
+            port = int(arg)
+
+    from rabbitmq.mock_api import MockManagementAPI
+
+    server = MockManagementAPI(queues, connections, latency, change_fraction, tick, bind, port, messages=messages)
+    logger.warning("serving {} queues and {} connections on {}".format(queues, connections, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
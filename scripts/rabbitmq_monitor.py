@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script calls RabbitMQ REST API to monitor queues and connections from one process,
+# sharing one RabbitMQ client and polling each resource type on its own interval.
+# Ticks are on a fixed timeline, so slow requests do not make the polling period drift,
+# and resources that fall due at the same time are fetched together in one batch.
+#
+# input arguments:
+#   --endpoint: the RabbitMQ API endpoint. e.g. "https://mozart.mycluster.hysds.io:15673" see http://e-jobs.aria.hysds.io:15672/api/
+#               for a cluster, a comma-separated list of the endpoints of each node. polls fail over between them.
+#   --username: username for rabbitmq
+#   --passwd: password for rabbitmq
+#   --queue-interval: (optional) how often to check queues in unit seconds. 0 disables queue monitoring. (default=10)
+#   --connection-interval: (optional) how often to check connections in unit seconds. 0 disables connection monitoring. (default=10)
+#   --format: (optional) output format, "plain" or "sdswatch". (default=plain)
+#   --output: (optional) file to write to instead of stdout.
+#   --max-bytes: (optional) rotate the output file when it reaches this size in bytes. (default=0, no rotation)
+#   --backup-count: (optional) number of rotated output files to keep. (default=0)
+#   --alerts: (optional) json rule file of alerts evaluated on the changed queues and connections of each poll,
+#             see rabbitmq/alerts.py. notifications go to the rule file's sinks, e.g. the log or a webhook.
+#   --stats-interval: (optional) log a line of per-phase timings (fetch, convert, diff, write, ...), record counts,
+#                     payload bytes and missed deadlines of each resource type every this many seconds,
+#                     see rabbitmq/instrumentation.py. (default=0, disabled)
+#   --profile-dir: (optional) sample the stack of each poll, and keep the profiles of the slowest polls of each
+#                  resource type in this directory as folded stacks, e.g. for flamegraph.pl.
+#   --profile-top: (optional) number of slowest polls to keep profiles of, per resource type. (default=5)
+#
+# outputs to stdout:
+#   same as rabbitmq_queue_monitor.py and rabbitmq_connection_monitor.py
+#
+# example usage:
+#   rabbitmq_monitor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --queue-interval=10 --connection-interval=60 --format=sdswatch
+#   2020-05-22T03:19:04+00:00 , https://100.100.100.100:15673 , rabbitmq.queue , jobs_processed , state, running
+#   2020-05-22T03:19:04+00:00 , https://100.100.100.100:15673 , rabbitmq.queue , jobs_processed , ready, 0
+#   2020-05-22T03:19:04+00:00 , https://100.100.100.100:15673 , rabbitmq.queue , jobs_processed , unacked, 1
+#   2020-05-22T03:19:04+00:00 , https://100.100.100.100:15673 , rabbitmq.connection , 127.0.0.1:41446->127.0.0.1:5672 , state, running
+#   ...
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_monitor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest [--queue-interval=10] [--connection-interval=10] [--format=sdswatch] \n' )
+
+
+import sys, getopt
+import time
+import threading
+from datetime import datetime
+from rabbitmq.instrumentation import PhaseStats, PollCycle, SlowCycleProfiles, timed_map
+
+# jobs of different resource types may run at the same time on the scheduler's worker threads
+alerts_lock = threading.Lock()
+
+
+def fetch_queues(rbmq, stats):
+    """
+    @param stats: rabbitmq.instrumentation.PhaseStats to record the fetch and convert times in.
+    @return: set of queue tuples, ignoring the low-level celery queues
+    """
+    from rabbitmq.RabbitMQ import RabbitMQ
+    queues = rbmq.iter_queues_paged(columns=RabbitMQ.QUEUE_TUPLE_COLUMNS, name="^(?!celery)", use_regex=True)
+    return set(t for t in timed_map(RabbitMQ.queue_to_tuple, queues, stats, "convert", "fetch") if not t[0].startswith("celery"))
+
+
+def fetch_connections(rbmq, stats):
+    """
+    @param stats: rabbitmq.instrumentation.PhaseStats to record the fetch and convert times in.
+    @return: set of connection tuples
+    """
+    from rabbitmq.RabbitMQ import RabbitMQ
+    connections = rbmq.iter_connections(columns=RabbitMQ.CONNECTION_TUPLE_COLUMNS)
+    return set(timed_map(RabbitMQ.connection_to_tuple, connections, stats, "convert", "fetch"))
+
+
+# resource type -> (sink resource name, fetch function). add future resource types here.
+RESOURCES = {
+    "queues": ("queue", fetch_queues),
+    "connections": ("connection", fetch_connections),
+}
+
+
+def make_poll_job(rbmq, resource, sink, alerts=None, cycle=None):
+    """
+    @param alerts: (optional) rabbitmq.alerts.AlertEngine to evaluate on the changes.
+    @param cycle: (optional) rabbitmq.instrumentation.PollCycle timing the runs of the job.
+    @return: a job that fetches the resource and writes the changes since its previous run.
+    """
+    from rabbitmq.RabbitMQ import RabbitMQUnavailable
+    fetch = RESOURCES[resource][1]
+    state = {"previous": set()}
+    if cycle is None:
+        cycle = PollCycle(PhaseStats(), 0, label=resource)
+    stats = cycle.stats
+
+    def job():
+        # timestamp of query
+        now = datetime.now().astimezone().replace(microsecond=0).isoformat()
+        cycle.begin()
+
+        try:
+            current = fetch(rbmq, stats)
+        except RabbitMQUnavailable as e:
+            # e.g. the cluster nodes are restarting. keep the last known state and try again at the next tick.
+            logger.warning("skipping {} poll: {}".format(resource, e))
+            cycle.end()
+            return
+
+        # output only new changes
+        with stats.phase("diff"):
+            new = current.difference(state["previous"])
+        logger.debug("%s new: %s", resource, new)
+        with stats.phase("write"):
+            sink.write_cycle(now, new)
+
+        if alerts is not None:
+            with stats.phase("alerts"):
+                current_names = set(t[0] for t in current)
+                removed = set(t[0] for t in state["previous"] if t[0] not in current_names)
+                with alerts_lock:
+                    alerts.update(RESOURCES[resource][0], time.time(), new, removed)
+
+        state["previous"] = current
+        cycle.end()
+
+    return job
+
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    # rabbitmq credentials
+    username = ''
+    passwd = ''
+
+    api_endpoint = ''
+    intervals = {"queues": 10, "connections": 10}
+    output_format = 'plain'
+    output = None
+    max_bytes = 0
+    backup_count = 0
+    alerts_file = None
+    stats_interval = 0
+    profile_dir = None
+    profile_top = 5
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"he:u:p:f:o:",["endpoint=","username=","passwd=","queue-interval=","connection-interval=","format=","output=","max-bytes=","backup-count=","alerts=","stats-interval=","profile-dir=","profile-top="])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt in ("-e", "--endpoint"):
+            api_endpoint = arg
+        elif opt in ("-u", "--username"):
+            username = arg
+        elif opt in ("-p", "--passwd"):
+            passwd = arg
+        elif opt == "--queue-interval":
+            intervals["queues"] = float(arg)
+        elif opt == "--connection-interval":
+            intervals["connections"] = float(arg)
+        elif opt in ("-f", "--format"):
+            output_format = arg
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt == "--max-bytes":
+            max_bytes = int(arg)
+        elif opt == "--backup-count":
+            backup_count = int(arg)
+        elif opt == "--alerts":
+            alerts_file = arg
+        elif opt == "--stats-interval":
+            stats_interval = float(arg)
+        elif opt == "--profile-dir":
+            profile_dir = arg
+        elif opt == "--profile-top":
+            profile_top = int(arg)
+
+    # check if non-null string
+    if not api_endpoint.strip():
+        show_usage()
+        sys.exit(2)
+
+    from rabbitmq.RabbitMQ import RabbitMQ
+    from rabbitmq.sinks import OutputWriter, make_sink
+    from rabbitmq.scheduler import PollScheduler
+
+    # one client, so all resource types share the same pooled keep-alive connections
+    rbmq = RabbitMQ(api_endpoint, username, passwd)
+
+    # one writer, so all resource types go to the same output
+    writer = OutputWriter(output, max_bytes, backup_count)
+
+    # one alert engine, so that rate limiting applies over all resource types
+    alerts = None
+    if alerts_file:
+        from rabbitmq.alerts import AlertEngine
+        alerts = AlertEngine.from_file(alerts_file)
+
+    # this script only logs warnings by default, but the stats lines and profiles are logged at info level
+    if stats_interval or profile_dir:
+        logging.getLogger("rabbitmq.instrumentation").setLevel(logging.INFO)
+
+    scheduler = PollScheduler()
+    for resource, interval in intervals.items():
+        if interval <= 0:
+            continue
+        sink = make_sink(output_format, api_endpoint, RESOURCES[resource][0], writer=writer)
+        profiles = SlowCycleProfiles(profile_dir, profile_top) if profile_dir else None
+        # the client stats are shared by all resource types
+        cycle = PollCycle(PhaseStats(), interval, rbmq.stats, stats_interval, profiles, resource)
+        scheduler.add(resource, interval, make_poll_job(rbmq, resource, sink, alerts, cycle))
+    # end for
+
+    scheduler.run_forever()
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script inspects and moves messages in bulk, e.g. to requeue failed HySDS jobs from a dead-letter queue.
+# Messages are removed from the source queue a batch at a time. Matching messages are published to the target
+# and the others are put back at the tail of the source queue, with several publish requests in flight.
+#
+# input arguments:
+#   --endpoint: the RabbitMQ API endpoint. e.g. "https://mozart.mycluster.hysds.io:15673" see http://e-jobs.aria.hysds.io:15672/api/
+#               for a cluster, a comma-separated list of the endpoints of each node. polls fail over between them.
+#   --username: username for rabbitmq
+#   --passwd: password for rabbitmq
+#   --queue: name of the source queue.
+#   --vhost: (optional) virtual host of the queues and exchange. (default=/)
+#   --peek: (optional) if specified, outputs the first N messages as json lines, without removing them.
+#   --to-queue: (optional) target queue. if neither --to-queue nor --exchange is specified, each message goes back to the queue
+#               it was dead-lettered from (x-death header), or else to its original exchange and routing key.
+#   --exchange: (optional) target exchange, with --routing-key.
+#   --routing-key: (optional) routing key for --exchange.
+#   --contains: (optional) only move messages whose payload contains this text.
+#   --regex: (optional) only move messages whose payload matches this regular expression.
+#   --field: (optional) only move messages with a json payload field equal to a value, as path=value. e.g. job.type=job-hello_world:develop
+#   --header: (optional) only move messages with a header equal to a value, as name=value. e.g. x-first-death-reason=rejected
+#   --limit: (optional) max number of messages to go through. (default=all messages in the queue)
+#   --batch-size: (optional) number of messages removed from the queue per request. (default=500)
+#   --concurrency: (optional) number of concurrent publish requests. (default=8)
+#   --dry-run: (optional) only peek at the first --limit (or --batch-size) messages and count the ones that would be moved.
+#   --lost: (optional) file to save messages that could neither be moved nor put back to, as json lines.
+#           (default=<queue>-lost-<time>.jsonl in the current directory, only created if a message was lost)
+#
+# outputs:
+#   progress after each batch to stderr, and the final counts as json to stdout.
+#
+# example usage:
+#   rabbitmq_move_messages.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --queue=jobs_failed --field=job.type=job-hello_world:develop --dry-run
+#   {"total": 500, "fetched": 500, "matched": 212, "moved": 0, "requeued": 0, "failed": 0, "dry_run": true, "elapsed": 0.41, "rate": 1219.5}
+#
+#   rabbitmq_move_messages.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --queue=jobs_failed --field=job.type=job-hello_world:develop
+#   moved 21044/100000 fetched 100000/100000 requeued 78956 failed 0 (1650.2 msg/s)
+#   {"total": 100000, "fetched": 100000, "matched": 21044, "moved": 21044, "requeued": 78956, "failed": 0, "dry_run": false, "elapsed": 60.6, "rate": 1650.2}
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_move_messages.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --queue=jobs_failed [--peek=10] [--to-queue=name | --exchange=name --routing-key=key] [--contains=text] [--regex=pattern] [--field=path=value] [--header=name=value] [--limit=N] [--batch-size=500] [--concurrency=8] [--dry-run] [--lost=lost.jsonl] \n' )
+
+
+import sys, getopt
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    # rabbitmq credentials
+    username = ''
+    passwd = ''
+
+    api_endpoint = ''
+    queue_name = ''
+    vhost = '/'
+    peek = None
+    exchange = ''
+    routing_key = None
+    limit = None
+    batch_size = 500
+    concurrency = 8
+    dry_run = False
+    lost_file = None
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"he:u:p:q:",["endpoint=","username=","passwd=","queue=","vhost=","peek=","to-queue=","exchange=","routing-key=",
+                                                      "contains=","regex=","field=","header=","limit=","batch-size=","concurrency=","dry-run","lost="])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+
+    from rabbitmq.messages import payload_contains, payload_matches, json_field_equals, header_equals, all_of
+
+    predicates = []
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt in ("-e", "--endpoint"):
+            api_endpoint = arg
+        elif opt in ("-u", "--username"):
+            username = arg
+        elif opt in ("-p", "--passwd"):
+            passwd = arg
+        elif opt in ("-q", "--queue"):
+            queue_name = arg
+        elif opt == "--vhost":
+            vhost = arg
+        elif opt == "--peek":
+            peek = int(arg)
+        elif opt == "--to-queue":
+            exchange = ''
+            routing_key = arg
+        elif opt == "--exchange":
+            exchange = arg
+        elif opt == "--routing-key":
+            routing_key = arg
+        elif opt == "--contains":
+            predicates.append(payload_contains(arg))
+        elif opt == "--regex":
+            predicates.append(payload_matches(arg))
+        elif opt == "--field":
+            path, sep, value = arg.partition("=")
+            predicates.append(json_field_equals(path, value))
+        elif opt == "--header":
+            name, sep, value = arg.partition("=")
+            predicates.append(header_equals(name, value))
+        elif opt == "--limit":
+            limit = int(arg)
+        elif opt == "--batch-size":
+            batch_size = int(arg)
+        elif opt == "--concurrency":
+            concurrency = int(arg)
+        elif opt == "--dry-run":
+            dry_run = True
+        elif opt == "--lost":
+            lost_file = arg
+
+    # check if non-null string, and a routing key for a target exchange
+    if not api_endpoint.strip() or not queue_name.strip() or (exchange and routing_key is None):
+        show_usage()
+        sys.exit(2)
+
+    import re
+    import json
+    import time
+
+    from rabbitmq.RabbitMQ import RabbitMQ
+
+    predicate = all_of(*predicates) if predicates else None
+
+    # one pooled connection per concurrent publish
+    rbmq = RabbitMQ(api_endpoint, username, passwd, pool_maxsize=max(concurrency, 1))
+
+    if peek is not None:
+        lines = [json.dumps(m) + "\n" for m in rbmq.peek_messages(queue_name, peek, predicate, vhost)]
+        sys.stdout.write("".join(lines))
+        return
+
+    def progress(stats):
+        sys.stderr.write("moved {}/{} fetched {}/{} requeued {} failed {} ({:.1f} msg/s)\n".format(
+            stats.moved, stats.matched, stats.fetched, stats.total, stats.requeued, stats.failed, stats.rate))
+        sys.stderr.flush()
+
+    # the lost messages are removed from the queue, so they are always saved, even if the move is interrupted
+    lost = []
+    try:
+        stats = rbmq.move_messages(queue_name, exchange, routing_key, predicate, limit, batch_size, concurrency, dry_run, progress, vhost, lost)
+    finally:
+        if lost:
+            if not lost_file:
+                lost_file = "{}-lost-{}.jsonl".format(re.sub(r"[^\w.-]", "_", queue_name), time.strftime("%Y%m%dT%H%M%S"))
+            with open(lost_file, "a") as f:
+                f.write("".join(json.dumps(m) + "\n" for m in lost))
+            logger.error("{} message(s) could neither be moved nor put back, saved to {}".format(len(lost), lost_file))
+
+    sys.stdout.write(json.dumps(stats.to_dict()) + "\n")
+    if stats.failed:
+        sys.exit(1)
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script calls RabbitMQ REST API to monitor the resource headroom of the cluster nodes
+# and the broker-wide message rates, to see memory, file descriptor and disk pressure before the
+# broker blocks publishers, e.g. to throttle job submission.
+#
+# input arguments:
+#   --endpoint: the RabbitMQ API endpoint. e.g. "https://mozart.mycluster.hysds.io:15673" see http://e-jobs.aria.hysds.io:15672/api/
+#               for a cluster, a comma-separated list of the endpoints of each node. polls fail over between them.
+#   --username: username for rabbitmq
+#   --passwd: password for rabbitmq
+#   --node: (optional) name of node, e.g. "rabbit@mozart". if not specified, then all nodes of the cluster will be shown.
+#   --interval: (optional) frequency of how often to check rabbitmq in unit seconds. (default=10)
+#   --format: (optional) output format, "plain" or "sdswatch". (default=plain)
+#   --output: (optional) file to write to instead of stdout.
+#   --max-bytes: (optional) rotate the output file when it reaches this size in bytes. (default=0, no rotation)
+#   --backup-count: (optional) number of rotated output files to keep. (default=0)
+#   --min-headroom: (optional) log a warning when a node's headroom of any resource is below this percent,
+#                   or it has an alarm or is down. (default=20)
+#
+# outputs to stdout, only when changed since the last poll:
+#   timestamp, node_name, state, mem_headroom, fd_headroom, sockets_headroom, proc_headroom, disk_headroom, alarms
+#   timestamp, cluster_name, publish_rate, deliver_rate, ack_rate, messages_ready, messages_unacknowledged, connections, consumers, queues
+# note that
+#   * headroom is the percent of a limit not used yet. see rabbitmq/nodes.py.
+#   * rates are in messages per second, as sampled by the broker.
+#
+# example usage:
+#   rabbitmq_node_monitor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest [--node=rabbit@mozart --interval=10]
+#   2020-05-21T22:37:29+00:00 rabbit@mozart running 90.6 99.5 99.7 99.8 99.9 none
+#   2020-05-21T22:37:29+00:00 rabbit@mozart 12.0 11.0 11.0 13090 2 52 40 30
+#
+# ---------------------------------------------------------
+
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_node_monitor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest [--node=rabbit@mozart] [--min-headroom=20] \n' )
+
+
+import sys, getopt
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    # rabbitmq credentials
+    username = ''
+    passwd = ''
+
+    api_endpoint = ''
+    node_name = ''
+    interval = 10
+    output_format = 'plain'
+    output = None
+    max_bytes = 0
+    backup_count = 0
+    min_headroom_percent = 20.0
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"he:u:p:n:i:f:o:",["endpoint=","username=","passwd=","node=","interval=","format=","output=","max-bytes=","backup-count=","min-headroom="])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt in ("-e", "--endpoint"):
+            api_endpoint = arg
+        elif opt in ("-u", "--username"):
+            username = arg
+        elif opt in ("-p", "--passwd"):
+            passwd = arg
+        elif opt in ("-n", "--node"):
+            node_name = arg
+        elif opt in ("-i", "--interval"):
+            interval = int(arg)
+        elif opt in ("-f", "--format"):
+            output_format = arg
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt == "--max-bytes":
+            max_bytes = int(arg)
+        elif opt == "--backup-count":
+            backup_count = int(arg)
+        elif opt == "--min-headroom":
+            min_headroom_percent = float(arg)
+
+    # check if non-null string
+    if not api_endpoint.strip():
+        show_usage()
+        sys.exit(2)
+
+    from rabbitmq.RabbitMQ import RabbitMQ, RabbitMQUnavailable
+    rbmq = RabbitMQ(api_endpoint, username, passwd)
+
+    # one writer, so nodes and the overview go to the same output
+    from rabbitmq.sinks import OutputWriter, make_sink
+    writer = OutputWriter(output, max_bytes, backup_count)
+    node_sink = make_sink(output_format, api_endpoint, "node", writer=writer)
+    overview_sink = make_sink(output_format, api_endpoint, "overview", writer=writer)
+
+    from rabbitmq.nodes import node_headroom, min_headroom
+
+    import time
+    from datetime import datetime
+
+    previous = set()
+    while True:
+        # timestamp of query
+        now = datetime.now().astimezone().replace(microsecond=0).isoformat()
+
+        try:
+            # query rabbitmq for the latest node usage and broker-wide rates.
+            # only fetch the fields used by node_to_tuple() and overview_to_tuple().
+            nodes_list = rbmq.get_nodes(node_name, columns=RabbitMQ.NODE_TUPLE_COLUMNS)
+            overview = rbmq.get_overview(columns=RabbitMQ.OVERVIEW_TUPLE_COLUMNS)
+        except RabbitMQUnavailable as e:
+            # e.g. the cluster nodes are restarting. keep the last known state and try again at the next poll.
+            logger.warning("skipping poll: {}".format(e))
+            time.sleep(interval)
+            continue
+
+        current = set()
+        for node_item in nodes_list:
+            # (node_name, state, mem, fd, sockets, proc, disk, alarms)
+            headroom_tuple = node_headroom(RabbitMQ.node_to_tuple(node_item))
+            current.add(tuple(headroom_tuple))
+
+            lowest, resource = min_headroom(headroom_tuple)
+            if headroom_tuple.state != "running":
+                logger.warning("node {} is down".format(headroom_tuple.name))
+            elif headroom_tuple.alarms != "none":
+                logger.warning("node {} has {} alarm(s)".format(headroom_tuple.name, headroom_tuple.alarms))
+            elif lowest is not None and lowest < min_headroom_percent:
+                logger.warning("node {} has only {}% {} headroom".format(headroom_tuple.name, lowest, resource))
+        # end for
+        overview_tuple = RabbitMQ.overview_to_tuple(overview)
+
+        # new that is not in old
+        new = current.difference(previous)
+        logger.debug("new: %s", new)
+
+        # output only new changes, as one batch per cycle
+        node_sink.write_cycle(now, sorted(new))
+        if overview_tuple not in previous:
+            overview_sink.write_cycle(now, [overview_tuple])
+        current.add(overview_tuple)
+
+        previous = current
+
+        time.sleep(interval)
+    # end while
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -6,10 +6,41 @@
 # 
 # input arguments:
 #   --endpoint: the RabbitMQ API endpoint. e.g. "https://mozart.mycluster.hysds.io:15673" see http://e-jobs.aria.hysds.io:15672/api/
+#               for a cluster, a comma-separated list of the endpoints of each node. polls fail over between them.
 #   --username: username for rabbitmq
 #   --passwd: password for rabbitmq
 #   --queue: (optional) name of queue. if specified, it will only return info for this queue name. if not specified, then all queues will be shown.
 #   --interval: (optional) frequency of how often to check rabbitmq in unit seconds. (default=10)
+#   --format: (optional) output format, "plain" or "sdswatch". (default=plain)
+#   --output: (optional) file to write to instead of stdout.
+#   --max-bytes: (optional) rotate the output file when it reaches this size in bytes. (default=0, no rotation)
+#   --backup-count: (optional) number of rotated output files to keep. (default=0)
+#   --store: (optional) directory of a compact on-disk history. the changed records of each poll are appended to it,
+#            and can be queried with rabbitmq_history_query.py.
+#   --diff: (optional) "record" outputs whole records that changed, "field" outputs only the fields that changed
+#           and the queues that disappeared. (default=record)
+#   --deadband: (optional, repeatable, with --diff=field) ignore changes of a numeric field smaller than an absolute
+#               or relative amount, as field:abs:value or field:rel:value. fields are messages_ready, messages_unacknowledged.
+#   --adaptive: (optional) poll faster while queues are changing and slower while they are quiet, ignoring --interval.
+#   --min-interval: (optional) shortest adaptive interval in unit seconds. (default=5)
+#   --max-interval: (optional) longest adaptive interval in unit seconds. (default=120)
+#   --full-interval: (optional) in adaptive or probe mode, how often to refresh the full queue listing in unit seconds.
+#                    in between, only recently changed ("hot") queues are polled by name. (default=300)
+#   --hot-ttl: (optional) number of polls a queue stays hot after its last change. (default=5)
+#   --max-hot: (optional) max number of hot queues polled by name. (default=50)
+#   --lightweight: (optional) ask the broker to skip per-queue stats (disable_stats/enable_queue_totals), which is much cheaper for large brokers.
+#   --history: (optional) number of recent samples to keep per queue. if set, each output record also has the
+#              ingress_rate, egress_rate, ready_avg and time_to_drain derived from those samples. (default=0, disabled)
+#              not with --diff=field, whose events only carry the changed fields.
+#   --probe: (optional) check the broker-wide queue totals from /api/overview first, and skip the queue listing
+#            if they have not changed since the last poll. the full listing is still refreshed every --full-interval.
+#   --alerts: (optional) json rule file of alerts evaluated on the changed queues of each poll, see rabbitmq/alerts.py.
+#             notifications go to the rule file's sinks, e.g. the log or a webhook.
+#   --stats-interval: (optional) log a line of per-phase timings (fetch, convert, diff, write, ...), record counts,
+#                     payload bytes and missed deadlines every this many seconds, see rabbitmq/instrumentation.py. (default=0, disabled)
+#   --profile-dir: (optional) sample the stack of each poll, and keep the profiles of the slowest polls in this directory
+#                  as folded stacks, e.g. for flamegraph.pl.
+#   --profile-top: (optional) number of slowest polls to keep profiles of. (default=5)
 #
 # outputs to stdout:
 #   timestamp, queue_name, queue_state, messages_ready, messages_unacknowledged
@@ -47,11 +78,31 @@ def main(argv):
     api_endpoint = ''
     queue_name = ''
     interval = 10
+    output_format = 'plain'
+    output = None
+    max_bytes = 0
+    backup_count = 0
+    diff_mode = 'record'
+    store_dir = None
+    deadbands = []
+    adaptive_mode = False
+    min_interval = 5
+    max_interval = 120
+    full_interval = 300
+    hot_ttl = 5
+    max_hot = 50
+    lightweight = False
+    probe = False
+    history_window = 0
+    alerts_file = None
+    stats_interval = 0
+    profile_dir = None
+    profile_top = 5
 
     # ---------------------------------------------------------
 
     try:
-        opts, args = getopt.getopt(argv,"he:u:p:q:i:",["endpoint=","username=","passwd=","queue=","interval="])
+        opts, args = getopt.getopt(argv,"he:u:p:q:i:f:o:",["endpoint=","username=","passwd=","queue=","interval=","format=","output=","max-bytes=","backup-count=","diff=","deadband=","store=","adaptive","min-interval=","max-interval=","full-interval=","hot-ttl=","max-hot=","lightweight","probe","history=","alerts=","stats-interval=","profile-dir=","profile-top="])
     except getopt.GetoptError:
         show_usage()
         sys.exit(2)
@@ -69,60 +120,233 @@ def main(argv):
             queue_name = arg
         elif opt in ("-i", "--interval"):
             interval = int(arg)
+        elif opt in ("-f", "--format"):
+            output_format = arg
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt == "--max-bytes":
+            max_bytes = int(arg)
+        elif opt == "--backup-count":
+            backup_count = int(arg)
+        elif opt == "--diff":
+            diff_mode = arg
+        elif opt == "--store":
+            store_dir = arg
+        elif opt == "--deadband":
+            deadbands.append(arg)
+        elif opt == "--adaptive":
+            adaptive_mode = True
+        elif opt == "--min-interval":
+            min_interval = float(arg)
+        elif opt == "--max-interval":
+            max_interval = float(arg)
+        elif opt == "--full-interval":
+            full_interval = float(arg)
+        elif opt == "--hot-ttl":
+            hot_ttl = int(arg)
+        elif opt == "--max-hot":
+            max_hot = int(arg)
+        elif opt == "--lightweight":
+            lightweight = True
+        elif opt == "--probe":
+            probe = True
+        elif opt == "--history":
+            history_window = int(arg)
+        elif opt == "--alerts":
+            alerts_file = arg
+        elif opt == "--stats-interval":
+            stats_interval = float(arg)
+        elif opt == "--profile-dir":
+            profile_dir = arg
+        elif opt == "--profile-top":
+            profile_top = int(arg)
 
-    # check if non-null string
-    if not api_endpoint.strip():
+    # check if non-null string. the derived fields of --history are only added to whole records.
+    if not api_endpoint.strip() or (history_window > 0 and diff_mode == "field"):
         show_usage()
         sys.exit(2)
 
-    from rabbitmq.RabbitMQ import RabbitMQ
+    import requests
+    from rabbitmq.RabbitMQ import RabbitMQ, RabbitMQError, RabbitMQUnavailable
     rbmq = RabbitMQ(api_endpoint, username, passwd)
 
-    import sys
+    from rabbitmq.sinks import make_sink
+    sink = make_sink(output_format, api_endpoint, "queue", output, max_bytes, backup_count)
+
+    # on-disk history of the changed records
+    store = None
+    if store_dir:
+        from rabbitmq.store import HistoryWriter
+        store = HistoryWriter(store_dir, "queue")
+
+    # field-level diff keyed by queue name
+    engine = None
+    if diff_mode == "field":
+        from rabbitmq.diff import DiffEngine, QUEUE_FIELDS, REMOVED, parse_deadband
+        abs_deadbands = {}
+        rel_deadbands = {}
+        for field, mode, value in map(parse_deadband, deadbands):
+            (abs_deadbands if mode == "abs" else rel_deadbands)[field] = value
+        engine = DiffEngine(QUEUE_FIELDS, abs_deadbands, rel_deadbands)
+    elif diff_mode != "record":
+        show_usage()
+        sys.exit(2)
+
     import time
     from datetime import datetime
+    from urllib.parse import quote
+
+    adaptive = None
+    hot = None
+    if adaptive_mode:
+        from rabbitmq.adaptive import AdaptiveInterval, HotSet
+        adaptive = AdaptiveInterval(min_interval, max_interval)
+        hot = HotSet(hot_ttl, max_hot)
+        interval = adaptive.interval
+    last_full = None
+    previous_totals = None
+
+    # recent samples per queue, for derived rates and time-to-drain
+    history = None
+    if history_window > 0:
+        from rabbitmq.history import QueueHistory
+        history = QueueHistory(history_window)
+
+    # alert rules, evaluated on the changed queues only
+    alerts = None
+    if alerts_file:
+        from rabbitmq.alerts import AlertEngine
+        alerts = AlertEngine.from_file(alerts_file)
+
+    # per-phase timings of each poll
+    from rabbitmq.instrumentation import PhaseStats, PollCycle, SlowCycleProfiles, timed_map
+    profiles = SlowCycleProfiles(profile_dir, profile_top) if profile_dir else None
+    cycle = PollCycle(PhaseStats(), interval, rbmq.stats, stats_interval, profiles, "queues")
+    stats = cycle.stats
 
     previous = set()
     while True:
         # timestamp of query
         now = datetime.now().astimezone().replace(microsecond=0).isoformat()
 
-        # query rabbitmq for latest queue state
-        queues_list = rbmq.get_queues(queue_name)
+        started = time.monotonic()
+        cycle.begin()
+
+        try:
+            # cheap probe of the broker-wide totals. if nothing moved, skip querying the queues.
+            # the probe totals and the time of the last full listing are only kept once the listing succeeded,
+            # so that a failed poll is not mistaken for an unchanged or fresh one at the next poll
+            probe_unchanged = False
+            totals = None
+            if probe and not queue_name:
+                with stats.phase("probe"):
+                    totals = RabbitMQ.overview_queue_totals(rbmq.get_overview(columns=RabbitMQ.OVERVIEW_TOTALS_COLUMNS))
+                probe_unchanged = totals == previous_totals and last_full is not None and started - last_full < full_interval
 
-        current = set()
-        for queue_item in queues_list:
-            # (queue_name, queue_state, messages_ready, messages_unacknowledged)
-            queue_tuple = RabbitMQ.queue_to_tuple(queue_item)
+            full_listing = False
+            if probe_unchanged:
+                current = previous
+            elif adaptive is None or queue_name or last_full is None or started - last_full >= full_interval:
+                full_listing = True
 
-            # skip queue names that start with celery as low-level
-            if queue_tuple[0].startswith("celery"):
-                continue
+                # query rabbitmq for latest queue state.
+                # only fetch the fields used by queue_to_tuple(), and let the server skip the low-level celery queues.
+                if queue_name:
+                    queues_list = rbmq.get_queues(queue_name, columns=RabbitMQ.QUEUE_TUPLE_COLUMNS, lightweight=lightweight)
+                else:
+                    queues_list = rbmq.iter_queues_paged(columns=RabbitMQ.QUEUE_TUPLE_COLUMNS, name="^(?!celery)", use_regex=True, lightweight=lightweight)
 
-            current.add(queue_tuple)
-        # end for
+                current = set()
+                # (queue_name, queue_state, messages_ready, messages_unacknowledged)
+                for queue_tuple in timed_map(RabbitMQ.queue_to_tuple, queues_list, stats, "convert", "fetch"):
+
+                    # skip queue names that start with celery as low-level
+                    if queue_tuple[0].startswith("celery"):
+                        continue
+
+                    current.add(queue_tuple)
+                # end for
+            else:
+                # between full refreshes, only query the hot queues by name and keep the last known state of the others
+                hot_names = set(hot.names())
+                current = set(t for t in previous if t[0] not in hot_names)
+                for hot_name in hot_names:
+                    try:
+                        queues_list = rbmq.get_queues(quote(hot_name, safe=''), columns=RabbitMQ.QUEUE_TUPLE_COLUMNS, lightweight=lightweight)
+                    except RabbitMQUnavailable:
+                        raise
+                    except (RabbitMQError, requests.RequestException, ValueError) as e:
+                        # e.g. the queue was deleted (http 404) or its response was cut short.
+                        # it will show up again on the next full refresh if it still exists.
+                        logger.warning("dropping hot queue {}: {}".format(hot_name, e))
+                        hot.discard(hot_name)
+                        continue
+                    current.update(timed_map(RabbitMQ.queue_to_tuple, queues_list, stats, "convert", "fetch"))
+                # end for
+        except RabbitMQUnavailable as e:
+            # e.g. the cluster nodes are restarting. keep the last known state and try again at the next poll.
+            logger.warning("skipping poll: {}".format(e))
+            cycle.end()
+            time.sleep(interval)
+            continue
         #print("current: {}".format(current))
 
-        # new that is not in old
-        new = current.difference(previous)
-        logger.debug("new: {}".format(new))
-
-        # old that is not in new
-        old = previous.difference(current)
-        logger.debug("old: {}".format(old))
-
-        # output only new changes
-        for i in new:
-            # output tokens: timestamp, queue_name, queue_state, messages_ready, messages_unacknowledged
-            # since we use the output in wrapper script to stream and convert to sdswatch,
-            # we need to ensure that it is it does not wait until default stdout buffer filled before flushing.
-            # so specifically flush after write.
-            # https://www.turnkeylinux.org/blog/unix-buffering
-            sys.stdout.write("{} {} {} {} {}\n".format(now, i[0], i[1], i[2], i[3]))
-            sys.stdout.flush()
-        # end for
+        if totals is not None:
+            previous_totals = totals
+        if full_listing:
+            last_full = started
+
+        with stats.phase("diff"):
+            # new that is not in old
+            new = current.difference(previous)
+            logger.debug("new: %s", new)
+
+            # old that is not in new
+            old = previous.difference(current)
+            logger.debug("old: %s", old)
+
+            # a changed queue is in both old and new, so only names missing from current were removed
+            removed = set()
+            if old and (store is not None or alerts is not None):
+                current_names = set(t[0] for t in current)
+                removed = set(t[0] for t in old if t[0] not in current_names)
+
+        if store is not None:
+            with stats.phase("store"):
+                store.append(time.time(), new, removed)
+
+        if alerts is not None:
+            with stats.phase("alerts"):
+                alerts.update("queue", time.time(), new, removed)
+
+        # only a full listing tells which queues were deleted
+        if history is not None:
+            with stats.phase("history"):
+                history.record(time.time(), current, prune=full_listing)
+
+        # output only new changes, as one batch per cycle
+        if engine is None:
+            if history is not None:
+                new = [history.extend_tuple(t) for t in new]
+            with stats.phase("write"):
+                sink.write_cycle(now, new)
+            changed_names = [t[0] for t in new]
+        else:
+            with stats.phase("field_diff"):
+                events = engine.update(current)
+            with stats.phase("write"):
+                sink.write_events(now, events)
+            changed_names = [e.name for e in events if e.kind != REMOVED]
+
+        # adapt the interval to the rate of change. the very first poll reports every queue, so it does not count.
+        if adaptive is not None and previous:
+            hot.update(changed_names)
+            interval = adaptive.update(len(changed_names) > 0)
+            logger.debug("next poll in %ss, hot queues: %s", interval, hot.names())
+            cycle.interval = interval
 
         previous = current
+        cycle.end()
 
         time.sleep(interval)
     # end while
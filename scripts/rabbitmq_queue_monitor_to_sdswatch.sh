@@ -45,12 +45,5 @@ if [ ! -f "${RABBITMQ_QUEUE_PY}" ]; then
     exit 1
 fi
 
-# convert output streamed to sdswatch format
-${RABBITMQ_QUEUE_PY} --endpoint="${RABBITMQ_API_ENDPOINT}" --username="${RABBITMQ_USERNAME}" --passwd="${RABBITMQ_PASSWD}" --interval="${INTERVAL}" 2> ${BASE_NAME}.stderr | while IFS= read -r LINE; do
-    # timestamp, queue_name, queue_state, messages_ready, messages_unacknowledged
-    IFS=" " read TIMESTAMP QUEUE STATE READY UNACKED <<< ${LINE}
-    echo "${TIMESTAMP} , ${RABBITMQ_API_ENDPOINT} , rabbitmq.queue , ${QUEUE} , state, ${STATE}"
-    echo "${TIMESTAMP} , ${RABBITMQ_API_ENDPOINT} , rabbitmq.queue , ${QUEUE} , ready, ${READY}"
-    echo "${TIMESTAMP} , ${RABBITMQ_API_ENDPOINT} , rabbitmq.queue , ${QUEUE} , unacked, ${UNACKED}"
-done
-
+# output directly in sdswatch format, one buffered batch per poll cycle
+${RABBITMQ_QUEUE_PY} --endpoint="${RABBITMQ_API_ENDPOINT}" --username="${RABBITMQ_USERNAME}" --passwd="${RABBITMQ_PASSWD}" --interval="${INTERVAL}" --format=sdswatch 2> ${BASE_NAME}.stderr
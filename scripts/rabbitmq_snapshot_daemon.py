@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# ---------------------------------------------------------
+# This script polls the RabbitMQ REST API once per interval and shares the latest queue and connection
+# listings with every local tool over a Unix domain socket, so the broker sees one poller no matter how
+# many monitors, wrappers and scripts run on the host.
+# The RabbitMQ client of the other scripts reads from this daemon while it is running if $RABBITMQ_SNAPSHOT_SOCKET
+# is set to its socket, and queries the management API itself otherwise. Clients can also subscribe to versioned deltas, see rabbitmq/snapshot.py.
+#
+# input arguments:
+#   --endpoint: the RabbitMQ API endpoint. e.g. "https://mozart.mycluster.hysds.io:15673" see http://e-jobs.aria.hysds.io:15672/api/
+#               for a cluster, a comma-separated list of the endpoints of each node. polls fail over between them.
+#   --username: username for rabbitmq
+#   --passwd: password for rabbitmq
+#   --socket: (optional) path of the Unix socket. (default=$RABBITMQ_SNAPSHOT_SOCKET or /tmp/rabbitmq-snapshot.sock)
+#   --interval: (optional) frequency of how often to check rabbitmq in unit seconds. (default=10)
+#   --history: (optional) number of deltas kept per resource, for subscribers resuming from an older version. (default=100)
+#   --mode: (optional) octal permissions of the socket. e.g. 660 to share it with a group. (default=600)
+#
+# example usage:
+#   export RABBITMQ_SNAPSHOT_SOCKET=/tmp/rabbitmq-snapshot.sock
+#   rabbitmq_snapshot_daemon.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --interval=10 &
+#   rabbitmq_queue_monitor.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest --interval=10
+#
+# ---------------------------------------------------------
+
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s.%(funcName)s +%(lineno)s: %(levelname)-8s [%(process)d] %(message)s')
+
+
+# ---------------------------------------------------------
+
+def show_usage():
+    print('Usage:\n')
+    print('rabbitmq_snapshot_daemon.py --endpoint="https://mozart.mycluster.hysds.io:15673" --username=guest --passwd=guest [--socket=/tmp/rabbitmq-snapshot.sock] [--interval=10] \n' )
+
+
+import sys, getopt
+
+def main(argv):
+
+    # ---------------------------------------------------------
+    # initialize constants
+
+    # rabbitmq credentials
+    username = ''
+    passwd = ''
+
+    api_endpoint = ''
+    socket_path = None
+    interval = 10.0
+    history = 100
+    mode = 0o600
+
+    # ---------------------------------------------------------
+
+    try:
+        opts, args = getopt.getopt(argv,"he:u:p:s:i:",["endpoint=","username=","passwd=","socket=","interval=","history=","mode="])
+    except getopt.GetoptError:
+        show_usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            show_usage()
+            sys.exit()
+        elif opt in ("-e", "--endpoint"):
+            api_endpoint = arg
+        elif opt in ("-u", "--username"):
+            username = arg
+        elif opt in ("-p", "--passwd"):
+            passwd = arg
+        elif opt in ("-s", "--socket"):
+            socket_path = arg
+        elif opt in ("-i", "--interval"):
+            interval = float(arg)
+        elif opt == "--history":
+            history = int(arg)
+        elif opt == "--mode":
+            mode = int(arg, 8)
+
+    # check if non-null string
+    if not api_endpoint.strip():
+        show_usage()
+        sys.exit(2)
+
+    import signal
+    from rabbitmq.RabbitMQ import RabbitMQ
+    from rabbitmq.snapshot import SnapshotDaemon
+
+    # remove the socket on kill as well as on ctrl-c
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # the daemon itself must always query the management API
+    rbmq = RabbitMQ(api_endpoint, username, passwd, snapshot_socket=False)
+    daemon = SnapshotDaemon(rbmq, socket_path, interval, history=history, mode=mode)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        rbmq.close()
+# end main
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
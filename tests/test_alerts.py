@@ -0,0 +1,66 @@
+import unittest
+
+from rabbitmq.alerts import AlertEngine, AlertRule, FIRING, RESOLVED
+
+
+class ListSink:
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, alerts):
+        self.sent.extend(alerts)
+
+
+class RateRuleTest(unittest.TestCase):
+
+    def test_jump_after_quiet_period(self):
+        rule = AlertRule("backlog_growing", "queue", "rate", field="messages_ready", op=">", value=5, window=300)
+        engine = AlertEngine([rule])
+        engine.update("queue", 0.0, [("jobs", "running", 0, 0)])
+        # unchanged for an hour, so no sample is recorded
+        for now in range(10, 3600, 10):
+            engine.update("queue", float(now), [])
+        # end for
+        alerts = engine.update("queue", 3630.0, [("jobs", "running", 10000, 0)])
+        self.assertEqual([(a.rule, a.name, a.status) for a in alerts], [("backlog_growing", "jobs", FIRING)])
+        # 10000 messages over the 300s window, not over the hour since the previous sample
+        self.assertAlmostEqual(alerts[0].value, 10000 / 300.0)
+
+
+class RateLimitTest(unittest.TestCase):
+
+    def _engine(self, max_per_minute):
+        self.sink = ListSink()
+        rule = AlertRule("backlog", "queue", "threshold", field="messages_ready", op=">", value=100)
+        return AlertEngine([rule], [self.sink], repeat_interval=30.0, max_per_minute=max_per_minute)
+
+    def _sent(self, status):
+        return sorted(a.name for a in self.sink.sent if a.status == status)
+
+    def test_suppressed_resolve_is_sent_later(self):
+        engine = self._engine(2)
+        engine.update("queue", 0.0, [("a", "running", 500, 0), ("b", "running", 500, 0)])
+        self.assertEqual(self._sent(FIRING), ["a", "b"])
+        engine.update("queue", 10.0, [("a", "running", 0, 0), ("b", "running", 0, 0)])
+        self.assertEqual(self._sent(RESOLVED), [])
+        self.assertEqual(engine.suppressed, 2)
+        engine.update("queue", 61.0, [])
+        self.assertEqual(self._sent(RESOLVED), ["a", "b"])
+
+    def test_suppressed_repeat_keeps_the_resolve(self):
+        engine = self._engine(1)
+        engine.update("queue", 0.0, [("a", "running", 500, 0)])
+        engine.update("queue", 20.0, [("b", "running", 500, 0)])
+        # the repeat of a and the first notification of b are both over the limit
+        engine.update("queue", 30.0, [])
+        self.assertEqual(self._sent(FIRING), ["a"])
+        self.assertEqual(engine.firing(), [("backlog", "a")])
+        engine.update("queue", 40.0, [("a", "running", 0, 0), ("b", "running", 0, 0)])
+        engine.update("queue", 100.0, [])
+        # a was notified, so its resolve is sent. b never was, so it has nothing to resolve.
+        self.assertEqual(self._sent(RESOLVED), ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from unittest import mock
+
+from rabbitmq.RabbitMQ import RabbitMQ
+
+
+class MoveMessagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rbmq = RabbitMQ("http://127.0.0.1:1", "guest", "guest", snapshot_socket=False)
+        self.queue = [{"payload": "job {}".format(i), "properties": {}} for i in range(5)]
+        patches = [
+            mock.patch.object(self.rbmq, "_get"),
+            mock.patch.object(self.rbmq, "_decode", return_value={"messages_ready": len(self.queue)}),
+            mock.patch.object(self.rbmq, "get_messages", side_effect=self._get_messages),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        # end for
+        self.addCleanup(self.rbmq.close)
+
+    def _get_messages(self, queue_name, count=1, requeue=True, vhost='/'):
+        batch = self.queue[:count]
+        del self.queue[:count]
+        return batch
+
+    def test_unexpected_publish_error_is_lost_not_raised(self):
+        # e.g. a proxy answering with a non-json 200
+        with mock.patch.object(self.rbmq, "publish_message", side_effect=ValueError("Expecting value")):
+            stats = self.rbmq.move_messages("jobs_failed", routing_key="jobs", batch_size=2)
+        self.assertEqual(stats.failed, 5)
+        self.assertEqual([m["payload"] for m in stats.lost], ["job {}".format(i) for i in range(5)])
+
+    def test_removed_batch_is_kept_when_the_move_raises(self):
+        def predicate(message):
+            if message["payload"] == "job 3":
+                raise KeyboardInterrupt()
+            return True
+
+        lost = []
+        with mock.patch.object(self.rbmq, "publish_message", return_value=True):
+            with self.assertRaises(KeyboardInterrupt):
+                self.rbmq.move_messages("jobs_failed", routing_key="jobs", predicate=predicate, batch_size=2, lost=lost)
+        # the first batch was moved, the second was removed from the queue but not gone through
+        self.assertEqual([m["payload"] for m in lost], ["job 2", "job 3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import time
+import asyncio
+import unittest
+from unittest import mock
+
+import rabbitmq.RabbitMQ as rabbitmq_module
+from rabbitmq.RabbitMQ import RabbitMQ, RabbitMQUnavailable
+from rabbitmq.AsyncRabbitMQ import AsyncRabbitMQ
+from rabbitmq.resilience import Deadline, CircuitBreaker
+
+
+class FakeClock:
+    """
+    a clock that moves forward by step seconds every time it is read.
+    """
+
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+# nothing listens on port 1, so connections are refused right away
+UNREACHABLE = ["http://127.0.0.1:1", "http://127.0.0.1:1/"]
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def test_bound_minimum(self):
+        clock = FakeClock(1.0)
+        deadline = Deadline(1.0, clock=clock)
+        clock.now += 5
+        self.assertTrue(deadline.expired)
+        self.assertEqual(deadline.bound(30.0), 0.0)
+        self.assertEqual(deadline.bound(30.0, 0.01), 0.01)
+        self.assertEqual(deadline.bound(None, 0.01), 0.01)
+        self.assertIsNone(Deadline(None).bound(None, 0.01))
+
+    def _client(self, **kwargs):
+        return RabbitMQ(UNREACHABLE, "guest", "guest", snapshot_socket=False, failure_threshold=1000, **kwargs)
+
+    def _get_with_clock(self, rbmq, step):
+        clock = FakeClock(step)
+        with mock.patch.object(rabbitmq_module, "Deadline", lambda seconds: Deadline(seconds, clock=clock)), \
+                mock.patch.object(rabbitmq_module.time, "sleep"):
+            return rbmq.get_overview()
+
+    def test_deadline_expires_mid_retry(self):
+        # whichever clock read the deadline expires at, the call gives up with RabbitMQUnavailable,
+        # never with requests' ValueError for a zero timeout
+        for step in (0.1, 0.25, 0.5, 1.0, 2.0, 3.0):
+            rbmq = self._client(deadline=3.0, max_retries=10, backoff_factor=1.0)
+            with self.subTest(step=step):
+                with self.assertRaises(RabbitMQUnavailable):
+                    self._get_with_clock(rbmq, step)
+            rbmq.close()
+
+    def test_deadline_expires_mid_retry_hedged(self):
+        for step in (0.1, 0.5, 1.0, 3.0):
+            rbmq = self._client(deadline=3.0, max_retries=10, backoff_factor=1.0, hedge_delay=0.5)
+            with self.subTest(step=step):
+                with self.assertRaises(RabbitMQUnavailable):
+                    self._get_with_clock(rbmq, step)
+            rbmq.close()
+
+    def test_expired_deadline_is_not_an_endpoint_failure(self):
+        rbmq = self._client()
+        clock = FakeClock(1.0)
+        deadline = Deadline(1.0, clock=clock)
+        clock.now += 5
+        with self.assertRaises(RabbitMQUnavailable):
+            rbmq._attempt(0, "/api/overview", None, False, deadline)
+        self.assertEqual(rbmq.get_endpoint_states()[rbmq._endpoints[0]], CircuitBreaker.CLOSED)
+        rbmq.close()
+
+    def test_expired_deadline_gives_back_the_half_open_trial(self):
+        rbmq = self._client()
+        breaker_clock = FakeClock(0.0)
+        breaker = rbmq._breakers[0] = CircuitBreaker(failure_threshold=1, reset_timeout=30.0, clock=breaker_clock)
+        breaker.record_failure()
+        breaker_clock.now += 31
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        clock = FakeClock(1.0)
+        deadline = Deadline(1.0, clock=clock)
+        clock.now += 5
+        with self.assertRaises(RabbitMQUnavailable):
+            rbmq._attempt(0, "/api/overview", None, False, deadline)
+        # the trial never reached the endpoint, so the next request gets it
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        rbmq.close()
+
+
+class AsyncRabbitMQTest(unittest.TestCase):
+
+    def test_abandoned_call_stops_retrying_at_the_timeout(self):
+        client = AsyncRabbitMQ(UNREACHABLE, "guest", "guest", timeout=0.5, snapshot_socket=False,
+                               failure_threshold=1000, max_retries=100000, backoff_factor=0.01, backoff_max=0.01)
+
+        async def call():
+            # whichever gives up first
+            with self.assertRaises((asyncio.TimeoutError, RabbitMQUnavailable)):
+                await client.get_queues()
+
+        asyncio.run(call())
+        # the worker thread gives up at the deadline too, so the next call gets a free worker
+        started = time.monotonic()
+        client._executor.shutdown(wait=True)
+        self.assertLess(time.monotonic() - started, 2.0)
+        client.close()
+
+    def test_deadline_can_be_overridden(self):
+        client = AsyncRabbitMQ(UNREACHABLE, "guest", "guest", timeout=5.0, deadline=3.0, snapshot_socket=False)
+        self.assertEqual(client.client._deadline, 3.0)
+        client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+
+from rabbitmq.RabbitMQ import RabbitMQ
+from rabbitmq.records import SNAPSHOT_QUEUE_COLUMNS, SNAPSHOT_CONNECTION_COLUMNS
+from rabbitmq.snapshot import SnapshotDaemon, SnapshotClient, covers
+from rabbitmq.exporter import QUEUE_METRIC_COLUMNS, CONNECTION_METRIC_COLUMNS
+from rabbitmq.correlation import QUEUE_INDEX_COLUMNS, CONNECTION_INDEX_COLUMNS
+from rabbitmq.autoscale import ADVISOR_COLUMNS
+from rabbitmq.aggregate import AGGREGATE_COLUMNS
+
+
+class FakeRabbitMQ:
+    """
+    the parts of RabbitMQ the daemon polls with.
+    """
+
+    snapshot = None
+
+    def __init__(self, endpoint, queues):
+        self.endpoints = [endpoint]
+        self._queues = queues
+
+    def iter_queues_paged(self, columns=None, lightweight=False):
+        return iter(self._queues)
+
+
+class SnapshotColumnsTest(unittest.TestCase):
+
+    def test_daemon_polls_every_column_set(self):
+        for columns in (RabbitMQ.QUEUE_TUPLE_COLUMNS, QUEUE_METRIC_COLUMNS, QUEUE_INDEX_COLUMNS, ADVISOR_COLUMNS):
+            self.assertTrue(covers(SNAPSHOT_QUEUE_COLUMNS, columns), columns)
+        for columns in (RabbitMQ.CONNECTION_TUPLE_COLUMNS, CONNECTION_METRIC_COLUMNS, CONNECTION_INDEX_COLUMNS, AGGREGATE_COLUMNS):
+            self.assertTrue(covers(SNAPSHOT_CONNECTION_COLUMNS, columns), columns)
+
+    def test_snapshot_does_not_import_the_tools(self):
+        code = "import sys, rabbitmq.snapshot; print(sorted(m for m in sys.modules if m.startswith('rabbitmq.')))"
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        loaded = subprocess.check_output([sys.executable, "-c", code], cwd=root, universal_newlines=True)
+        for module in ("exporter", "autoscale", "aggregate", "correlation"):
+            self.assertNotIn("rabbitmq.{}'".format(module), loaded)
+
+
+class SnapshotOptInTest(unittest.TestCase):
+
+    def test_disabled_by_default(self):
+        with mock.patch.dict(os.environ, {}, clear=False):
+            os.environ.pop("RABBITMQ_SNAPSHOT_SOCKET", None)
+            self.assertIsNone(RabbitMQ("http://127.0.0.1:1", "guest", "guest").snapshot)
+            self.assertIsNotNone(RabbitMQ("http://127.0.0.1:1", "guest", "guest", snapshot_socket=True).snapshot)
+
+    def test_enabled_by_env(self):
+        with mock.patch.dict(os.environ, {"RABBITMQ_SNAPSHOT_SOCKET": "/tmp/test-snapshot.sock"}):
+            rbmq = RabbitMQ("http://127.0.0.1:1", "guest", "guest")
+            self.assertEqual(rbmq.snapshot.socket_path, "/tmp/test-snapshot.sock")
+            self.assertIsNone(RabbitMQ("http://127.0.0.1:1", "guest", "guest", snapshot_socket=False).snapshot)
+
+
+class SnapshotClientInfoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, "snapshot.sock")
+        self.daemons = []
+
+    def tearDown(self):
+        for daemon in self.daemons:
+            daemon.stop()
+        shutil.rmtree(self.directory)
+
+    def _serve(self, endpoint, socket_path=None):
+        daemon = SnapshotDaemon(FakeRabbitMQ(endpoint, [{"name": "jobs", "state": "running"}]),
+                                socket_path=socket_path or self.socket_path, connection_columns=())
+        daemon.start()
+        daemon.poll()
+        self.daemons.append(daemon)
+        return daemon
+
+    def test_socket_taken_over_by_another_cluster(self):
+        client = SnapshotClient(self.socket_path, ["http://a:15672"], info_ttl=0, retry_interval=0)
+        self._serve("http://a:15672")
+        self.assertEqual(client.select("queues", columns=("name",)), [{"name": "jobs"}])
+        # the first daemon keeps serving the connection it already accepted
+        other = self._serve("http://b:15672", os.path.join(self.directory, "other.sock"))
+        os.replace(other.socket_path, self.socket_path)
+        other.socket_path = self.socket_path
+        self.assertIsNone(client.select("queues", columns=("name",)))
+        client.close()
+
+    def test_info_kept_for_its_ttl(self):
+        client = SnapshotClient(self.socket_path, ["http://a:15672"], info_ttl=3600, retry_interval=0)
+        self._serve("http://a:15672")
+        self.assertTrue(client.available())
+        with mock.patch.object(client, "_call", side_effect=AssertionError("info fetched again")):
+            self.assertTrue(client.available())
+        client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()